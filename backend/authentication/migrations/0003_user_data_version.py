@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_user_spotify_access_token_user_spotify_refresh_token_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -11,6 +11,8 @@ class User(AbstractUser):
     spotify_access_token = models.TextField(blank=True, null=True)
     spotify_refresh_token = models.TextField(blank=True, null=True)
     spotify_token_expires_at = models.DateTimeField(blank=True, null=True)
+    # Bumped whenever the user's streaming data changes - part of statistics cache keys
+    data_version = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -0,0 +1,152 @@
+import time
+import base64
+import logging
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 5xx responses worth retrying. POST requests (playlist creation, adding
+# tracks) are not idempotent, so they are only retried on gateway errors,
+# where Spotify did not process the request.
+RETRY_STATUSES = {500, 502, 503, 504}
+RETRY_STATUSES_UNSAFE = {502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+_local = threading.local()
+
+
+def get_session():
+    """
+    Return the thread's pooled HTTP session - connections (and their TLS
+    handshakes) are reused across requests to Spotify
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=settings.SPOTIFY_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+    return session
+
+
+def _retry_after(response):
+    # Retry-After holds either seconds or an HTTP date
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SpotifyClient:
+    """
+    Spotify Web API client with timeouts and retries. 429 responses are
+    retried after the Retry-After delay, 5xx responses and connection errors
+    with exponential backoff. Responses are returned as they are, so callers
+    check the status code as with plain requests.
+    """
+    def __init__(self, access_token=None, session=None):
+        self.access_token = access_token
+        self.session = session or get_session()
+
+    def api_url(self, path):
+        return f'{settings.SPOTIFY_API_URL.rstrip("/")}/{path.lstrip("/")}'
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        if not url.startswith(('http://', 'https://')):
+            url = self.api_url(url)
+        headers = kwargs.pop('headers', None) or {}
+        if self.access_token and 'Authorization' not in headers:
+            headers['Authorization'] = f'Bearer {self.access_token}'
+        kwargs.setdefault('timeout', settings.SPOTIFY_TIMEOUT)
+
+        idempotent = method in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else RETRY_STATUSES_UNSAFE
+        max_retries = settings.SPOTIFY_MAX_RETRIES
+
+        for attempt in range(max_retries + 1):
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt == max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code == 429:
+                    delay = _retry_after(response)
+                    if delay is None:
+                        delay = self.backoff(attempt)
+                    elif delay > settings.SPOTIFY_MAX_RETRY_AFTER:
+                        return response  # Rate limited for too long to wait in a request
+                elif response.status_code in retry_statuses:
+                    delay = self.backoff(attempt)
+                else:
+                    return response
+                if attempt == max_retries:
+                    return response
+
+            logger.info('Retrying Spotify %s %s in %.1fs (attempt %d)', method, url, delay, attempt + 1)
+            time.sleep(delay)
+
+    def backoff(self, attempt):
+        return min(settings.SPOTIFY_RETRY_BACKOFF * 2 ** attempt, settings.SPOTIFY_MAX_RETRY_AFTER)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def request_token(self, data):
+        """
+        POST to the accounts service token endpoint with the app credentials
+        """
+        credentials = f'{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}'
+        headers = {
+            'Authorization': f'Basic {base64.b64encode(credentials.encode()).decode()}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        return self.post(f'{settings.SPOTIFY_ACCOUNTS_URL.rstrip("/")}/api/token', headers=headers, data=data)
+
+    def exchange_code(self, code):
+        """
+        Exchange an authorization code for tokens
+        """
+        return self.request_token({
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': settings.SPOTIFY_REDIRECT_URI,
+        })
+
+    def refresh_token(self, refresh_token):
+        """
+        Get a new access token for a refresh token
+        """
+        return self.request_token({
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+        })
+
+    def get_profile(self):
+        """
+        Get the profile of the token's Spotify user
+        """
+        return self.get('me')
@@ -0,0 +1,150 @@
+import time
+import logging
+import requests
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import User
+from .spotify_client import SpotifyClient
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds between checks while another request refreshes the token
+REFRESH_WAIT_INTERVAL = 0.1
+
+
+def token_cache_key(user_id):
+    return f'spotify:token:{user_id}'
+
+
+def refresh_lock_key(user_id):
+    return f'spotify:token-refresh:{user_id}'
+
+
+def _cache_token(user_id, access_token, expires_at):
+    # Cached until the token is due for refresh
+    timeout = (expires_at - timezone.now()).total_seconds() - settings.SPOTIFY_TOKEN_REFRESH_MARGIN
+    if timeout > 0:
+        cache.set(token_cache_key(user_id), access_token, timeout)
+
+
+def store_user_tokens(user, token_data):
+    """
+    Save tokens returned by the Spotify token endpoint on the user and
+    cache the access token. A refresh response may omit the refresh token,
+    the stored one then stays valid.
+    """
+    user.spotify_access_token = token_data['access_token']
+    if token_data.get('refresh_token'):
+        user.spotify_refresh_token = token_data['refresh_token']
+    user.spotify_token_expires_at = timezone.now() + timedelta(seconds=token_data.get('expires_in', 3600))
+    user.save(update_fields=[
+        'spotify_user_id', 'spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'
+    ])
+    _cache_token(user.pk, user.spotify_access_token, user.spotify_token_expires_at)
+
+
+def forget_user_tokens(user):
+    """
+    Drop the cached access token, e.g. after disconnecting Spotify
+    """
+    cache.delete(token_cache_key(user.pk))
+
+
+def _is_fresh(user):
+    if not user.spotify_access_token or not user.spotify_token_expires_at:
+        return False
+    margin = timedelta(seconds=settings.SPOTIFY_TOKEN_REFRESH_MARGIN)
+    return user.spotify_token_expires_at - margin > timezone.now()
+
+
+def _unexpired_token(user):
+    # A token inside the refresh margin is still usable when the refresh fails
+    if user.spotify_access_token and user.spotify_token_expires_at and user.spotify_token_expires_at > timezone.now():
+        return user.spotify_access_token
+    return None
+
+
+def _refresh_lock_timeout():
+    # Longest a refresh can take: every attempt timing out, plus the backoff between them
+    attempts = settings.SPOTIFY_MAX_RETRIES + 1
+    return int(attempts * (settings.SPOTIFY_TIMEOUT + settings.SPOTIFY_MAX_RETRY_AFTER)) + 1
+
+
+def _wait_for_refresh(user):
+    # Another request is refreshing the token - wait for it to finish
+    lock_key = refresh_lock_key(user.pk)
+    deadline = time.monotonic() + _refresh_lock_timeout()
+    while time.monotonic() < deadline:
+        access_token = cache.get(token_cache_key(user.pk))
+        if access_token or cache.get(lock_key) is None:
+            break
+        time.sleep(REFRESH_WAIT_INTERVAL)
+    user.refresh_from_db(fields=['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'])
+    if _is_fresh(user):
+        return user.spotify_access_token
+    return _unexpired_token(user)
+
+
+def _refresh(user):
+    # Call the token endpoint without holding any database lock
+    try:
+        response = SpotifyClient().refresh_token(user.spotify_refresh_token)
+    except requests.RequestException as e:
+        logger.warning('Refreshing the Spotify token of user %s failed: %s', user.pk, e)
+        return _unexpired_token(user)
+    if response.status_code != 200:
+        logger.warning('Refreshing the Spotify token of user %s failed with %s', user.pk, response.status_code)
+        return _unexpired_token(user)
+    token_data = response.json()
+
+    # Only the final write locks the row, and it is skipped when the user
+    # disconnected Spotify in the meantime
+    with transaction.atomic():
+        locked = User.objects.select_for_update().get(pk=user.pk)
+        if locked.spotify_refresh_token != user.spotify_refresh_token:
+            return _unexpired_token(locked)
+        store_user_tokens(locked, token_data)
+    return locked.spotify_access_token
+
+
+def get_access_token(user):
+    """
+    Return a valid Spotify access token of the user, refreshing it ahead of
+    expiry. Returns None when Spotify is not connected or the refresh token
+    was revoked - the user has to connect again.
+
+    The token is cached until it is due for refresh. Refreshes of one user
+    are serialized with a lock in the cache (shared by all processes when
+    the cache is), so concurrent requests wait for a single call to the
+    token endpoint and then use its result. The user row is only locked
+    for the final write of the new token.
+    """
+    access_token = cache.get(token_cache_key(user.pk))
+    if access_token:
+        return access_token
+
+    if _is_fresh(user):
+        _cache_token(user.pk, user.spotify_access_token, user.spotify_token_expires_at)
+        return user.spotify_access_token
+
+    lock_key = refresh_lock_key(user.pk)
+    if not cache.add(lock_key, True, _refresh_lock_timeout()):
+        return _wait_for_refresh(user)
+    try:
+        # Another request may have refreshed the token before we took the lock
+        user.refresh_from_db(fields=['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'])
+        if _is_fresh(user):
+            _cache_token(user.pk, user.spotify_access_token, user.spotify_token_expires_at)
+            return user.spotify_access_token
+        if not user.spotify_refresh_token:
+            return None
+        access_token = _refresh(user)
+    finally:
+        cache.delete(lock_key)
+
+    user.refresh_from_db(fields=['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'])
+    return access_token
@@ -1,13 +1,14 @@
 import requests
-import base64
-from datetime import datetime, timedelta
 from urllib.parse import urlencode
 from django.conf import settings
 from django.shortcuts import redirect
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from .spotify_client import SpotifyClient
+from .spotify_tokens import store_user_tokens, forget_user_tokens
 
 
 @api_view(['GET'])
@@ -34,7 +35,7 @@ def spotify_auth_url(request):
         'show_dialog': 'true'
     }
     
-    auth_url = f"https://accounts.spotify.com/authorize?{urlencode(params)}"
+    auth_url = f"{settings.SPOTIFY_ACCOUNTS_URL.rstrip('/')}/authorize?{urlencode(params)}"
     
     return Response({'auth_url': auth_url})
 
@@ -68,40 +69,17 @@ def spotify_callback(request):
         return redirect('http://127.0.0.1/top-tracks?error=invalid_state')
     
     # Exchange code for access token
-    token_url = 'https://accounts.spotify.com/api/token'
-    
-    credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
-    b64_credentials = base64.b64encode(credentials.encode()).decode()
-    
-    headers = {
-        'Authorization': f'Basic {b64_credentials}',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    
-    data = {
-        'grant_type': 'authorization_code',
-        'code': code,
-        'redirect_uri': settings.SPOTIFY_REDIRECT_URI
-    }
-    
     try:
-        response = requests.post(token_url, headers=headers, data=data)
+        response = SpotifyClient().exchange_code(code)
         
         if response.status_code != 200:
             return redirect(f'http://127.0.0.1/{redirect_to}?error=token_exchange_failed')
         
         token_data = response.json()
         access_token = token_data.get('access_token')
-        refresh_token = token_data.get('refresh_token')
-        expires_in = token_data.get('expires_in', 3600)
         
         # Get user profile to find Spotify user ID
-        profile_url = 'https://api.spotify.com/v1/me'
-        profile_headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        profile_response = requests.get(profile_url, headers=profile_headers)
+        profile_response = SpotifyClient(access_token).get_profile()
         
         if profile_response.status_code != 200:
             return redirect(f'http://127.0.0.1/{redirect_to}?error=profile_fetch_failed')
@@ -114,10 +92,7 @@ def spotify_callback(request):
         try:
             user = User.objects.get(id=int(user_id))
             user.spotify_user_id = spotify_user_id
-            user.spotify_access_token = access_token
-            user.spotify_refresh_token = refresh_token
-            user.spotify_token_expires_at = datetime.now() + timedelta(seconds=expires_in)
-            user.save()
+            store_user_tokens(user, token_data)
         except (User.DoesNotExist, ValueError, TypeError):
             return redirect(f'http://127.0.0.1/{redirect_to}?error=user_not_found')
         
@@ -145,82 +120,8 @@ def exchange_spotify_code(request):
         )
     
     # Exchange code for access token
-    token_url = 'https://accounts.spotify.com/api/token'
-    
-    credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
-    b64_credentials = base64.b64encode(credentials.encode()).decode()
-    
-    headers = {
-        'Authorization': f'Basic {b64_credentials}',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    
-    data = {
-        'grant_type': 'authorization_code',
-        'code': code,
-        'redirect_uri': settings.SPOTIFY_REDIRECT_URI
-    }
-    
-    response = requests.post(token_url, headers=headers, data=data)
-    
-    if response.status_code != 200:
-        return redirect(f'http://localhost:5173/top-tracks?error=token_exchange_failed')
-    
-    token_data = response.json()
-    access_token = token_data.get('access_token')
-    refresh_token = token_data.get('refresh_token')
-    expires_in = token_data.get('expires_in', 3600)
-    
-    # Get user profile to find Spotify user ID
-    profile_url = 'https://api.spotify.com/v1/me'
-    profile_headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
-    
-    profile_response = requests.get(profile_url, headers=profile_headers)
-    
-    if profile_response.status_code != 200:
-        return redirect('http://localhost:5173/top-tracks?error=profile_fetch_failed')
-    
-    profile_data = profile_response.json()
-    spotify_user_id = profile_data.get('id')
-    
-    # Get user from state parameter (user_id)
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def exchange_spotify_code(request):
-    """
-    Exchange authorization code for access token
-    Frontend sends the code here after receiving it from Spotify
-    """
-    import json
-    code = request.data.get('code')
-    
-    if not code:
-        return Response(
-            {'error': 'Authorization code is required'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    # Exchange code for access token
-    token_url = 'https://accounts.spotify.com/api/token'
-    
-    credentials = f"{settings.SPOTIFY_CLIENT_ID}:{settings.SPOTIFY_CLIENT_SECRET}"
-    b64_credentials = base64.b64encode(credentials.encode()).decode()
-    
-    headers = {
-        'Authorization': f'Basic {b64_credentials}',
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-    
-    data = {
-        'grant_type': 'authorization_code',
-        'code': code,
-        'redirect_uri': settings.SPOTIFY_REDIRECT_URI
-    }
-    
     try:
-        response = requests.post(token_url, headers=headers, data=data)
+        response = SpotifyClient().exchange_code(code)
         
         if response.status_code != 200:
             return Response(
@@ -230,16 +131,9 @@ def exchange_spotify_code(request):
         
         token_data = response.json()
         access_token = token_data.get('access_token')
-        refresh_token = token_data.get('refresh_token')
-        expires_in = token_data.get('expires_in', 3600)
         
         # Get user profile to find Spotify user ID
-        profile_url = 'https://api.spotify.com/v1/me'
-        profile_headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        profile_response = requests.get(profile_url, headers=profile_headers)
+        profile_response = SpotifyClient(access_token).get_profile()
         
         if profile_response.status_code != 200:
             return Response(
@@ -253,10 +147,7 @@ def exchange_spotify_code(request):
         # Save tokens to user model
         user = request.user
         user.spotify_user_id = spotify_user_id
-        user.spotify_access_token = access_token
-        user.spotify_refresh_token = refresh_token
-        user.spotify_token_expires_at = datetime.now() + timedelta(seconds=expires_in)
-        user.save()
+        store_user_tokens(user, token_data)
         
         return Response({
             'success': True,
@@ -281,7 +172,9 @@ def spotify_connection_status(request):
     if not user.spotify_access_token or not user.spotify_token_expires_at:
         return Response({'connected': False})
     
-    is_expired = datetime.now() >= user.spotify_token_expires_at.replace(tzinfo=None)
+    # Read from the stored expiry, without calling Spotify: an expired token
+    # is refreshed on its next use as long as there is a refresh token
+    is_expired = user.spotify_token_expires_at <= timezone.now() and not user.spotify_refresh_token
     
     return Response({
         'connected': True,
@@ -302,5 +195,6 @@ def disconnect_spotify(request):
     user.spotify_user_id = None
     user.spotify_token_expires_at = None
     user.save()
+    forget_user_tokens(user)
     
     return Response({'status': 'disconnected'})
@@ -0,0 +1,219 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import User
+from .spotify_client import SpotifyClient
+from .spotify_tokens import get_access_token, token_cache_key
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers each request with the next scripted (status, headers, body)
+    response and records (method, path, body) of the requests
+    """
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode()
+        self.server.requests.append((self.command, self.path, body))
+        status, headers, data = self.server.responses.pop(0)
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SpotifyStubTestCase(TestCase):
+    """
+    Runs a local HTTP server in place of the Spotify API and accounts service
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.requests = []
+        cls.server.responses = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.stub_settings = override_settings(
+            SPOTIFY_API_URL=f'{url}/v1',
+            SPOTIFY_ACCOUNTS_URL=url,
+            SPOTIFY_MAX_RETRIES=3,
+            SPOTIFY_RETRY_BACKOFF=0.5,
+            SPOTIFY_MAX_RETRY_AFTER=30,
+        )
+        cls.stub_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.responses.clear()
+        # Retry delays are recorded instead of slept
+        patcher = mock.patch('authentication.spotify_client.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def respond(self, *responses):
+        self.server.responses.extend(
+            response if len(response) == 3 else (response[0], {}, response[1]) for response in responses
+        )
+
+    def delays(self):
+        return [call.args[0] for call in self.sleep.call_args_list]
+
+
+class SpotifyClientTests(SpotifyStubTestCase):
+    def test_rate_limited_request_waits_for_retry_after(self):
+        self.respond((429, {'Retry-After': '2'}, {}), (200, {'id': 'me'}))
+
+        response = SpotifyClient('token').get('me')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id': 'me'})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.delays(), [2.0])
+
+    def test_rate_limit_longer_than_max_retry_after_is_returned(self):
+        self.respond((429, {'Retry-After': '120'}, {}))
+
+        response = SpotifyClient('token').get('me')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.delays(), [])
+
+    def test_server_errors_are_retried_with_exponential_backoff(self):
+        self.respond((500, {}), (502, {}), (503, {}), (200, {'id': 'me'}))
+
+        response = SpotifyClient('token').get('me')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.delays(), [0.5, 1.0, 2.0])
+
+    def test_last_server_error_is_returned_after_max_retries(self):
+        self.respond(*[(503, {})] * 4)
+
+        response = SpotifyClient('token').get('me')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_post_is_not_retried_on_internal_server_error(self):
+        self.respond((500, {}))
+
+        response = SpotifyClient('token').post('users/me/playlists', json={'name': 'Mix'})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.delays(), [])
+
+    def test_post_is_retried_on_gateway_error(self):
+        self.respond((503, {}), (201, {'id': 'playlist'}))
+
+        response = SpotifyClient('token').post('users/me/playlists', json={'name': 'Mix'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([method for method, path, body in self.server.requests], ['POST', 'POST'])
+
+    def test_client_errors_are_not_retried(self):
+        self.respond((404, {'error': 'not found'}))
+
+        response = SpotifyClient('token').get('tracks/unknown')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class AccessTokenTests(SpotifyStubTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(
+            username='listener',
+            email='listener@example.com',
+            spotify_access_token='old-token',
+            spotify_refresh_token='refresh-token',
+            spotify_token_expires_at=timezone.now() - timedelta(minutes=1),
+        )
+
+    def test_expired_token_is_refreshed_once(self):
+        self.respond((200, {'access_token': 'new-token', 'expires_in': 3600}))
+
+        self.assertEqual(get_access_token(self.user), 'new-token')
+        self.assertEqual(get_access_token(self.user), 'new-token')
+
+        self.assertEqual(len(self.server.requests), 1)
+        method, path, body = self.server.requests[0]
+        self.assertEqual((method, path), ('POST', '/api/token'))
+        self.assertIn('grant_type=refresh_token', body)
+        self.assertIn('refresh_token=refresh-token', body)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.spotify_access_token, 'new-token')
+        # The refresh response has no refresh token, the stored one stays valid
+        self.assertEqual(self.user.spotify_refresh_token, 'refresh-token')
+        self.assertGreater(self.user.spotify_token_expires_at, timezone.now() + timedelta(minutes=59))
+        self.assertEqual(cache.get(token_cache_key(self.user.pk)), 'new-token')
+
+    def test_refresh_token_is_replaced_when_rotated(self):
+        self.respond((200, {'access_token': 'new-token', 'refresh_token': 'rotated', 'expires_in': 3600}))
+
+        get_access_token(self.user)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.spotify_refresh_token, 'rotated')
+
+    def test_revoked_refresh_token_returns_none(self):
+        self.respond((400, {'error': 'invalid_grant'}))
+
+        with self.assertLogs('authentication.spotify_tokens', 'WARNING'):
+            self.assertIsNone(get_access_token(self.user))
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.spotify_access_token, 'old-token')
+
+    def test_token_inside_refresh_margin_is_used_when_refresh_fails(self):
+        self.user.spotify_token_expires_at = timezone.now() + timedelta(minutes=2)
+        self.user.save()
+        self.respond((400, {'error': 'invalid_grant'}))
+
+        with self.assertLogs('authentication.spotify_tokens', 'WARNING'):
+            self.assertEqual(get_access_token(self.user), 'old-token')
+
+    def test_fresh_token_is_not_refreshed(self):
+        self.user.spotify_token_expires_at = timezone.now() + timedelta(hours=1)
+        self.user.save()
+
+        self.assertEqual(get_access_token(self.user), 'old-token')
+        self.assertEqual(self.server.requests, [])
+
+    def test_user_without_refresh_token_is_not_connected(self):
+        self.user.spotify_refresh_token = None
+        self.user.save()
+
+        self.assertIsNone(get_access_token(self.user))
+        self.assertEqual(self.server.requests, [])
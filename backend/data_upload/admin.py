@@ -1,5 +1,14 @@
 from django.contrib import admin
-from .models import SpotifyDataUpload, StreamingHistory
+from .models import SpotifyDataUpload, UploadFile, StreamingHistory, PlaylistExport
+
+
+class UploadFileInline(admin.TabularInline):
+    model = UploadFile
+    extra = 0
+    readonly_fields = (
+        'name', 'status', 'records_inserted', 'records_duplicate', 'records_skipped',
+        'error_message', 'started_at', 'finished_at'
+    )
 
 
 @admin.register(SpotifyDataUpload)
@@ -7,11 +16,25 @@ class SpotifyDataUploadAdmin(admin.ModelAdmin):
     list_display = ('user', 'upload_date', 'file_size', 'processed', 'processing_status')
     list_filter = ('processed', 'processing_status', 'upload_date')
     search_fields = ('user__username',)
+    inlines = [UploadFileInline]
 
 
 @admin.register(StreamingHistory)
 class StreamingHistoryAdmin(admin.ModelAdmin):
-    list_display = ('user', 'master_metadata_track_name', 'master_metadata_album_artist_name', 'ts', 'ms_played')
+    list_display = ('user', 'track', 'artist', 'ts', 'ms_played')
     list_filter = ('ts', 'conn_country', 'platform')
-    search_fields = ('master_metadata_track_name', 'master_metadata_album_artist_name', 'user__username')
+    list_select_related = ('user', 'track__artist')
+    search_fields = ('track__name', 'track__artist__name', 'user__username')
     date_hierarchy = 'ts'
+    
+    @admin.display(description='Artist')
+    def artist(self, obj):
+        return obj.track.artist if obj.track else None
+
+
+@admin.register(PlaylistExport)
+class PlaylistExportAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'status', 'tracks_added', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'name', 'spotify_playlist_id')
+    exclude = ('track_uris',)
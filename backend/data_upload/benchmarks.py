@@ -0,0 +1,49 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+
+def generate_sample_records(count, seed=0, start=datetime(2014, 1, 1, tzinfo=timezone.utc)):
+    """
+    Generate synthetic records in the Spotify extended streaming history format
+    """
+    rng = random.Random(seed)
+    platforms = ['android', 'ios', 'windows', 'osx', 'web_player']
+    reasons = ['trackdone', 'fwdbtn', 'clickrow', 'backbtn', 'playbtn', 'endplay']
+    ts = start
+
+    for i in range(count):
+        ts += timedelta(seconds=rng.randint(30, 600))
+        track = rng.randint(0, 5000)
+        is_music = rng.random() > 0.1
+        yield {
+            'ts': ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'username': 'benchmark',
+            'platform': rng.choice(platforms),
+            'ms_played': rng.randint(0, 400000),
+            'conn_country': 'PL',
+            'ip_addr_decrypted': '10.0.0.1',
+            'user_agent_decrypted': 'unknown',
+            'master_metadata_track_name': f'Track {track}' if is_music else None,
+            'master_metadata_album_artist_name': f'Artist {track % 500}' if is_music else None,
+            'master_metadata_album_album_name': f'Album {track % 1500}' if is_music else None,
+            'spotify_track_uri': f'spotify:track:{track:022d}' if is_music else None,
+            'episode_name': None if is_music else f'Episode {i}',
+            'episode_show_name': None if is_music else 'Podcast',
+            'spotify_episode_uri': None if is_music else f'spotify:episode:{i:022d}',
+            'reason_start': rng.choice(reasons),
+            'reason_end': rng.choice(reasons),
+            'shuffle': rng.random() > 0.5,
+            'skipped': rng.random() > 0.8,
+            'offline': False,
+            'offline_timestamp': int(ts.timestamp() * 1000),
+            'incognito_mode': False,
+        }
+
+
+def write_sample_file(path, count, seed=0):
+    """
+    Write a synthetic Streaming_History JSON file with the given number of records
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(list(generate_sample_records(count, seed)), f)
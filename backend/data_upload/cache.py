@@ -0,0 +1,69 @@
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from spotify_backend.metrics import get_counters, increment_counter
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+HITS_KEY = 'stats:hits'
+MISSES_KEY = 'stats:misses'
+
+
+def bump_data_version(user):
+    """
+    Invalidate every cached statistics result of a user
+    """
+    User.objects.filter(pk=user.pk).update(data_version=F('data_version') + 1)
+
+
+def stats_cache_key(user, name, params):
+    """
+    Build the cache key of a statistics result. The user's data version
+    is part of the key, so results of older data are never read again.
+    """
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    return f'stats:{user.pk}:{user.data_version}:{name}:{digest}'
+
+
+def get_cached_stats(user, name, params, compute):
+    """
+    Return a cached statistics result, computing and storing it on a miss
+    """
+    key = stats_cache_key(user, name, params)
+    result = cache.get(key)
+    if result is not None:
+        _count(HITS_KEY)
+        return result
+
+    _count(MISSES_KEY)
+    result = compute()
+    cache.set(key, result, settings.STATS_CACHE_TIMEOUT)
+    return result
+
+
+def get_cache_counters():
+    """
+    Return the statistics cache hit/miss counters. Like the request
+    metrics they are kept per process unless METRICS_CACHE_URL is set.
+    """
+    values = get_counters().get_many([HITS_KEY, MISSES_KEY])
+    hits = values.get(HITS_KEY, 0)
+    misses = values.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def _count(key):
+    # The counters are diagnostics, an unreachable counter store must not fail the request
+    try:
+        increment_counter(key)
+    except Exception:
+        logger.warning('Could not update statistics cache counter %s', key, exc_info=True)
@@ -0,0 +1,173 @@
+import os
+import hashlib
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from .models import SpotifyDataUpload
+
+# Bytes read from the request body per write
+STREAM_BLOCK_SIZE = 64 * 1024
+
+SUPPORTED_EXTENSIONS = ('.zip', '.parquet')
+
+
+class OffsetMismatch(Exception):
+    """
+    A chunk does not start where the stored data ends
+    """
+    def __init__(self, offset):
+        super().__init__(f'Expected offset {offset}')
+        self.offset = offset
+
+
+def create_chunked_upload(user, filename, size, incremental=False, profile=False):
+    """
+    Start a chunked upload of a ZIP archive or Parquet export. The data is
+    written to a `.part` file in the user's upload directory.
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError('File must be a ZIP archive or a Parquet export')
+    if size <= 0:
+        raise ValueError('File size must be positive')
+
+    user_upload_dir = os.path.join(settings.UPLOAD_DIR, str(user.pk))
+    os.makedirs(user_upload_dir, exist_ok=True)
+
+    upload = SpotifyDataUpload.objects.create(
+        user=user,
+        file_path='',
+        file_size=size,
+        processing_status='uploading',
+        incremental=incremental,
+        profile=profile
+    )
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    upload.file_path = os.path.join(user_upload_dir, f'spotify_data_{timestamp}_{upload.pk}{extension}.part')
+    upload.save(update_fields=['file_path'])
+    open(upload.file_path, 'wb').close()
+    return upload
+
+
+def write_chunk(upload, offset, stream, length, checksum=None):
+    """
+    Append `length` bytes read from a file-like stream at `offset`, which
+    must be where the stored data ends. The body is copied to disk in small
+    blocks and never held in memory. With a SHA-256 checksum a corrupted
+    chunk is discarded. Returns the new offset.
+
+    The body is written before the upload row is locked, so a slow client
+    does not hold the lock; bytes past `bytes_received` are not read by
+    anyone yet. The lock only serializes the offset check and the update
+    of `bytes_received` between concurrent PUTs of the same upload.
+
+    A chunk cut short by a dropped connection is kept up to the last byte
+    received, so the client resumes from there.
+    """
+    upload.refresh_from_db(fields=['file_path', 'file_size', 'bytes_received', 'processing_status'])
+    _check_chunk(upload, offset, length)
+
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        f = open(upload.file_path, 'r+b')
+    except FileNotFoundError:
+        # Finished or deleted since the check
+        raise ValueError('Upload is not in progress')
+    with f:
+        # Bytes of an earlier interrupted chunk past the offset are overwritten
+        f.seek(offset)
+        try:
+            while written < length:
+                block = stream.read(min(STREAM_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                written += len(block)
+        except OSError:
+            pass  # client disconnected - keep what arrived
+    mismatch = checksum and (written != length or digest.hexdigest() != checksum.lower())
+    if mismatch:
+        written = 0
+
+    with transaction.atomic():
+        upload = _lock_upload(upload)
+        # Another PUT may have stored this range meanwhile
+        _check_chunk(upload, offset, length)
+        with open(upload.file_path, 'r+b') as f:
+            f.truncate(offset + written)
+        upload.bytes_received = offset + written
+        upload.save(update_fields=['bytes_received'])
+
+    if mismatch:
+        raise ValueError('Chunk checksum mismatch')
+    return upload.bytes_received
+
+
+def _lock_upload(upload):
+    # FOR NO KEY UPDATE does not wait for the key-share locks that the
+    # follower's open transaction holds on the row through its inserted plays
+    no_key = connection.features.has_select_for_no_key_update
+    return SpotifyDataUpload.objects.select_for_update(no_key=no_key).get(pk=upload.pk)
+
+
+def _check_chunk(upload, offset, length):
+    if not is_receiving(upload):
+        raise ValueError('Upload is not in progress')
+    if offset != upload.bytes_received:
+        raise OffsetMismatch(upload.bytes_received)
+    if offset + length > upload.file_size:
+        raise ValueError('Chunk extends past the declared file size')
+
+
+def complete_chunked_upload(upload, checksum=None):
+    """
+    Check that all bytes arrived (and match the SHA-256 checksum of the
+    whole file, if given) and move the file to its final name. An upload
+    that is not already being ingested while it arrives is then 'uploaded'
+    and ready to be queued for processing.
+    """
+    with transaction.atomic():
+        upload = _lock_upload(upload)
+        if not is_receiving(upload):
+            raise ValueError('Upload is not in progress')
+        if upload.bytes_received != upload.file_size:
+            raise OffsetMismatch(upload.bytes_received)
+
+        if checksum:
+            digest = hashlib.sha256()
+            with open(upload.file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            if digest.hexdigest() != checksum.lower():
+                raise ValueError('File checksum mismatch')
+
+        final_path = upload.file_path.removesuffix('.part')
+        os.replace(upload.file_path, final_path)
+        upload.file_path = final_path
+        if upload.processing_status == 'uploading':
+            upload.processing_status = 'uploaded'
+        upload.save(update_fields=['file_path', 'processing_status'])
+    return upload
+
+
+def is_receiving(upload):
+    """
+    Check whether a chunked upload still accepts data. A ZIP upload may
+    already be queued or processing while it arrives.
+    """
+    return upload.file_path.endswith('.part') and upload.processing_status != 'failed'
+
+
+def starts_ingestion_early(upload):
+    """
+    Check whether a chunked upload is ingested while it arrives. Not on
+    SQLite: its single writer would be held by the ingest transaction of a
+    member while the member waits for chunks that can't be stored.
+    """
+    return (
+        settings.STREAMING_INGESTION
+        and connection.vendor != 'sqlite'
+        and upload.file_path.endswith('.zip.part')
+    )
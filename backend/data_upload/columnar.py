@@ -0,0 +1,250 @@
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .models import StreamingHistory, UploadFile
+from .ingestion import (
+    SPOTIFY_TS_FORMAT, IngestStats, get_incremental_cutoff, iter_batches, process_upload_file
+)
+from .loaders import get_loader
+
+
+# Columns of the Parquet export - named like the keys of Spotify history files
+# (column, StreamingHistory lookup, Arrow type)
+EXPORT_COLUMNS = (
+    ('ts', 'ts', 'timestamp'),
+    ('username', 'username', 'string'),
+    ('platform', 'platform__name', 'string'),
+    ('ms_played', 'ms_played', 'int64'),
+    ('conn_country', 'conn_country', 'string'),
+    ('ip_addr_decrypted', 'ip_addr_decrypted', 'string'),
+    ('user_agent_decrypted', 'user_agent_decrypted', 'string'),
+    ('master_metadata_track_name', 'track__name', 'string'),
+    ('master_metadata_album_artist_name', 'track__artist__name', 'string'),
+    ('master_metadata_album_album_name', 'track__album__name', 'string'),
+    ('spotify_track_uri', 'track__spotify_uri', 'string'),
+    ('episode_name', 'episode_name', 'string'),
+    ('episode_show_name', 'episode_show_name', 'string'),
+    ('spotify_episode_uri', 'spotify_episode_uri', 'string'),
+    ('reason_start', 'reason_start__name', 'string'),
+    ('reason_end', 'reason_end__name', 'string'),
+    ('shuffle', 'shuffle', 'bool'),
+    ('skipped', 'skipped', 'bool'),
+    ('offline', 'offline', 'bool'),
+    ('offline_timestamp', 'offline_timestamp', 'int64'),
+    ('incognito_mode', 'incognito_mode', 'bool'),
+)
+
+PARQUET_COMPRESSION = 'zstd'
+
+
+def _require_pyarrow():
+    # pyarrow is only needed for exports and Parquet imports
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured('Parquet export/import requires pyarrow (pip install pyarrow)')
+    return pyarrow
+
+
+def get_export_schema():
+    """
+    Return the Arrow schema of the Parquet export
+    """
+    pa = _require_pyarrow()
+    types = {
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'string': pa.string(),
+        'int64': pa.int64(),
+        'bool': pa.bool_(),
+    }
+    return pa.schema([(column, types[arrow_type]) for column, lookup, arrow_type in EXPORT_COLUMNS])
+
+
+def iter_history_record_batches(user, chunk_size=None):
+    """
+    Yield a user's streaming history as Arrow record batches of chunk_size rows
+    """
+    pa = _require_pyarrow()
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    schema = get_export_schema()
+
+    rows = (
+        StreamingHistory.objects
+        .filter(user=user)
+        .order_by('ts', 'id')
+        .values_list(*(lookup for column, lookup, arrow_type in EXPORT_COLUMNS))
+    )
+    for chunk in iter_batches(rows.iterator(chunk_size=chunk_size), chunk_size):
+        # Transpose the chunk into one list per column
+        columns = zip(*chunk)
+        yield pa.record_batch(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+def write_history_parquet(user, fp, chunk_size=None):
+    """
+    Write a user's streaming history to a binary file object as Parquet,
+    one row group per chunk. Returns the number of exported rows.
+    """
+    pa = _require_pyarrow()
+    count = 0
+    with pa.parquet.ParquetWriter(fp, get_export_schema(), compression=PARQUET_COMPRESSION) as writer:
+        for batch in iter_history_record_batches(user, chunk_size):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+class _StreamSink:
+    """
+    Write-only file object collecting Parquet output between row groups,
+    so the export can be streamed while it is being written
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # The Parquet footer stores absolute offsets of the row groups
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_history_parquet(user, chunk_size=None):
+    """
+    Yield the Parquet export of a user's streaming history as bytes,
+    one row group at a time
+    """
+    pa = _require_pyarrow()
+    sink = _StreamSink()
+    writer = pa.parquet.ParquetWriter(sink, get_export_schema(), compression=PARQUET_COMPRESSION)
+    try:
+        for batch in iter_history_record_batches(user, chunk_size):
+            writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _timestamp_column(column):
+    """
+    Convert the "ts" column to UTC timestamps: exports store timestamps,
+    Parquet files written by other tools may hold Spotify timestamp strings
+    """
+    pa = _require_pyarrow()
+    ts_type = pa.timestamp('us', tz='UTC')
+    if pa.types.is_timestamp(column.type):
+        # Timestamps without a time zone are taken as UTC
+        return column.cast(ts_type)
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pa.compute.strptime(column, format=SPOTIFY_TS_FORMAT, unit='us').cast(ts_type)
+    raise ValueError('Parquet "ts" column must hold timestamps or Spotify timestamp strings')
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _to_datetimes(ts):
+    # Several times faster than to_pylist(), which converts through the Arrow time zone
+    pa = _require_pyarrow()
+    return [
+        None if value is None else _EPOCH + timedelta(microseconds=value)
+        for value in ts.cast(pa.int64()).to_pylist()
+    ]
+
+
+def ingest_parquet(upload, fp, since=None, loader=None, batch_size=None):
+    """
+    Load a Parquet export straight from its Arrow columns. Timestamps are
+    converted and `since` (a Spotify timestamp string) is applied to whole
+    columns, and the column values are decoded into rows without building
+    a dict per record.
+    """
+    pa = _require_pyarrow()
+    loader = loader or get_loader()
+    batch_size = batch_size or settings.INGESTION_BATCH_SIZE
+    stats = IngestStats()
+    timer = stats.timer
+
+    parquet = pa.parquet.ParquetFile(fp)
+    if 'ts' not in parquet.schema_arrow.names:
+        raise ValueError('Parquet file has no "ts" column')
+    cutoff = None
+    if since:
+        cutoff = pa.scalar(
+            datetime.strptime(since, SPOTIFY_TS_FORMAT).replace(tzinfo=dt_timezone.utc),
+            type=pa.timestamp('us', tz='UTC'),
+        )
+
+    batches = parquet.iter_batches(batch_size=batch_size)
+    while True:
+        # Reading and decompressing the row groups
+        with timer.stage('read'):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        timer.count('batches')
+        timer.count('records', batch.num_rows)
+
+        with timer.stage('decode'):
+            ts = _timestamp_column(batch.column('ts'))
+            if cutoff is not None:
+                newer = pa.compute.greater_equal(ts, cutoff)
+                batch, ts = batch.filter(newer), ts.filter(newer)
+                stats.skipped += len(newer) - batch.num_rows
+            columns = {name: batch.column(name).to_pylist() for name in batch.schema.names}
+            columns['ts'] = _to_datetimes(ts)
+            rows = loader.decoder.decode_columns(columns, batch.num_rows, timer)
+        if not rows:
+            continue
+
+        count = loader.load_rows(upload, rows, timer)
+        stats.inserted += count
+        stats.duplicates += len(rows) - count
+        upload.heartbeat()
+    return stats
+
+
+def process_parquet_upload(upload, file_path):
+    """
+    Ingest an uploaded Parquet export. Returns the UploadFile outcomes.
+    """
+    since = get_incremental_cutoff(upload.user) if upload.incremental else None
+
+    upload.files_total = 1
+    upload.save(update_fields=['files_total'])
+    upload_file = UploadFile.objects.create(upload=upload, name=os.path.basename(file_path))
+
+    def ingest():
+        with open(file_path, 'rb') as f:
+            stats = ingest_parquet(upload, f, since=since)
+        stats.timer.count('bytes', os.path.getsize(file_path))
+        return stats
+
+    process_upload_file(upload, upload_file, ingest)
+    return [upload_file]
@@ -0,0 +1,125 @@
+from datetime import datetime
+from operator import itemgetter
+from .dimensions import DimensionCache
+from .profiling import StageTimer
+
+
+# (model field, Spotify JSON key, default when the key is missing)
+# Track, artist, album, platform and reasons are interned by DimensionCache
+RECORD_FIELDS = (
+    ('username', 'username', ''),
+    ('ms_played', 'ms_played', 0),
+    ('conn_country', 'conn_country', ''),
+    ('ip_addr_decrypted', 'ip_addr_decrypted', None),
+    ('user_agent_decrypted', 'user_agent_decrypted', ''),
+    ('episode_name', 'episode_name', ''),
+    ('episode_show_name', 'episode_show_name', ''),
+    ('spotify_episode_uri', 'spotify_episode_uri', ''),
+    ('shuffle', 'shuffle', False),
+    ('skipped', 'skipped', False),
+    ('offline', 'offline', False),
+    ('offline_timestamp', 'offline_timestamp', None),
+    ('incognito_mode', 'incognito_mode', False),
+)
+
+# Spotify JSON keys of the dimension values: the track key
+# (track, artist, album, URI) followed by platform, reason start and reason end
+DIMENSION_KEYS = (
+    'master_metadata_track_name',
+    'master_metadata_album_artist_name',
+    'master_metadata_album_album_name',
+    'spotify_track_uri',
+    'platform',
+    'reason_start',
+    'reason_end',
+)
+
+DIMENSION_FIELDS = ('track_id', 'platform_id', 'reason_start_id', 'reason_end_id')
+
+# Columns of a decoded row
+ROW_COLUMNS = ('ts',) + DIMENSION_FIELDS + tuple(field for field, key, default in RECORD_FIELDS)
+
+_KEYS = ('ts',) + DIMENSION_KEYS + tuple(key for field, key, default in RECORD_FIELDS)
+_DEFAULTS = (None,) * (1 + len(DIMENSION_KEYS)) + tuple(default for field, key, default in RECORD_FIELDS)
+_TRACK = slice(1, 5)
+_VALUES = slice(1 + len(DIMENSION_KEYS), None)
+
+# Every value of a record in one C call - KeyError when a key is missing
+_get_values = itemgetter(*_KEYS)
+
+
+def parse_spotify_timestamps(values):
+    """
+    Parse Spotify "ts" strings ('2014-01-01T12:00:00Z') into aware UTC
+    datetimes. Each value is parsed on its own by fromisoformat, which
+    reads the Z suffix in C. Parsing the fixed layout for all values at
+    once with numpy was several times slower: building the datetime
+    objects costs more than the parsing itself.
+    """
+    return list(map(datetime.fromisoformat, values))
+
+
+class RecordDecoder:
+    """
+    Decodes Spotify records into plain row tuples in ROW_COLUMNS order,
+    with dimension values replaced by their ids. Spotify's schema is fixed,
+    so all values of a record are read at once; records with missing keys
+    fall back to the defaults of RECORD_FIELDS. The "ts" string is kept as
+    it is: the COPY loader passes it on unchanged, the ORM loader parses it
+    with parse_spotify_timestamps().
+    """
+    def __init__(self):
+        self.dimensions = DimensionCache()
+        # Raw (track, artist, album, URI) values -> track id
+        self.track_ids = {}
+
+    def decode(self, items, timer=None):
+        values = []
+        for item in items:
+            try:
+                values.append(_get_values(item))
+            except KeyError:
+                values.append(tuple(item.get(key, default) for key, default in zip(_KEYS, _DEFAULTS)))
+        return self._decode_values(values, timer)
+
+    def decode_columns(self, columns, length, timer=None):
+        """
+        Decode `length` records given column-wise, as a dict of Spotify
+        key -> list of values (e.g. the columns of an Arrow batch). Missing
+        columns take the defaults of RECORD_FIELDS.
+        """
+        values = list(zip(*(
+            columns[key] if key in columns else [default] * length
+            for key, default in zip(_KEYS, _DEFAULTS)
+        )))
+        return self._decode_values(values, timer)
+
+    def _decode_values(self, values, timer):
+        # `values` are tuples in _KEYS order
+        timer = timer or StageTimer()
+        track_ids = self.track_ids
+        new_tracks = {record[_TRACK] for record in values} - track_ids.keys()
+        with timer.stage('dimensions'):
+            self.dimensions.prepare(
+                new_tracks,
+                {record[5] for record in values},
+                {record[6] for record in values} | {record[7] for record in values},
+            )
+            for track in new_tracks:
+                track_ids[track] = self.dimensions.track_id(*track)
+
+        # Empty names are never interned, so they map to None like missing ones
+        platform_ids = self.dimensions.platforms
+        reason_ids = self.dimensions.reasons
+        rows = []
+        for record in values:
+            if not record[0]:
+                raise ValueError('Streaming history record without "ts"')
+            rows.append((
+                record[0],
+                track_ids[record[_TRACK]],
+                platform_ids.get(record[5]),
+                reason_ids.get(record[6]),
+                reason_ids.get(record[7]),
+            ) + record[_VALUES])
+        return rows
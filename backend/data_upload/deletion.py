@@ -0,0 +1,138 @@
+import os
+import shutil
+import logging
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from .models import SpotifyDataUpload, StreamingHistory, DailyTrackStats
+from .partitioning import get_partition_strategy
+from .profiling import get_profile_path
+
+logger = logging.getLogger(__name__)
+
+
+def delete_user_history(user, chunk_size=None):
+    """
+    Delete a user's streaming history with set-based SQL and return the
+    number of deleted rows. Rows are deleted in chunks, each in its own
+    transaction, so no lock is held for the whole delete. When the table
+    is hash-partitioned by user and the user's partition holds no other
+    user, the partition is truncated instead.
+    """
+    chunk_size = chunk_size or settings.DELETE_CHUNK_SIZE
+    table = connection.ops.quote_name(StreamingHistory._meta.db_table)
+
+    if get_partition_strategy() == 'hash':
+        deleted = _truncate_user_partition(user, table)
+        if deleted is not None:
+            return deleted
+
+    return _delete_in_chunks(table, 'user_id = %s', [user.pk], chunk_size)
+
+
+def delete_upload(upload, chunk_size=None):
+    """
+    Delete a single upload with the plays stored by it and its files on
+    disk, e.g. an abandoned chunked upload. The plays are deleted in chunks
+    like in delete_user_history. Returns the number of deleted plays.
+    """
+    chunk_size = chunk_size or settings.DELETE_CHUNK_SIZE
+    table = connection.ops.quote_name(StreamingHistory._meta.db_table)
+    deleted = _delete_in_chunks(table, 'user_id = %s AND upload_id = %s', [upload.user_id, upload.pk], chunk_size)
+
+    file_paths = [upload.file_path]
+    if upload.profile:
+        file_paths.append(get_profile_path(upload))
+    upload.delete()
+    for file_path in file_paths:
+        remove_upload_files(file_path)
+    return deleted
+
+
+def _delete_in_chunks(table, condition, params, chunk_size):
+    # Each chunk is deleted in its own transaction
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN '
+                f'(SELECT id FROM {table} WHERE {condition} LIMIT %s)',
+                params + [chunk_size],
+            )
+            count = cursor.rowcount
+        deleted += count
+        if count < chunk_size:
+            return deleted
+
+
+def _truncate_user_partition(user, table):
+    # Returns the deleted row count, or None when the partition is shared
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT tableoid::regclass::text FROM {table} WHERE user_id = %s LIMIT 1', [user.pk])
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        partition = row[0]  # regclass text is already quoted when needed
+
+        # Block inserts into the partition while checking who else is stored there
+        cursor.execute(f'LOCK TABLE {partition} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute(f'SELECT MIN(user_id), MAX(user_id) FROM {partition}')
+        if cursor.fetchone() != (user.pk, user.pk):
+            return None
+
+        # The rollup already knows how many plays are stored - no need to count the partition
+        deleted = DailyTrackStats.objects.filter(user=user).aggregate(total=Sum('play_count'))['total'] or 0
+        cursor.execute(f'TRUNCATE {partition}')
+    return deleted
+
+
+def delete_user_uploads(user):
+    """
+    Delete a user's upload records and their files on disk (the ZIP archive,
+    profile captures and the `_extracted` directory left by older versions).
+    Returns the number of deleted uploads.
+    """
+    file_paths = list(SpotifyDataUpload.objects.filter(user=user).values_list('file_path', flat=True))
+    file_paths += [
+        get_profile_path(upload) for upload in SpotifyDataUpload.objects.filter(user=user, profile=True)
+    ]
+    _, deleted = SpotifyDataUpload.objects.filter(user=user).delete()
+
+    for file_path in file_paths:
+        remove_upload_files(file_path)
+
+    # Remove the user's upload directory once it is empty
+    try:
+        os.rmdir(os.path.join(settings.UPLOAD_DIR, str(user.pk)))
+    except OSError:
+        pass
+
+    return deleted.get(SpotifyDataUpload._meta.label, 0)
+
+
+def is_in_upload_dir(path):
+    """
+    Check whether a path (after resolving symlinks) lies inside UPLOAD_DIR
+    """
+    upload_dir = os.path.realpath(settings.UPLOAD_DIR)
+    return os.path.commonpath([upload_dir, os.path.realpath(path)]) == upload_dir
+
+
+def remove_upload_files(file_path):
+    """
+    Remove an uploaded ZIP file and its extraction directory, if present.
+    Files outside UPLOAD_DIR are never touched.
+    """
+    if not file_path:
+        return
+    if not is_in_upload_dir(file_path):
+        logger.warning('Not removing %s: it is outside UPLOAD_DIR', file_path)
+        return
+    extract_dir = os.path.splitext(file_path)[0] + '_extracted'
+    try:
+        if os.path.isdir(extract_dir):
+            shutil.rmtree(extract_dir)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    except OSError as e:
+        logger.warning('Could not remove files of upload %s: %s', file_path, e)
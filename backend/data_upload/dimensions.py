@@ -0,0 +1,113 @@
+from django.db.models import Q
+from .models import Artist, Album, Track, Platform, Reason
+
+
+def _clean(value):
+    # Empty strings and NULLs both mean "no value" in the dimension tables
+    return value or None
+
+
+class DimensionCache:
+    """
+    Interns track, artist, album, platform and reason values into the
+    dimension tables during ingestion. Ids are cached per ingestion so
+    each distinct value costs database work only the first time it is seen.
+    `platforms` and `reasons` map prepared names to their ids.
+    """
+    def __init__(self):
+        self.artists = {}
+        self.albums = {}
+        self.tracks = {}
+        self.platforms = {}
+        self.reasons = {}
+
+    def prepare(self, tracks=(), platforms=(), reasons=()):
+        """
+        Make sure the given dimension values have ids. `tracks` holds raw
+        (track name, artist name, album name, track URI) tuples.
+        """
+        artist_names, album_keys, track_keys = set(), set(), set()
+        for track in tracks:
+            track_name, artist_name, album_name, uri = map(_clean, track)
+            if artist_name:
+                artist_names.add(artist_name)
+            if album_name:
+                album_keys.add((album_name, artist_name))
+            if track_name or uri:
+                track_keys.add((track_name, artist_name, album_name, uri))
+        platform_names = {name for name in platforms if name}
+        reason_names = {name for name in reasons if name}
+
+        self._intern_names(Artist, self.artists, artist_names)
+        self._intern_names(Platform, self.platforms, platform_names)
+        self._intern_names(Reason, self.reasons, reason_names)
+
+        # Albums and tracks reference artist/album ids resolved above
+        album_keys = {(name, self.artists.get(artist)) for name, artist in album_keys}
+        self._intern_keys(
+            Album, self.albums, album_keys, ('name', 'artist_id'),
+            lambda missing: Q(name__in={name for name, artist_id in missing}),
+        )
+
+        track_keys = {
+            (
+                name,
+                self.artists.get(artist),
+                self.albums.get((album, self.artists.get(artist))),
+                uri,
+            )
+            for name, artist, album, uri in track_keys
+        }
+        self._intern_keys(
+            Track, self.tracks, track_keys, ('name', 'artist_id', 'album_id', 'spotify_uri'),
+            lambda missing: (
+                Q(name__in={key[0] for key in missing if key[0]})
+                | Q(spotify_uri__in={key[3] for key in missing if key[3]})
+            ),
+        )
+
+    def track_id(self, track_name, artist_name, album_name, uri):
+        """
+        Return the id of a track passed to prepare(), None for records
+        without track metadata (e.g. podcast episodes)
+        """
+        track_name, artist_name, album_name, uri = map(_clean, (track_name, artist_name, album_name, uri))
+        if not (track_name or uri):
+            return None
+        artist_id = self.artists.get(artist_name)
+        album_id = self.albums.get((album_name, artist_id)) if album_name else None
+        return self.tracks[(track_name, artist_id, album_id, uri)]
+
+    @staticmethod
+    def _intern_names(model, cache, names):
+        missing = [name for name in names if name not in cache]
+        if not missing:
+            return
+        cache.update(model.objects.filter(name__in=missing).values_list('name', 'id'))
+
+        new = [name for name in missing if name not in cache]
+        if new:
+            model.objects.bulk_create([model(name=name) for name in new], ignore_conflicts=True)
+            cache.update(model.objects.filter(name__in=new).values_list('name', 'id'))
+
+    @staticmethod
+    def _intern_keys(model, cache, keys, fields, candidates):
+        missing = {key for key in keys if key not in cache}
+        if not missing:
+            return
+
+        def fetch():
+            # Narrow the lookup with `candidates`, then match full keys in Python (NULL-safe)
+            rows = model.objects.filter(candidates(missing)).order_by('id').values_list(*fields, 'id')
+            for row in rows:
+                key = row[:-1]
+                if key in missing and key not in cache:
+                    cache[key] = row[-1]
+
+        fetch()
+        new = [key for key in missing if key not in cache]
+        if new:
+            model.objects.bulk_create(
+                [model(**dict(zip(fields, key))) for key in new], ignore_conflicts=True
+            )
+            fetch()
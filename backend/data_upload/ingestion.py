@@ -0,0 +1,368 @@
+import io
+import os
+import re
+import json
+import time
+import logging
+import zipfile
+import posixpath
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import SpotifyDataUpload, UploadFile, StreamingHistory
+from .loaders import get_loader
+from .profiling import StageTimer, TimedReader
+
+logger = logging.getLogger(__name__)
+
+
+# Size of the text chunks read from a history file while decoding it
+READ_CHUNK_SIZE = 64 * 1024
+
+# Largest single record accepted - a corrupt file fails here instead of
+# being read into memory as one never-ending element
+MAX_RECORD_SIZE = 1024 * 1024
+
+# Format of the "ts" field in Spotify streaming history files
+SPOTIFY_TS_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = re.compile(r'[\s,\]]')
+
+
+def iter_json_array(fp, chunk_size=READ_CHUNK_SIZE, max_record_size=MAX_RECORD_SIZE):
+    """
+    Incrementally decode a top-level JSON array from a text stream,
+    yielding one element at a time without loading the whole document
+    """
+    buf = fp.read(chunk_size)
+    eof = not buf
+    pos = 0
+
+    def fill():
+        # Drop the consumed prefix and append the next chunk
+        nonlocal buf, pos, eof
+        if len(buf) - pos > max_record_size:
+            raise ValueError(
+                f'Streaming history record larger than {max_record_size} characters - the file is corrupt'
+            )
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_whitespace():
+        # Move past whitespace, reading more as needed; False at the end of the stream
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return True
+            if not fill():
+                return False
+
+    # Opening bracket
+    if not skip_whitespace() or buf[pos] != '[':
+        raise ValueError('Streaming history file must contain a JSON array')
+    pos += 1
+
+    expect_value = True
+    first = True
+    while True:
+        if not skip_whitespace():
+            raise ValueError('Unexpected end of streaming history file')
+
+        char = buf[pos]
+        if char == ']':
+            if expect_value and not first:
+                raise ValueError('Unexpected "]" after "," in streaming history file')
+            pos += 1
+            break
+        if char == ',':
+            if expect_value:
+                raise ValueError('Unexpected "," in streaming history file')
+            expect_value = True
+            pos += 1
+            continue
+        if not expect_value:
+            raise ValueError('Expected "," between streaming history records')
+
+        if char in '{["':
+            # Self-delimiting value: a truncated one fails to decode
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element is split across chunks - read more and retry
+                if fill():
+                    continue
+                raise
+        else:
+            # Bare number or literal: only complete once a delimiter follows,
+            # "1.5e10" read as "1.5" would otherwise decode as a shorter value
+            delimiter = _DELIMITERS.search(buf, pos)
+            if delimiter is None and fill():
+                continue
+            end = delimiter.start() if delimiter else len(buf)
+            item, length = _decoder.raw_decode(buf[pos:end])
+            if length != end - pos:
+                raise ValueError(f'Invalid value {buf[pos:end]!r} in streaming history file')
+
+        yield item
+        pos = end
+        expect_value = False
+        first = False
+
+    # Nothing but whitespace may follow the array
+    if skip_whitespace():
+        raise ValueError('Unexpected data after the JSON array in streaming history file')
+
+
+class IngestStats:
+    """
+    Counters and stage timings for one ingested history file
+    """
+    def __init__(self):
+        self.inserted = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.timer = StageTimer()
+
+
+def iter_batches(iterable, batch_size):
+    """
+    Group an iterable into lists of at most batch_size items
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_incremental_cutoff(user):
+    """
+    Return the user's latest stored play as a Spotify formatted UTC
+    timestamp string, or None when the user has no history yet
+    """
+    # Served by the (user, ts) index
+    latest = StreamingHistory.objects.filter(user=user).aggregate(latest=Max('ts'))['latest']
+    if latest is None:
+        return None
+    return latest.astimezone(dt_timezone.utc).strftime(SPOTIFY_TS_FORMAT)
+
+
+def ingest_streaming_history(upload, fp, batch_size=None, loader=None, since=None):
+    """
+    Stream records from an open history file into the database in
+    fixed-size batches, so memory use is bounded by the batch size
+    """
+    batch_size = batch_size or settings.INGESTION_BATCH_SIZE
+    stats = IngestStats()
+    fp = TimedReader(fp, stats.timer)
+    return ingest_records(
+        upload, iter_batches(iter_json_array(fp), batch_size), loader=loader, since=since, stats=stats
+    )
+
+
+def ingest_records(upload, batches, loader=None, since=None, stats=None):
+    """
+    Load batches of Spotify formatted records (dicts with a "ts" string).
+    With `since` (a Spotify timestamp string) older records are skipped
+    before any parsing or database work.
+    """
+    loader = loader or get_loader()
+    stats = stats or IngestStats()
+    timer = stats.timer
+
+    batches = iter(batches)
+    while True:
+        # Reading the file is timed separately, see TimedReader
+        with timer.stage('parse'):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        timer.count('batches')
+        timer.count('records', len(batch))
+        if since:
+            # Fixed-format UTC timestamps compare correctly as strings
+            newer = [item for item in batch if (item.get('ts') or '') >= since]
+            stats.skipped += len(batch) - len(newer)
+            batch = newer
+            if not batch:
+                continue
+        count = loader.load(upload, batch, timer)
+        stats.inserted += count
+        stats.duplicates += len(batch) - count
+        upload.heartbeat()
+    return stats
+
+
+def is_streaming_history_member(name):
+    """
+    Check whether a ZIP member name is a Streaming_History*.json file
+    """
+    file = posixpath.basename(name)
+    return file.startswith('Streaming_History') and file.endswith('.json')
+
+
+def process_zip_member(upload, file_path, upload_file, since=None):
+    """
+    Ingest a single history member of the archive
+    """
+    def ingest():
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            with zip_ref.open(upload_file.name) as raw, io.TextIOWrapper(raw, encoding='utf-8') as f:
+                stats = ingest_streaming_history(upload, f, since=since)
+            stats.timer.count('bytes', zip_ref.getinfo(upload_file.name).file_size)
+            return stats
+
+    return process_upload_file(upload, upload_file, ingest)
+
+
+def process_upload_file(upload, upload_file, ingest):
+    """
+    Run `ingest` (returning IngestStats) for one file of an upload in its
+    own transaction and record its outcome, so a corrupt file does not
+    affect the others
+    """
+    upload_file.status = 'processing'
+    upload_file.started_at = timezone.now()
+    upload_file.save(update_fields=['status', 'started_at'])
+
+    started = time.perf_counter()
+    try:
+        with transaction.atomic():
+            stats = ingest()
+    except Exception as e:
+        logger.warning('Failed to ingest %s from upload %s: %s', upload_file.name, upload.pk, e)
+        upload_file.status = 'failed'
+        upload_file.error_message = str(e)
+        upload_file.finished_at = timezone.now()
+        upload_file.save(update_fields=['status', 'error_message', 'finished_at'])
+        upload.add_progress(files=1)
+        return upload_file
+
+    upload_file.status = 'completed'
+    upload_file.records_inserted = stats.inserted
+    upload_file.records_duplicate = stats.duplicates
+    upload_file.records_skipped = stats.skipped
+    upload_file.finished_at = timezone.now()
+    upload_file.timings = stats.timer.as_dict(total=time.perf_counter() - started)
+    upload_file.save(update_fields=[
+        'status', 'records_inserted', 'records_duplicate', 'records_skipped', 'finished_at', 'timings'
+    ])
+    upload.add_progress(
+        files=1, records=stats.inserted, duplicates=stats.duplicates, skipped=stats.skipped
+    )
+    return upload_file
+
+
+def _init_file_worker():
+    # Spawned worker processes set up Django and open their own DB connections
+    import django
+    django.setup()
+
+
+def _process_zip_member_in_worker(upload_id, file_path, upload_file_id, since):
+    """
+    Worker process entry point for process_zip_member
+    """
+    upload = SpotifyDataUpload.objects.select_related('user').get(pk=upload_id)
+    upload_file = UploadFile.objects.get(pk=upload_file_id)
+    try:
+        return process_zip_member(upload, file_path, upload_file, since).status
+    finally:
+        connections.close_all()
+
+
+def _get_file_workers(upload):
+    # SQLite allows a single writer, so files are processed one by one there.
+    # A profile only covers this process, so profiled uploads don't use workers.
+    if connection.vendor == 'sqlite' or upload.profile:
+        return 1
+    return max(1, settings.INGESTION_FILE_WORKERS)
+
+
+def process_spotify_zip(upload, file_path):
+    """
+    Process Spotify data ZIP file and ingest its streaming history.
+    History members are read straight from the archive as streams,
+    every other member (images, PDFs, ...) is skipped. With
+    INGESTION_FILE_WORKERS > 1 files are processed in parallel worker
+    processes. Incremental uploads only ingest records at or after the
+    user's latest stored play. Files already processed for this upload
+    (e.g. while it was still being uploaded) are not processed again.
+    Returns the UploadFile outcomes.
+    """
+    since = get_incremental_cutoff(upload.user) if upload.incremental else None
+
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        members = [
+            member.filename for member in zip_ref.infolist()
+            if not member.is_dir() and is_streaming_history_member(member.filename)
+        ]
+
+    upload.files_total = len(members)
+    upload.save(update_fields=['files_total'])
+    existing = {upload_file.name: upload_file for upload_file in upload.files.all()}
+    upload_files = [existing[name] for name in members if name in existing]
+    upload_files += UploadFile.objects.bulk_create(
+        [UploadFile(upload=upload, name=name) for name in members if name not in existing]
+    )
+    pending = [upload_file for upload_file in upload_files if upload_file.status in ('pending', 'processing')]
+
+    workers = min(_get_file_workers(upload), len(pending))
+    if workers <= 1:
+        for upload_file in pending:
+            process_zip_member(upload, file_path, upload_file, since)
+        return upload_files
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_file_worker,
+    ) as executor:
+        futures = {
+            executor.submit(
+                _process_zip_member_in_worker, upload.pk, file_path, upload_file.pk, since
+            ): upload_file
+            for upload_file in pending
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                # The worker itself crashed - record the file as failed
+                upload_file = futures[future]
+                logger.error('Worker failed on %s from upload %s: %s', upload_file.name, upload.pk, e)
+                UploadFile.objects.filter(pk=upload_file.pk).exclude(status='completed').update(
+                    status='failed', error_message=str(e), finished_at=timezone.now()
+                )
+                upload.add_progress(files=1)
+
+    upload.refresh_from_db(fields=[
+        'files_processed', 'records_inserted', 'records_duplicate', 'records_skipped'
+    ])
+    return list(UploadFile.objects.filter(upload=upload))
+
+
+def process_streaming_history_file(upload, json_path, batch_size=None, loader=None):
+    """
+    Process individual streaming history JSON file
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        stats = ingest_streaming_history(upload, f, batch_size=batch_size, loader=loader)
+    stats.timer.count('bytes', os.path.getsize(json_path))
+    return stats
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import SpotifyDataUpload
+from .ingestion import process_spotify_zip
+from .columnar import process_parquet_upload
+from .streaming import UploadStalled, ingest_growing_zip
+from .rollups import update_daily_stats_for_upload
+from .snapshots import build_snapshot
+from .profiling import StageTimer, capture_profile
+from .deletion import delete_upload
+from .cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+
+def run_upload_job(upload):
+    """
+    Process a queued upload and move it through the processing stages
+    """
+    upload.processing_status = 'processing'
+    upload.started_at = upload.heartbeat_at = timezone.now()
+    # With the heartbeat, an upload run directly (import_history) is not
+    # taken for a stale one and requeued
+    upload.save(update_fields=['processing_status', 'started_at', 'heartbeat_at'])
+
+    if upload.file_path.endswith('.part'):
+        # Chunked ZIP upload still in progress - parsed while it arrives by a
+        # follower thread, the queue worker is not kept waiting for the client
+        follow_upload(upload)
+        return
+
+    timer = StageTimer()
+    started = time.perf_counter()
+    try:
+        with capture_profile(upload):
+            if upload.file_path.endswith('.parquet'):
+                upload_files = process_parquet_upload(upload, upload.file_path)
+            else:
+                upload_files = process_spotify_zip(upload, upload.file_path)
+            if upload.records_inserted:
+                upload.heartbeat()
+                with timer.stage('rollups'):
+                    update_daily_stats_for_upload(upload)
+                if settings.ANALYTICS_ENGINE == 'snapshot':
+                    upload.heartbeat()
+                    with timer.stage('snapshot'):
+                        build_upload_snapshot(upload)
+    except Exception as e:
+        logger.exception('Processing upload %s failed', upload.pk)
+        upload.processing_status = 'failed'
+        upload.error_message = str(e)
+        upload.finished_at = timezone.now()
+        upload.timings = collect_timings(upload, timer, time.perf_counter() - started)
+        upload.save(update_fields=['processing_status', 'error_message', 'finished_at', 'timings'])
+        return
+
+    failed = [upload_file for upload_file in upload_files if upload_file.status != 'completed']
+    if upload_files and len(failed) == len(upload_files):
+        upload.processing_status = 'failed'
+    elif failed:
+        upload.processing_status = 'completed_with_errors'
+    else:
+        upload.processing_status = 'completed'
+    if failed:
+        upload.error_message = '\n'.join(
+            f'{upload_file.name}: {upload_file.error_message}' for upload_file in failed
+        )
+
+    upload.processed = upload.processing_status != 'failed'
+    upload.finished_at = timezone.now()
+    upload.timings = collect_timings(upload, timer, time.perf_counter() - started)
+    upload.save(update_fields=['processed', 'processing_status', 'error_message', 'finished_at', 'timings'])
+
+
+_follower_slots = None
+_follower_slots_lock = threading.Lock()
+
+
+def _get_follower_slots():
+    global _follower_slots
+    with _follower_slots_lock:
+        if _follower_slots is None:
+            _follower_slots = threading.BoundedSemaphore(settings.STREAMING_INGESTION_FOLLOWERS)
+        return _follower_slots
+
+
+def follow_upload(upload):
+    """
+    Ingest a chunked ZIP upload while it arrives, in a thread of its own
+    (at most STREAMING_INGESTION_FOLLOWERS at a time). Once the upload is
+    finished it is queued again for the rest of the processing. Without a
+    free follower the upload is processed after it is finished.
+    """
+    slots = _get_follower_slots()
+    if not slots.acquire(blocking=False):
+        logger.info('No free follower for upload %s, it is processed once finished', upload.pk)
+        _hand_back(upload)
+        return
+    try:
+        threading.Thread(target=_follow, args=(upload.pk, slots), name=f'follower-{upload.pk}', daemon=True).start()
+    except Exception:
+        slots.release()
+        raise
+
+
+def _follow(upload_id, slots):
+    close_old_connections()
+    try:
+        upload = SpotifyDataUpload.objects.select_related('user').get(pk=upload_id)
+        try:
+            ingest_growing_zip(upload)
+        except UploadStalled as e:
+            logger.info('Upload %s stalled, processing continues after it is finished: %s', upload_id, e)
+        except Exception:
+            logger.exception('Streaming ingestion of upload %s failed, it is processed once finished', upload_id)
+        _hand_back(upload)
+    except SpotifyDataUpload.DoesNotExist:
+        pass  # deleted while it was uploaded
+    finally:
+        slots.release()
+        close_old_connections()
+
+
+def _hand_back(upload):
+    # An upload still arriving goes back to 'uploading' (finishing it queues the
+    # processing), a finished one is queued now. The conditional update decides
+    # atomically against complete_chunked_upload, which renames the .part file.
+    detached = SpotifyDataUpload.objects.filter(
+        pk=upload.pk, file_path__endswith='.part'
+    ).update(processing_status='uploading')
+    if not detached:
+        upload.refresh_from_db(fields=['file_path', 'bytes_received'])
+        enqueue_upload(upload)
+
+
+def collect_timings(upload, timer, total):
+    """
+    Combine the job's own stages with the stages and counters of its files
+    (recorded by process_upload_file, also in worker processes) and the
+    time the upload request spent saving the file. `total` is the wall
+    time of the job, so parallel file workers can add up to more.
+    """
+    saved = upload.timings.get('stages', {}).get('save')
+    if saved is not None:
+        timer.add({'stages': {'save': saved}})
+    for timings in upload.files.values_list('timings', flat=True):
+        timer.add(timings)
+    timer.count('bytes_uploaded', upload.file_size)
+
+    timings = timer.as_dict(total=total)
+    logger.info('Upload %s timings: %s', upload.pk, json.dumps(timings, sort_keys=True))
+    return timings
+
+
+def build_upload_snapshot(upload):
+    """
+    Materialize the analytics snapshot after new records were ingested.
+    A failure only means the snapshot is built on first use instead.
+    """
+    try:
+        build_snapshot(upload.user)
+    except Exception:
+        logger.exception('Building the analytics snapshot for upload %s failed', upload.pk)
+
+
+def claim_next_upload():
+    """
+    Take the oldest queued upload, or return None if the queue is empty.
+    The conditional update makes the claim atomic, so concurrent workers
+    (also in other processes) never take the same upload.
+    """
+    queued = SpotifyDataUpload.objects.filter(processing_status='queued').order_by('upload_date')
+    while True:
+        upload_id = queued.values_list('pk', flat=True).first()
+        if upload_id is None:
+            return None
+        claimed = SpotifyDataUpload.objects.filter(pk=upload_id, processing_status='queued').update(
+            processing_status='processing', heartbeat_at=timezone.now()
+        )
+        if claimed:
+            return SpotifyDataUpload.objects.select_related('user').get(pk=upload_id)
+        # Taken by another worker - try the next one
+
+
+def requeue_stale_uploads():
+    """
+    Queue uploads again whose worker stopped sending heartbeats, e.g.
+    because the process running it was restarted. Processing is resumable,
+    files completed before are not processed again.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.INGESTION_STALE_TIMEOUT)
+    count = (
+        SpotifyDataUpload.objects
+        .filter(processing_status='processing')
+        .filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True))
+        .update(processing_status='queued')
+    )
+    if count:
+        logger.warning('Requeued %s stale upload(s)', count)
+    return count
+
+
+def remove_abandoned_uploads():
+    """
+    Delete chunked uploads that received no data for CHUNKED_UPLOAD_EXPIRY
+    seconds, with their `.part` file and the plays ingested while they
+    arrived. The last write is the modification time of the `.part` file.
+    """
+    expiry = settings.CHUNKED_UPLOAD_EXPIRY
+    cutoff = timezone.now() - timedelta(seconds=expiry)
+    removed = 0
+    for upload in SpotifyDataUpload.objects.filter(file_path__endswith='.part', upload_date__lt=cutoff):
+        try:
+            idle = time.time() - os.path.getmtime(upload.file_path)
+        except OSError:
+            idle = expiry  # The file is gone, nothing can be resumed
+        if idle < expiry:
+            continue
+        deleted = delete_upload(upload)
+        if deleted:
+            bump_data_version(upload.user)
+        removed += 1
+    if removed:
+        logger.warning('Removed %s abandoned chunked upload(s)', removed)
+    return removed
+
+
+def process_queue(poll_interval, wakeup=None, once=False, on_upload=None):
+    """
+    Worker loop: claim queued uploads and process them, requeueing stale
+    uploads and removing abandoned chunked uploads whenever the queue is
+    empty. Waits poll_interval seconds (or
+    until the `wakeup` event is set) between polls of an empty queue.
+    """
+    while True:
+        close_old_connections()
+        try:
+            upload = claim_next_upload()
+            if upload is None and requeue_stale_uploads():
+                upload = claim_next_upload()
+            if upload is None:
+                remove_abandoned_uploads()
+        except Exception:
+            logger.exception('Polling the ingestion queue failed')
+            upload = None
+        if upload is None:
+            if once:
+                break
+            if wakeup is None:
+                time.sleep(poll_interval)
+            elif wakeup.wait(poll_interval):
+                wakeup.clear()
+            continue
+
+        try:
+            run_upload_job(upload)
+        except Exception:
+            logger.exception('Ingestion job for upload %s crashed', upload.pk)
+        if on_upload:
+            on_upload(upload)
+    close_old_connections()
+
+
+class ThreadQueueBackend:
+    """
+    Local queue backend - queued uploads are processed by worker threads
+    inside the web server process (started by wsgi.py). The queue lives in
+    the database, so uploads queued before a restart are picked up again.
+    """
+    def __init__(self, workers):
+        self.wakeup = threading.Event()
+        for index in range(workers):
+            threading.Thread(
+                target=process_queue,
+                args=(settings.INGESTION_QUEUE_POLL_INTERVAL, self.wakeup),
+                name=f'ingestion-{index}',
+                daemon=True,
+            ).start()
+
+    def enqueue(self, upload):
+        # Wake a worker once the upload row is committed
+        transaction.on_commit(self.wakeup.set)
+
+
+class DatabaseQueueBackend:
+    """
+    Database queue backend - queued uploads stay in the table and are
+    picked up by `manage.py run_ingestion_worker` processes
+    """
+    def enqueue(self, upload):
+        pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_queue_backend():
+    """
+    Return the configured ingestion queue backend
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.INGESTION_QUEUE_BACKEND == 'database':
+                _backend = DatabaseQueueBackend()
+            elif settings.INGESTION_QUEUE_BACKEND == 'thread':
+                _backend = ThreadQueueBackend(settings.INGESTION_QUEUE_WORKERS)
+            else:
+                raise ValueError(
+                    f'Unknown INGESTION_QUEUE_BACKEND: {settings.INGESTION_QUEUE_BACKEND}'
+                )
+        return _backend
+
+
+def enqueue_upload(upload):
+    """
+    Mark an upload as queued and hand it to the queue backend
+    """
+    upload.processing_status = 'queued'
+    upload.save(update_fields=['processing_status'])
+    get_queue_backend().enqueue(upload)
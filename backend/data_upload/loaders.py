@@ -0,0 +1,201 @@
+import io
+from operator import itemgetter
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import StreamingHistory
+from .decoding import ROW_COLUMNS, RecordDecoder, parse_spotify_timestamps
+from .profiling import StageTimer
+
+
+# Natural key of a play, matching the unique_streaming_record constraint
+NATURAL_KEY_FIELDS = ('ts', 'track_id', 'spotify_episode_uri', 'ms_played')
+
+_natural_key = itemgetter(*(ROW_COLUMNS.index(field) for field in NATURAL_KEY_FIELDS))
+
+# Positional StreamingHistory arguments (in concrete field order) picked from
+# (id, user_id, upload_id, created_at) + a decoded row. Positional arguments
+# skip the keyword handling of Model.__init__.
+_MODEL_SOURCE = ('id', 'user_id', 'upload_id', 'created_at') + ROW_COLUMNS
+_model_args = itemgetter(*(_MODEL_SOURCE.index(field.attname) for field in StreamingHistory._meta.concrete_fields))
+
+
+def build_streaming_records(upload, rows):
+    """
+    Build unsaved StreamingHistory instances from decoded rows whose "ts"
+    is already parsed
+    """
+    prefix = (None, upload.user_id, upload.id, None)
+    return [StreamingHistory(*_model_args(prefix + row)) for row in rows]
+
+
+class OrmLoader:
+    """
+    Insert records through Django models and bulk_create (works on every database).
+    Records already stored for the user are skipped.
+    """
+    name = 'orm'
+
+    def __init__(self):
+        self.decoder = RecordDecoder()
+
+    def load(self, upload, items, timer=None):
+        timer = timer or StageTimer()
+        with timer.stage('decode'):
+            rows = self.decoder.decode(items, timer)
+            if not rows:
+                return 0
+            timestamps = parse_spotify_timestamps([row[0] for row in rows])
+            rows = [(ts,) + row[1:] for ts, row in zip(timestamps, rows)]
+        return self.load_rows(upload, rows, timer)
+
+    def load_rows(self, upload, rows, timer=None):
+        """
+        Insert decoded rows whose "ts" is already parsed
+        """
+        timer = timer or StageTimer()
+        if not rows:
+            return 0
+        timestamps = [row[0] for row in rows]
+
+        with timer.stage('dedup'):
+            # One query per batch fetches the keys already stored in its time range
+            existing = set(
+                StreamingHistory.objects
+                .filter(
+                    user_id=upload.user_id,
+                    ts__gte=min(timestamps),
+                    ts__lte=max(timestamps),
+                )
+                .order_by()
+                .values_list(*NATURAL_KEY_FIELDS)
+            )
+
+            new_rows = []
+            new_keys = set()
+            for row in rows:
+                key = _natural_key(row)
+                if key not in existing:
+                    existing.add(key)
+                    new_keys.add(key)
+                    new_rows.append(row)
+        if not new_rows:
+            return 0
+
+        # Model instances are only built for records that are not stored yet
+        with timer.stage('build'):
+            records = build_streaming_records(upload, new_rows)
+        # ignore_conflicts covers concurrent uploads of the same records
+        with timer.stage('insert'):
+            StreamingHistory.objects.bulk_create(records, batch_size=len(rows), ignore_conflicts=True)
+            # Rows another upload stored since the dedup query were skipped
+            # by the database, so only rows now stored under this upload count
+            stored = (
+                StreamingHistory.objects
+                .filter(
+                    user_id=upload.user_id,
+                    upload_id=upload.id,
+                    ts__gte=min(timestamps),
+                    ts__lte=max(timestamps),
+                )
+                .order_by()
+                .values_list(*NATURAL_KEY_FIELDS)
+            )
+            return sum(1 for key in stored if key in new_keys)
+
+
+def _copy_value(value):
+    """
+    Encode a single value for PostgreSQL COPY text format
+    """
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, str):
+        return (
+            value.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r')
+        )
+    return str(value)
+
+
+class CopyLoader:
+    """
+    Stream records into PostgreSQL with COPY FROM STDIN, skipping
+    model instantiation and multi-row INSERT statements. Rows are copied
+    into a temporary staging table and moved with ON CONFLICT DO NOTHING,
+    so records already stored for the user are skipped.
+    """
+    name = 'copy'
+
+    staging_table = 'data_upload_streaminghistory_staging'
+    columns = ('user_id', 'upload_id', 'created_at') + ROW_COLUMNS
+
+    def __init__(self):
+        self.decoder = RecordDecoder()
+        table = connection.ops.quote_name(StreamingHistory._meta.db_table)
+        columns = ', '.join(self.columns)
+        self.create_staging_sql = (
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS {self.staging_table} AS '
+            f'SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        self.copy_sql = f'COPY {self.staging_table} ({columns}) FROM STDIN'
+        self.insert_sql = (
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {self.staging_table} '
+            f'ON CONFLICT DO NOTHING'
+        )
+        self.truncate_sql = f'TRUNCATE {self.staging_table}'
+
+    def load(self, upload, items, timer=None):
+        timer = timer or StageTimer()
+        with timer.stage('decode'):
+            rows = self.decoder.decode(items, timer)
+        return self.load_rows(upload, rows, timer)
+
+    def load_rows(self, upload, rows, timer=None):
+        """
+        Copy decoded rows. "ts" may be a Spotify timestamp string or an
+        aware datetime, PostgreSQL parses the text of either.
+        """
+        timer = timer or StageTimer()
+        if not rows:
+            return 0
+
+        with timer.stage('build'):
+            # Spotify timestamps are ISO 8601 and are parsed by PostgreSQL directly
+            prefix = f'{upload.user_id}\t{upload.id}\t{timezone.now().isoformat()}\t'
+            buf = io.StringIO()
+            for row in rows:
+                buf.write(prefix + '\t'.join(map(_copy_value, row)) + '\n')
+            buf.seek(0)
+
+        with timer.stage('insert'), transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(self.create_staging_sql)
+            cursor.copy_expert(self.copy_sql, buf)
+            cursor.execute(self.insert_sql)
+            inserted = cursor.rowcount
+            cursor.execute(self.truncate_sql)
+        return inserted
+
+
+def get_loader(name=None):
+    """
+    Return the loader for the current database: COPY on PostgreSQL
+    (unless disabled with INGESTION_COPY_LOADER), the ORM path otherwise
+    """
+    if name is None:
+        use_copy = settings.INGESTION_COPY_LOADER and connection.vendor == 'postgresql'
+        name = 'copy' if use_copy else 'orm'
+
+    if name == 'copy':
+        if connection.vendor != 'postgresql':
+            raise ValueError('The COPY loader requires PostgreSQL')
+        return CopyLoader()
+    if name == 'orm':
+        return OrmLoader()
+    raise ValueError(f'Unknown loader: {name}')
@@ -0,0 +1,111 @@
+import os
+import time
+import tempfile
+import statistics
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Trunc
+from django.test.utils import override_settings
+from django.utils import timezone
+from data_upload import snapshots
+from data_upload.benchmarks import write_sample_file
+from data_upload.ingestion import process_streaming_history_file
+from data_upload.models import SpotifyDataUpload, StreamingHistory, DailyTrackStats
+from data_upload.rollups import rebuild_daily_stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare top tracks and monthly stats computed from raw rows (ORM), '
+        'the daily rollup and the NumPy snapshot on a synthetic history'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=100000, help='Number of synthetic records')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(SNAPSHOT_DIR=tmp):
+            json_path = os.path.join(tmp, 'Streaming_History_Audio_benchmark.json')
+            write_sample_file(json_path, options['records'])
+
+            # Everything is rolled back so the benchmark leaves no data behind
+            with transaction.atomic():
+                user = User.objects.create(username='__analytics_benchmark__', email='benchmark@example.invalid')
+                upload = SpotifyDataUpload.objects.create(user=user, file_path=json_path, file_size=0)
+                stats = process_streaming_history_file(upload, json_path)
+                self.stdout.write(f'Loaded {stats.inserted} records')
+
+                self.report('rollup build', [self.timed(lambda: rebuild_daily_stats(user))])
+                user.refresh_from_db(fields=['data_version'])
+                self.report('snapshot build', [self.timed(lambda: snapshots.build_snapshot(user))])
+
+                self.run_queries(user, options['repeat'])
+                transaction.set_rollback(True)
+
+    def run_queries(self, user, repeat):
+        tz = timezone.get_current_timezone()
+        queries = [
+            ('top tracks / orm', lambda: list(
+                StreamingHistory.objects.filter(user=user, track__isnull=False)
+                .values('track_id')
+                .annotate(play_count=models.Count('id'), total_ms_played=models.Sum('ms_played'))
+                .order_by('-play_count')[:50]
+            )),
+            ('top tracks / rollup', lambda: list(
+                DailyTrackStats.objects.filter(user=user, track__isnull=False)
+                .values('track_id')
+                .annotate(play_count=models.Sum('play_count'), total_ms_played=models.Sum('ms_played'))
+                .order_by('-play_count')[:50]
+            )),
+            ('top tracks / snapshot', lambda: snapshots.top_tracks(snapshots.get_snapshot(user), limit=50)),
+            ('monthly / orm', lambda: list(
+                StreamingHistory.objects.filter(user=user)
+                .annotate(period=Trunc('ts', 'month', output_field=models.DateField(), tzinfo=tz))
+                .values('period')
+                .annotate(total_ms=models.Sum('ms_played'), play_count=models.Count('id'))
+                .order_by('period')
+            )),
+            ('monthly / rollup', lambda: list(
+                DailyTrackStats.objects.filter(user=user)
+                .annotate(period=Trunc('day', 'month', output_field=models.DateField()))
+                .values('period')
+                .annotate(total_ms=models.Sum('ms_played'), play_count=models.Sum('play_count'))
+                .order_by('period')
+            )),
+            ('monthly / snapshot', lambda: snapshots.listening_periods(
+                snapshots.get_snapshot(user), 'month', tz
+            )),
+        ]
+        results = {}
+        for name, query in queries:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                results[name] = query()
+                timings.append(time.perf_counter() - started)
+            self.report(name, timings)
+
+        # All engines must agree on the numbers
+        for kind in ('top tracks', 'monthly'):
+            totals = {
+                name: sorted(row['play_count'] for row in rows)
+                for name, rows in results.items() if name.startswith(kind)
+            }
+            consistent = len({tuple(values) for values in totals.values()}) == 1
+            style = self.style.SUCCESS if consistent else self.style.ERROR
+            self.stdout.write(style(f'{kind}: results {"match" if consistent else "DIFFER"}'))
+
+    def timed(self, func):
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    def report(self, name, timings):
+        self.stdout.write(
+            f'{name:>22}: best {min(timings) * 1000:9.2f} ms, '
+            f'median {statistics.median(timings) * 1000:9.2f} ms'
+        )
@@ -0,0 +1,53 @@
+import os
+import time
+import tempfile
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from data_upload.benchmarks import write_sample_file
+from data_upload.ingestion import process_streaming_history_file
+from data_upload.loaders import get_loader
+from data_upload.models import SpotifyDataUpload
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare StreamingHistory loaders (rows/sec) on a synthetic history file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=100000, help='Number of synthetic records')
+        parser.add_argument('--batch-size', type=int, default=None, help='Records per batch')
+        parser.add_argument('--loaders', default='orm,copy', help='Comma separated loader names')
+
+    def handle(self, *args, **options):
+        loaders = [name.strip() for name in options['loaders'].split(',') if name.strip()]
+        if connection.vendor != 'postgresql' and 'copy' in loaders:
+            self.stdout.write(self.style.WARNING('COPY loader requires PostgreSQL - skipping it'))
+            loaders.remove('copy')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, 'Streaming_History_Audio_benchmark.json')
+            write_sample_file(json_path, options['records'])
+            self.stdout.write(f"Generated {options['records']} records ({os.path.getsize(json_path)} bytes)")
+
+            for name in loaders:
+                elapsed, count = self.run_loader(name, json_path, options['batch_size'])
+                self.stdout.write(
+                    f'{name:>6}: {count} rows in {elapsed:.2f}s - {count / elapsed:,.0f} rows/sec'
+                )
+
+    def run_loader(self, name, json_path, batch_size):
+        # Everything is rolled back so the benchmark leaves no data behind
+        with transaction.atomic():
+            user = User.objects.create(username='__ingestion_benchmark__', email='benchmark@example.invalid')
+            upload = SpotifyDataUpload.objects.create(user=user, file_path=json_path, file_size=0)
+            loader = get_loader(name)
+
+            started = time.perf_counter()
+            stats = process_streaming_history_file(upload, json_path, batch_size=batch_size, loader=loader)
+            count = stats.inserted + stats.duplicates
+            elapsed = time.perf_counter() - started
+
+            transaction.set_rollback(True)
+        return elapsed, count
@@ -0,0 +1,124 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+from django.db.models.functions import Trunc, TruncDate
+from data_upload.models import User, DailyTrackStats, StreamingHistory
+from data_upload.rollups import day_start
+
+
+class Command(BaseCommand):
+    help = (
+        'Print query plans (EXPLAIN ANALYZE on PostgreSQL) of the analytics queries for one user. '
+        'Run before and after a schema change with --output to compare plans.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='User id (default: user with the most plays)')
+        parser.add_argument('--start-date', help='Start date (YYYY-MM-DD) for the date range queries')
+        parser.add_argument('--end-date', help='End date (YYYY-MM-DD) for the date range queries')
+        parser.add_argument(
+            '--tz', default='America/New_York',
+            help='Time zone of the listening stats query outside TIME_ZONE (default: America/New_York)'
+        )
+        parser.add_argument('--output', help='Also write the plans to this file')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        start_date = self.parse_date(options['start_date'])
+        end_date = self.parse_date(options['end_date'])
+        try:
+            tzinfo = ZoneInfo(options['tz'])
+        except (ZoneInfoNotFoundError, ValueError):
+            raise CommandError(f'Invalid time zone: {options["tz"]}')
+        if options['tz'] == settings.TIME_ZONE:
+            raise CommandError('--tz must differ from TIME_ZONE, which is served by the daily rollup')
+
+        explain_options = {}
+        if connection.vendor == 'postgresql':
+            explain_options = {'analyze': True, 'buffers': True}
+
+        lines = [f'# {connection.vendor}, user {user.pk}, range {start_date} - {end_date}, tz {tzinfo}']
+        for name, query in self.get_queries(user, start_date, end_date, tzinfo):
+            lines.append(f'\n## {name}\n')
+            lines.append(query.explain(**explain_options))
+
+        report = '\n'.join(lines)
+        self.stdout.write(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(report + '\n')
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            try:
+                return User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                raise CommandError(f'User {user_id} does not exist')
+
+        user = (
+            User.objects.annotate(plays=models.Count('streaming_history'))
+            .order_by('-plays')
+            .first()
+        )
+        if user is None:
+            raise CommandError('No users found')
+        return user
+
+    def parse_date(self, value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}. Use YYYY-MM-DD')
+
+    def get_queries(self, user, start_date, end_date, tzinfo):
+        """
+        Querysets with the same shape as the statistics endpoints and ingestion
+        """
+        stats = DailyTrackStats.objects.filter(user=user)
+        history = StreamingHistory.objects.filter(user=user)
+        # Range of get_monthly_listening_stats in another time zone
+        history_tz = StreamingHistory.objects.filter(user=user)
+        if start_date:
+            stats = stats.filter(day__gte=start_date)
+            history = history.filter(ts__gte=day_start(start_date))
+            history_tz = history_tz.filter(ts__gte=datetime.combine(start_date, time.min, tzinfo=tzinfo))
+        if end_date:
+            stats = stats.filter(day__lte=end_date)
+            history = history.filter(ts__lt=day_start(end_date, offset=1))
+            history_tz = history_tz.filter(
+                ts__lt=datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tzinfo)
+            )
+
+        ranked = dict(play_count=models.Sum('play_count'), total_ms_played=models.Sum('ms_played'))
+
+        return [
+            ('streaming_stats', stats.values('user').annotate(
+                records=models.Sum('play_count'), total=models.Sum('ms_played')
+            ).order_by()),
+            ('top_tracks', stats.filter(track__isnull=False).values('track_id').annotate(
+                **ranked
+            ).order_by('-play_count')[:50]),
+            ('spotify_playlist_tracks', stats.filter(
+                track__name__isnull=False, track__spotify_uri__isnull=False
+            ).values('track_id').annotate(**ranked).order_by('-play_count')[:50]),
+            ('listening_stats_month', stats.annotate(
+                period=Trunc('day', 'month', output_field=models.DateField())
+            ).values('period').annotate(
+                total_ms=models.Sum('ms_played'), play_count=models.Sum('play_count')
+            ).order_by('period')),
+            ('listening_stats_other_tz', history_tz.annotate(
+                period=Trunc('ts', 'month', output_field=models.DateField(), tzinfo=tzinfo)
+            ).values('period').annotate(
+                total_ms=models.Sum('ms_played'), play_count=models.Count('id')
+            ).order_by('period')),
+            ('incremental_cutoff', StreamingHistory.objects.filter(user=user).values('user').annotate(
+                latest=models.Max('ts')
+            ).order_by()),
+            ('daily_rollup_rebuild', history.annotate(day=TruncDate('ts')).values(
+                'day', 'track_id'
+            ).annotate(play_count=models.Count('id'), ms_played=models.Sum('ms_played')).order_by()),
+        ]
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from data_upload.models import User
+from data_upload.columnar import write_history_parquet
+
+
+class Command(BaseCommand):
+    help = "Export a user's streaming history to a compressed Parquet file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, required=True, help='User id')
+        parser.add_argument('--output', required=True, help='Path of the .parquet file to write')
+        parser.add_argument('--chunk-size', type=int, help='Rows per row group (default EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist')
+
+        with open(options['output'], 'wb') as f:
+            count = write_history_parquet(user, f, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Exported {count} records to {options["output"]}'))
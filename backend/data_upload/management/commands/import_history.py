@@ -0,0 +1,61 @@
+import os
+import shutil
+from datetime import datetime
+from time import perf_counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from data_upload.models import User, SpotifyDataUpload
+from data_upload.jobs import run_upload_job
+
+
+class Command(BaseCommand):
+    help = 'Import a Parquet history export (or a Spotify data ZIP) for a user, skipping stored plays'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the .parquet or .zip file')
+        parser.add_argument('--user', type=int, required=True, help='User id')
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Only import records newer than the user's latest stored play"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist')
+
+        source_path = os.path.abspath(options['path'])
+        if not os.path.isfile(source_path):
+            raise CommandError(f'File not found: {source_path}')
+        extension = os.path.splitext(source_path)[1].lower()
+        if extension not in ('.zip', '.parquet'):
+            raise CommandError('File must be a ZIP archive or a Parquet export')
+
+        # Imports are recorded and processed like uploads, in this process. The
+        # file is copied to the user's upload directory: deleting the user's
+        # data removes upload files, which must never be the operator's original.
+        user_upload_dir = os.path.join(settings.UPLOAD_DIR, str(user.pk))
+        os.makedirs(user_upload_dir, exist_ok=True)
+        upload = SpotifyDataUpload.objects.create(
+            user=user,
+            file_path='',
+            file_size=os.path.getsize(source_path),
+            processing_status='uploaded',
+            incremental=options['incremental'],
+        )
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        upload.file_path = os.path.join(user_upload_dir, f'spotify_data_{timestamp}_{upload.pk}{extension}')
+        started = perf_counter()
+        shutil.copyfile(source_path, upload.file_path)
+        upload.timings = {'stages': {'save': round(perf_counter() - started, 4)}}
+        upload.save(update_fields=['file_path', 'timings'])
+
+        run_upload_job(upload)
+
+        self.stdout.write(
+            f'Upload {upload.pk}: {upload.processing_status}, {upload.records_inserted} new, '
+            f'{upload.records_duplicate} duplicate, {upload.records_skipped} skipped'
+        )
+        if upload.error_message:
+            self.stderr.write(upload.error_message)
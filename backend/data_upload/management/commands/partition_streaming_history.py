@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from data_upload.models import StreamingHistory
+from data_upload.partitioning import build_partition_sql, get_partition_strategy, iter_range_bounds
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert StreamingHistory into a PostgreSQL partitioned table - by hash of user '
+        '(cheap per-user deletes) or by ts range (date range queries prune partitions)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', choices=('hash', 'range'), default='hash')
+        parser.add_argument('--partitions', type=int, default=16, help='Number of hash partitions')
+        parser.add_argument('--interval', choices=('year', 'month'), default='year', help='Range partition size')
+        parser.add_argument(
+            '--future', type=int, default=2,
+            help='Range partitions created ahead of the latest stored play'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only print the SQL statements')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+        if get_partition_strategy():
+            raise CommandError(f'{StreamingHistory._meta.db_table} is already partitioned')
+        if options['partitions'] < 1:
+            raise CommandError('--partitions must be at least 1')
+
+        bounds = ()
+        if options['strategy'] == 'range':
+            bounds = list(self.get_range_bounds(options['interval'], options['future']))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            statements = build_partition_sql(
+                cursor, options['strategy'], partitions=options['partitions'], bounds=bounds
+            )
+            for sql in statements:
+                self.stdout.write(sql + ';')
+                if not options['dry_run']:
+                    cursor.execute(sql)
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'{StreamingHistory._meta.db_table} is now partitioned by {options["strategy"]}'
+            ))
+
+    def get_range_bounds(self, interval, future):
+        span = StreamingHistory.objects.aggregate(first=Min('ts'), last=Max('ts'))
+        today = timezone.now().date()
+        first = span['first'].date() if span['first'] else today
+        last = max(span['last'].date() if span['last'] else today, today)
+        if interval == 'year':
+            last = last.replace(year=last.year + future, day=1)
+        else:
+            month = last.month - 1 + future
+            last = last.replace(year=last.year + month // 12, month=month % 12 + 1, day=1)
+        return iter_range_bounds(first, last, interval)
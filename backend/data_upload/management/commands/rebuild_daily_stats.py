@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from data_upload.models import User
+from data_upload.rollups import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily listening rollup from the raw streaming history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='User id (repeatable, default: all users)')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user']:
+            users = users.filter(pk__in=options['user'])
+
+        for user in users.iterator():
+            rebuild_daily_stats(user)
+            self.stdout.write(f'Rebuilt daily stats for user {user.pk}')
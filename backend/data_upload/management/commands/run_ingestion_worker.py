@@ -0,0 +1,29 @@
+import threading
+from django.core.management.base import BaseCommand
+from data_upload.jobs import process_queue
+
+
+class Command(BaseCommand):
+    help = 'Process queued Spotify data uploads (INGESTION_QUEUE_BACKEND=database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker threads')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between queue polls')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        threads = [
+            threading.Thread(
+                target=process_queue,
+                args=(options['poll_interval'],),
+                kwargs={'once': options['once'], 'on_upload': self.report},
+            )
+            for _ in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def report(self, upload):
+        self.stdout.write(f'Upload {upload.pk}: {upload.processing_status}')
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0002_alter_streaminghistory_incognito_mode_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='error_message',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='files_processed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='files_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='records_inserted',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0003_spotifydataupload_error_message_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=500)),
+                ('status', models.CharField(default='pending', max_length=50)),
+                ('records_inserted', models.BigIntegerField(default=0)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='data_upload.spotifydataupload')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
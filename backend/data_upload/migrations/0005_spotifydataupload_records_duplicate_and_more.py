@@ -0,0 +1,55 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+NATURAL_KEY = ('user', 'ts', 'spotify_track_uri', 'spotify_episode_uri', 'ms_played')
+
+
+def remove_duplicate_records(apps, schema_editor):
+    """
+    Keep only the oldest row of every natural key so the unique constraint can be created
+    """
+    StreamingHistory = apps.get_model('data_upload', 'StreamingHistory')
+    duplicates = (
+        StreamingHistory.objects
+        .values(*NATURAL_KEY)
+        .annotate(keep_id=models.Min('id'), copies=models.Count('id'))
+        .filter(copies__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates.iterator():
+        lookup = {}
+        for field in NATURAL_KEY:
+            if duplicate[field] is None:
+                lookup[f'{field}__isnull'] = True
+            else:
+                lookup[field] = duplicate[field]
+        StreamingHistory.objects.filter(**lookup).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0004_uploadfile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='records_duplicate',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadfile',
+            name='records_duplicate',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='streaminghistory',
+            constraint=models.UniqueConstraint(fields=('user', 'ts', 'spotify_track_uri', 'spotify_episode_uri', 'ms_played'), name='unique_streaming_record', nulls_distinct=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0005_spotifydataupload_records_duplicate_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='records_skipped',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadfile',
+            name='records_skipped',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,102 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0006_spotifydataupload_incremental_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=500, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Platform',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Reason',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=500)),
+                ('artist', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='albums', to='data_upload.artist')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('name', 'artist'), name='unique_album', nulls_distinct=False)],
+            },
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=500, null=True)),
+                ('spotify_uri', models.CharField(blank=True, max_length=255, null=True)),
+                ('album', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tracks', to='data_upload.album')),
+                ('artist', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tracks', to='data_upload.artist')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('name', 'artist', 'album', 'spotify_uri'), name='unique_track', nulls_distinct=False)],
+            },
+        ),
+
+        # Move the old text columns out of the way of the new foreign keys
+        migrations.RemoveConstraint(
+            model_name='streaminghistory',
+            name='unique_streaming_record',
+        ),
+        migrations.RemoveIndex(
+            model_name='streaminghistory',
+            name='data_upload_master__696fa7_idx',
+        ),
+        migrations.RenameField(
+            model_name='streaminghistory',
+            old_name='platform',
+            new_name='platform_name',
+        ),
+        migrations.RenameField(
+            model_name='streaminghistory',
+            old_name='reason_start',
+            new_name='reason_start_name',
+        ),
+        migrations.RenameField(
+            model_name='streaminghistory',
+            old_name='reason_end',
+            new_name='reason_end_name',
+        ),
+        migrations.AddField(
+            model_name='streaminghistory',
+            name='track',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='plays', to='data_upload.track'),
+        ),
+        migrations.AddField(
+            model_name='streaminghistory',
+            name='platform',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='data_upload.platform'),
+        ),
+        migrations.AddField(
+            model_name='streaminghistory',
+            name='reason_start',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='data_upload.reason'),
+        ),
+        migrations.AddField(
+            model_name='streaminghistory',
+            name='reason_end',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='data_upload.reason'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 5000
+
+
+def _clean(value):
+    # Empty strings and NULLs both mean "no value" in the dimension tables
+    return value or None
+
+
+def populate_dimensions(apps, schema_editor):
+    """
+    Intern the text columns of existing rows into the dimension tables
+    and point every row at its dimension ids
+    """
+    StreamingHistory = apps.get_model('data_upload', 'StreamingHistory')
+    Artist = apps.get_model('data_upload', 'Artist')
+    Album = apps.get_model('data_upload', 'Album')
+    Track = apps.get_model('data_upload', 'Track')
+    Platform = apps.get_model('data_upload', 'Platform')
+    Reason = apps.get_model('data_upload', 'Reason')
+
+    cache = {}
+
+    def intern(model, **key):
+        cache_key = (model.__name__,) + tuple(key.values())
+        if cache_key not in cache:
+            cache[cache_key] = model.objects.get_or_create(**key)[0].id
+        return cache[cache_key]
+
+    def intern_name(model, name):
+        name = _clean(name)
+        return intern(model, name=name) if name else None
+
+    last_id = 0
+    while True:
+        rows = list(
+            StreamingHistory.objects
+            .filter(id__gt=last_id)
+            .order_by('id')
+            .values_list(
+                'id', 'master_metadata_track_name', 'master_metadata_album_artist_name',
+                'master_metadata_album_album_name', 'spotify_track_uri',
+                'platform_name', 'reason_start_name', 'reason_end_name'
+            )[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for row_id, track_name, artist_name, album_name, uri, platform, reason_start, reason_end in rows:
+            track_name, album_name, uri = _clean(track_name), _clean(album_name), _clean(uri)
+            artist_id = intern_name(Artist, artist_name)
+            album_id = intern(Album, name=album_name, artist_id=artist_id) if album_name else None
+            track_id = None
+            if track_name or uri:
+                track_id = intern(
+                    Track, name=track_name, artist_id=artist_id, album_id=album_id, spotify_uri=uri
+                )
+
+            updates.append(StreamingHistory(
+                id=row_id,
+                track_id=track_id,
+                platform_id=intern_name(Platform, platform),
+                reason_start_id=intern_name(Reason, reason_start),
+                reason_end_id=intern_name(Reason, reason_end),
+            ))
+
+        StreamingHistory.objects.bulk_update(
+            updates, ['track_id', 'platform_id', 'reason_start_id', 'reason_end_id'], batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0007_dimension_tables'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_dimensions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+from django.db import migrations, models
+
+
+NATURAL_KEY = ('user', 'ts', 'track', 'spotify_episode_uri', 'ms_played')
+
+
+def remove_duplicate_records(apps, schema_editor):
+    """
+    Keep only the oldest row of every natural key. Plays that differed only
+    in an empty versus missing track value were distinct before, but share
+    a track since the dimension tables treat both as no value.
+    """
+    StreamingHistory = apps.get_model('data_upload', 'StreamingHistory')
+    duplicates = (
+        StreamingHistory.objects
+        .values(*NATURAL_KEY)
+        .annotate(keep_id=models.Min('id'), copies=models.Count('id'))
+        .filter(copies__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates.iterator():
+        lookup = {}
+        for field in NATURAL_KEY:
+            if duplicate[field] is None:
+                lookup[f'{field}__isnull'] = True
+            else:
+                lookup[field] = duplicate[field]
+        StreamingHistory.objects.filter(**lookup).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0008_populate_dimension_tables'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='master_metadata_track_name',
+        ),
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='master_metadata_album_artist_name',
+        ),
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='master_metadata_album_album_name',
+        ),
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='spotify_track_uri',
+        ),
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='platform_name',
+        ),
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='reason_start_name',
+        ),
+        migrations.RemoveField(
+            model_name='streaminghistory',
+            name='reason_end_name',
+        ),
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='streaminghistory',
+            constraint=models.UniqueConstraint(fields=('user', 'ts', 'track', 'spotify_episode_uri', 'ms_played'), name='unique_streaming_record', nulls_distinct=False),
+        ),
+    ]
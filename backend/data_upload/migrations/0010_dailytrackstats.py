@@ -0,0 +1,61 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+BATCH_SIZE = 1000
+
+
+def populate_daily_stats(apps, schema_editor):
+    """
+    Build the rollup from the streaming history already stored
+    """
+    StreamingHistory = apps.get_model('data_upload', 'StreamingHistory')
+    DailyTrackStats = apps.get_model('data_upload', 'DailyTrackStats')
+
+    rows = (
+        StreamingHistory.objects
+        .annotate(day=TruncDate('ts'))
+        .values('user_id', 'day', 'track_id')
+        .annotate(play_count=Count('id'), ms_played=Sum('ms_played'))
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator():
+        batch.append(DailyTrackStats(**row))
+        if len(batch) >= BATCH_SIZE:
+            DailyTrackStats.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        DailyTrackStats.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0009_remove_streaminghistory_text_columns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTrackStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('play_count', models.IntegerField(default=0)),
+                ('ms_played', models.BigIntegerField(default=0)),
+                ('track', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='data_upload.track')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_track_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailytrackstats',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'track'), name='unique_daily_track_stats', nulls_distinct=False),
+        ),
+        migrations.RunPython(populate_daily_stats, migrations.RunPython.noop),
+    ]
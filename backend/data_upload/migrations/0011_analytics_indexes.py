@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0010_dailytrackstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='streaminghistory',
+            name='data_upload_user_id_dcfc6d_idx',
+        ),
+        migrations.AddIndex(
+            model_name='dailytrackstats',
+            index=models.Index(fields=['user', 'day'], include=('play_count', 'ms_played'), name='dailystats_user_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailytrackstats',
+            index=models.Index(condition=models.Q(('track__isnull', False)), fields=['user', 'day'], include=('track', 'play_count', 'ms_played'), name='dailystats_music_idx'),
+        ),
+    ]
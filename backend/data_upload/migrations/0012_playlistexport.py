@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0011_analytics_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_playlist_id', models.CharField(max_length=100)),
+                ('playlist_url', models.CharField(blank=True, max_length=500)),
+                ('name', models.CharField(max_length=255)),
+                ('track_uris', models.JSONField(default=list)),
+                ('tracks_added', models.IntegerField(default=0)),
+                ('status', models.CharField(default='in_progress', max_length=20)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='playlist_exports', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
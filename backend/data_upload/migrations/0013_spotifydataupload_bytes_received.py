@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-17 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0012_playlistexport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='bytes_received',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
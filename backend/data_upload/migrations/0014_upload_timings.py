@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-17 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_upload', '0013_spotifydataupload_bytes_received'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='profile',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='spotifydataupload',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='uploadfile',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
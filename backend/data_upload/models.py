@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connection, connections, models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 User = get_user_model()
 
+# Seconds between heartbeats of an upload being processed
+HEARTBEAT_INTERVAL = 30
+
 
 class SpotifyDataUpload(models.Model):
     """
@@ -15,11 +19,168 @@ class SpotifyDataUpload(models.Model):
     processed = models.BooleanField(default=False)
     processing_status = models.CharField(max_length=50, default='pending')
     
+    # Background processing progress
+    files_total = models.IntegerField(default=0)
+    files_processed = models.IntegerField(default=0)
+    records_inserted = models.BigIntegerField(default=0)
+    records_duplicate = models.BigIntegerField(default=0)
+    records_skipped = models.BigIntegerField(default=0)
+    error_message = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    # Only ingest records newer than the user's latest stored play
+    incremental = models.BooleanField(default=False)
+    
+    # Bytes stored so far by a chunked upload (processing_status 'uploading')
+    bytes_received = models.BigIntegerField(default=0)
+    
+    # Last sign of life of the worker processing the upload
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    
+    # Per-stage processing times and counters (see profiling.StageTimer)
+    timings = models.JSONField(default=dict, blank=True)
+    # Capture a cProfile of the processing (INGESTION_PROFILING)
+    profile = models.BooleanField(default=False)
+    
     class Meta:
         ordering = ['-upload_date']
     
     def __str__(self):
         return f"{self.user.username} - {self.upload_date}"
+    
+    def add_progress(self, files=0, records=0, duplicates=0, skipped=0):
+        """
+        Atomically increment the progress counters in the database
+        """
+        SpotifyDataUpload.objects.filter(pk=self.pk).update(
+            files_processed=models.F('files_processed') + files,
+            records_inserted=models.F('records_inserted') + records,
+            records_duplicate=models.F('records_duplicate') + duplicates,
+            records_skipped=models.F('records_skipped') + skipped,
+        )
+        self.files_processed += files
+        self.records_inserted += records
+        self.records_duplicate += duplicates
+        self.records_skipped += skipped
+    
+    def heartbeat(self):
+        """
+        Record that the upload is still being processed (at most every
+        HEARTBEAT_INTERVAL seconds). Uploads without a recent heartbeat are
+        requeued, see jobs.requeue_stale_uploads.
+        """
+        now = timezone.now()
+        if self.heartbeat_at and (now - self.heartbeat_at).total_seconds() < HEARTBEAT_INTERVAL:
+            return
+        self.heartbeat_at = now
+        if not connection.in_atomic_block or connection.vendor == 'sqlite':
+            # SQLite has a single writer, a second connection would wait for the transaction
+            SpotifyDataUpload.objects.filter(pk=self.pk).update(heartbeat_at=now)
+            return
+
+        # Inside the transaction of a file the update would only be seen once
+        # the file is committed, so it is written on a connection of its own
+        heartbeat_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with heartbeat_connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {heartbeat_connection.ops.quote_name(self._meta.db_table)} '
+                    f'SET heartbeat_at = %s WHERE id = %s',
+                    [heartbeat_connection.ops.adapt_datetimefield_value(now), self.pk]
+                )
+        finally:
+            heartbeat_connection.close()
+
+
+class UploadFile(models.Model):
+    """
+    Model to track the outcome of each streaming history file in an upload
+    """
+    upload = models.ForeignKey(SpotifyDataUpload, on_delete=models.CASCADE, related_name='files')
+    name = models.CharField(max_length=500)
+    status = models.CharField(max_length=50, default='pending')
+    records_inserted = models.BigIntegerField(default=0)
+    records_duplicate = models.BigIntegerField(default=0)
+    records_skipped = models.BigIntegerField(default=0)
+    error_message = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    timings = models.JSONField(default=dict, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.name} - {self.status}"
+
+
+class Artist(models.Model):
+    """
+    Dimension table of artist names shared by all users
+    """
+    name = models.CharField(max_length=500, unique=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class Album(models.Model):
+    """
+    Dimension table of albums, identified by name and artist
+    """
+    name = models.CharField(max_length=500)
+    artist = models.ForeignKey(Artist, on_delete=models.PROTECT, related_name='albums', blank=True, null=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'artist'], name='unique_album', nulls_distinct=False),
+        ]
+    
+    def __str__(self):
+        return self.name
+
+
+class Track(models.Model):
+    """
+    Dimension table of tracks, identified by name, artist, album and Spotify URI
+    """
+    name = models.CharField(max_length=500, blank=True, null=True)
+    artist = models.ForeignKey(Artist, on_delete=models.PROTECT, related_name='tracks', blank=True, null=True)
+    album = models.ForeignKey(Album, on_delete=models.PROTECT, related_name='tracks', blank=True, null=True)
+    spotify_uri = models.CharField(max_length=255, blank=True, null=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'artist', 'album', 'spotify_uri'],
+                name='unique_track',
+                nulls_distinct=False,
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.name}"
+
+
+class Platform(models.Model):
+    """
+    Dimension table of client platform strings
+    """
+    name = models.CharField(max_length=255, unique=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class Reason(models.Model):
+    """
+    Dimension table of playback start/end reasons
+    """
+    name = models.CharField(max_length=100, unique=True)
+    
+    def __str__(self):
+        return self.name
 
 
 class StreamingHistory(models.Model):
@@ -32,25 +193,22 @@ class StreamingHistory(models.Model):
     # Spotify data fields
     ts = models.DateTimeField()  # timestamp
     username = models.CharField(max_length=255)
-    platform = models.CharField(max_length=100, blank=True, null=True)
+    platform = models.ForeignKey(Platform, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
     ms_played = models.IntegerField()  # milliseconds played
     conn_country = models.CharField(max_length=10, blank=True, null=True)
     ip_addr_decrypted = models.GenericIPAddressField(blank=True, null=True)
     user_agent_decrypted = models.TextField(blank=True, null=True)
     
-    # Track info
-    master_metadata_track_name = models.CharField(max_length=500, blank=True, null=True)
-    master_metadata_album_artist_name = models.CharField(max_length=500, blank=True, null=True)
-    master_metadata_album_album_name = models.CharField(max_length=500, blank=True, null=True)
-    spotify_track_uri = models.CharField(max_length=255, blank=True, null=True)
+    # Track info (track name, artist, album and URI live in the dimension tables)
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, related_name='plays', blank=True, null=True)
     
     # Additional metadata
     episode_name = models.CharField(max_length=500, blank=True, null=True)
     episode_show_name = models.CharField(max_length=500, blank=True, null=True)
     spotify_episode_uri = models.CharField(max_length=255, blank=True, null=True)
     
-    reason_start = models.CharField(max_length=100, blank=True, null=True)
-    reason_end = models.CharField(max_length=100, blank=True, null=True)
+    reason_start = models.ForeignKey(Reason, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
+    reason_end = models.ForeignKey(Reason, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
     shuffle = models.BooleanField(default=False, null=True, blank=True)
     skipped = models.BooleanField(default=False, null=True, blank=True)
     offline = models.BooleanField(default=False, null=True, blank=True)
@@ -61,10 +219,79 @@ class StreamingHistory(models.Model):
     
     class Meta:
         ordering = ['-ts']
+        constraints = [
+            # Natural identity of a play - re-uploaded records with the same key are skipped.
+            # Its (user, ts, track, ..., ms_played) index also serves every per-user time
+            # range query on this table (latest play, rollup rebuild, stats in other time zones)
+            models.UniqueConstraint(
+                fields=['user', 'ts', 'track', 'spotify_episode_uri', 'ms_played'],
+                name='unique_streaming_record',
+                nulls_distinct=False,
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.track} - {self.ts}"
+
+
+class DailyTrackStats(models.Model):
+    """
+    Rollup of streaming history per user, day and track, used by the
+    statistics endpoints instead of scanning individual plays.
+    Days are calendar days in settings.TIME_ZONE.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_track_stats')
+    day = models.DateField()
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
+    play_count = models.IntegerField(default=0)
+    ms_played = models.BigIntegerField(default=0)
+    
+    class Meta:
         indexes = [
-            models.Index(fields=['user', 'ts']),
-            models.Index(fields=['master_metadata_track_name']),
+            # Index-only scans for totals and per-period sums over a day range
+            models.Index(
+                fields=['user', 'day'],
+                include=['play_count', 'ms_played'],
+                name='dailystats_user_day_idx',
+            ),
+            # Music rows only - top tracks and playlist generation
+            models.Index(
+                fields=['user', 'day'],
+                include=['track', 'play_count', 'ms_played'],
+                condition=models.Q(track__isnull=False),
+                name='dailystats_music_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'day', 'track'],
+                name='unique_daily_track_stats',
+                nulls_distinct=False,
+            ),
         ]
     
     def __str__(self):
-        return f"{self.master_metadata_track_name} - {self.ts}"
+        return f"{self.user.username} - {self.day} - {self.track}"
+
+
+class PlaylistExport(models.Model):
+    """
+    Playlist created on Spotify from the user's top tracks, with the
+    progress of adding its tracks so a failed export can be resumed
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='playlist_exports')
+    spotify_playlist_id = models.CharField(max_length=100)
+    playlist_url = models.CharField(max_length=500, blank=True)
+    name = models.CharField(max_length=255)
+    track_uris = models.JSONField(default=list)
+    tracks_added = models.IntegerField(default=0)
+    status = models.CharField(max_length=20, default='in_progress')  # in_progress, completed, failed
+    error_message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.name} ({self.tracks_added}/{len(self.track_uris)})"
@@ -0,0 +1,66 @@
+from base64 import b64decode, b64encode
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over (ts, id), newest plays first. Each page is a
+    range scan continuing after the last row of the previous page, so deep
+    pages cost the same as the first one and no COUNT query is run.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, page_size))
+        except ValueError:
+            pass
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            ts, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(ts__lt=ts) | Q(ts=ts, id__lt=pk))
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset.order_by('-ts', '-id')[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def encode_cursor(self, row):
+        value = f'{row.ts.isoformat()}|{row.id}'
+        return b64encode(value.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            ts, pk = b64decode(cursor.encode(), validate=True).decode().split('|')
+            return datetime.fromisoformat(ts), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
@@ -0,0 +1,117 @@
+from datetime import date
+from django.db import connection
+from .models import StreamingHistory
+
+
+# Partition key column of each supported layout
+PARTITION_KEYS = {
+    'hash': 'user_id',
+    'range': 'ts',
+}
+
+_STRATEGIES = {'h': 'hash', 'r': 'range', 'l': 'list'}
+
+
+def get_partition_strategy():
+    """
+    Return 'hash' or 'range' when StreamingHistory is a partitioned
+    PostgreSQL table, None for a regular table
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT partstrat FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+            [StreamingHistory._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return _STRATEGIES.get(row[0]) if row else None
+
+
+def iter_range_bounds(first, last, interval):
+    """
+    Yield (suffix, start, end) partition bounds covering the dates first..last
+    by year or month
+    """
+    if interval == 'year':
+        for year in range(first.year, last.year + 1):
+            yield f'y{year}', date(year, 1, 1), date(year + 1, 1, 1)
+        return
+
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        yield f'm{year}_{month:02d}', date(year, month, 1), date(next_year, next_month, 1)
+        year, month = next_year, next_month
+
+
+def build_partition_sql(cursor, strategy, partitions=16, bounds=()):
+    """
+    Return the statements converting StreamingHistory into a partitioned
+    table with the same columns, constraints and indexes. Rows are copied
+    into the new table, which then takes over the original name.
+    """
+    table = StreamingHistory._meta.db_table
+    new_table = f'{table}_partitioned'
+    qn = connection.ops.quote_name
+    key = PARTITION_KEYS[strategy]
+
+    # Constraints and indexes are recreated on the partitioned table under the same names
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'p'",
+        [table],
+    )
+    pk_name, _ = cursor.fetchone()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('u', 'f', 'c') ORDER BY contype DESC, conname",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass) "
+        "ORDER BY indexname",
+        [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+
+    statements = [
+        f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE',
+        f'CREATE TABLE {qn(new_table)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING IDENTITY '
+        f'INCLUDING STORAGE) PARTITION BY {strategy.upper()} ({qn(key)})',
+    ]
+    if strategy == 'hash':
+        statements.extend(
+            f'CREATE TABLE {qn(f"{table}_h{remainder}")} PARTITION OF {qn(new_table)} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+            for remainder in range(partitions)
+        )
+    else:
+        statements.extend(
+            f'CREATE TABLE {qn(f"{table}_{suffix}")} PARTITION OF {qn(new_table)} '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            for suffix, start, end in bounds
+        )
+        # Plays outside the created ranges land here until a partition is added
+        statements.append(
+            f'CREATE TABLE {qn(f"{table}_default")} PARTITION OF {qn(new_table)} DEFAULT'
+        )
+
+    statements.extend([
+        f'INSERT INTO {qn(new_table)} OVERRIDING SYSTEM VALUE SELECT * FROM {qn(table)}',
+        f"SELECT setval(pg_get_serial_sequence('{new_table}', 'id'), "
+        f'COALESCE(MAX(id), 0) + 1, false) FROM {qn(new_table)}',
+        f'DROP TABLE {qn(table)}',
+        f'ALTER TABLE {qn(new_table)} RENAME TO {qn(table)}',
+        # Unique keys of a partitioned table must contain the partition key
+        f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(pk_name)} PRIMARY KEY (id, {qn(key)})',
+    ])
+    statements.extend(
+        f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}'
+        for name, definition in constraints
+    )
+    statements.extend(indexes)
+    return statements
+
@@ -0,0 +1,122 @@
+import logging
+import requests
+from django.conf import settings
+from django.db.models import Sum
+from .models import DailyTrackStats, PlaylistExport
+
+logger = logging.getLogger(__name__)
+
+# Spotify accepts at most 100 URIs per add-items request
+PLAYLIST_BATCH_SIZE = 100
+
+
+def get_playlist_track_uris(user, start_date=None, end_date=None, limit=50):
+    """
+    Return the Spotify URIs of the user's most played tracks in a date
+    range, most played first, without duplicates
+    """
+    query = DailyTrackStats.objects.filter(
+        user=user,
+        track__name__isnull=False,
+        track__spotify_uri__isnull=False
+    )
+    if start_date:
+        query = query.filter(day__gte=start_date)
+    if end_date:
+        query = query.filter(day__lte=end_date)
+
+    # Grouped by URI, so tracks stored under several names count once
+    return list(
+        query
+        .values_list('track__spotify_uri', flat=True)
+        .annotate(play_count=Sum('play_count'), total_ms_played=Sum('ms_played'))
+        .order_by('-play_count', '-total_ms_played', 'track__spotify_uri')[:min(limit, settings.PLAYLIST_MAX_TRACKS)]
+    )
+
+
+def create_playlist_export(user, client, name, description, track_uris):
+    """
+    Create an empty private playlist on Spotify and record the export.
+    Returns (export, None) or (None, the failed response).
+    """
+    response = client.post(f'users/{user.spotify_user_id}/playlists', json={
+        'name': name,
+        'description': description,
+        'public': False
+    })
+    if response.status_code not in (200, 201):
+        return None, response
+
+    playlist = response.json()
+    export = PlaylistExport.objects.create(
+        user=user,
+        spotify_playlist_id=playlist['id'],
+        playlist_url=playlist.get('external_urls', {}).get('spotify', ''),
+        name=name,
+        track_uris=track_uris,
+    )
+    return export, None
+
+
+def add_playlist_tracks(export, client):
+    """
+    Add the export's remaining tracks to its playlist in batches, saving
+    progress after each batch. Stops at the first failed batch, leaving the
+    export 'failed' so it can be resumed from there.
+
+    Spotify applies adds to one playlist in the order they arrive, and a
+    position beyond the current length is rejected, so batches of a playlist
+    are sent one after another over the client's pooled connection. Each
+    batch is inserted at an explicit position, keeping the ranking order
+    even if the playlist is edited in between.
+    """
+    uris = export.track_uris
+    if export.status == 'failed':
+        _sync_progress(export, client)
+    export.status = 'in_progress'
+    export.error_message = None
+
+    while export.tracks_added < len(uris):
+        batch = uris[export.tracks_added:export.tracks_added + PLAYLIST_BATCH_SIZE]
+        try:
+            response = client.post(
+                f'playlists/{export.spotify_playlist_id}/tracks',
+                json={'uris': batch, 'position': export.tracks_added}
+            )
+        except requests.RequestException as e:
+            return _fail(export, f'Network error: {e}')
+        if response.status_code not in (200, 201):
+            return _fail(export, f'Spotify returned {response.status_code}: {response.text[:500]}')
+
+        export.tracks_added += len(batch)
+        export.save(update_fields=['tracks_added', 'status', 'error_message', 'updated_at'])
+
+    export.status = 'completed'
+    export.save(update_fields=['tracks_added', 'status', 'error_message', 'updated_at'])
+    return export
+
+
+def _fail(export, message):
+    logger.warning('Adding tracks to playlist export %s failed: %s', export.pk, message)
+    export.status = 'failed'
+    export.error_message = message
+    export.save(update_fields=['tracks_added', 'status', 'error_message', 'updated_at'])
+    return export
+
+
+def _sync_progress(export, client):
+    # A batch whose response was lost may have been applied - the playlist
+    # then holds exactly one batch more than recorded
+    try:
+        response = client.get(
+            f'playlists/{export.spotify_playlist_id}',
+            params={'fields': 'tracks.total'}
+        )
+    except requests.RequestException:
+        return
+    if response.status_code != 200:
+        return
+    total = response.json().get('tracks', {}).get('total')
+    pending = len(export.track_uris[export.tracks_added:export.tracks_added + PLAYLIST_BATCH_SIZE])
+    if pending and total == export.tracks_added + pending:
+        export.tracks_added = total
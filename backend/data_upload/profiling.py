@@ -0,0 +1,115 @@
+import os
+import time
+import cProfile
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Wall time per processing stage and counters (bytes, records,
+    batches). The time of a nested stage is excluded from the enclosing
+    one, so the stage times add up to the time spent in all stages.
+    """
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            # Pause the enclosing stage
+            parent = self._stack[-1]
+            self.stages[parent[0]] += now - parent[1]
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            name, started = self._stack.pop()
+            self.stages[name] += now - started
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def add(self, timings):
+        """
+        Add the stages and counters of a timings dict (see as_dict)
+        """
+        for name, seconds in (timings or {}).get('stages', {}).items():
+            self.stages[name] += seconds
+        for name, value in (timings or {}).get('counters', {}).items():
+            self.counters[name] += value
+
+    def as_dict(self, total=None):
+        """
+        Timings in the format stored on uploads and upload files. `total` is
+        the wall time of the whole job, the rate is computed from it.
+        """
+        timings = {
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+        if total is not None:
+            timings['total'] = round(total, 4)
+            records = self.counters.get('records', 0)
+            timings['rows_per_second'] = round(records / total) if total > 0 else None
+        return timings
+
+
+class TimedReader:
+    """
+    File wrapper that times reads (including decompression) as the 'read'
+    stage
+    """
+    def __init__(self, fp, timer):
+        self.fp = fp
+        self.timer = timer
+
+    def read(self, size=-1):
+        with self.timer.stage('read'):
+            return self.fp.read(size)
+
+
+def get_profile_path(upload):
+    """
+    Path of the cProfile capture of an upload (pstats format)
+    """
+    return os.path.join(settings.UPLOAD_DIR, str(upload.user_id), f'upload_{upload.pk}.prof')
+
+
+@contextmanager
+def capture_profile(upload):
+    """
+    Profile the block with cProfile when profiling was requested for the
+    upload, and save the stats for download. Only the current thread is
+    profiled.
+    """
+    if not upload.profile:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Only one profiler can be active at a time on Python 3.12+
+        logger.warning('Could not profile upload %s: %s', upload.pk, e)
+        yield
+        return
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = get_profile_path(upload)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
@@ -0,0 +1,69 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import DailyTrackStats, StreamingHistory
+from .cache import bump_data_version
+
+
+# Rows written per INSERT while rebuilding the rollup
+ROLLUP_BATCH_SIZE = 1000
+
+
+def rebuild_daily_stats(user, start_day=None, end_day=None):
+    """
+    Recompute the DailyTrackStats rows of a user from the raw streaming
+    history, for the inclusive day range (the whole history by default)
+    """
+    with transaction.atomic():
+        # Invalidates cached statistics and locks the user row,
+        # serializing rebuilds of the same user (concurrent uploads)
+        bump_data_version(user)
+
+        stats = DailyTrackStats.objects.filter(user=user)
+        history = StreamingHistory.objects.filter(user=user)
+        if start_day:
+            stats = stats.filter(day__gte=start_day)
+            history = history.filter(ts__gte=day_start(start_day))
+        if end_day:
+            stats = stats.filter(day__lte=end_day)
+            history = history.filter(ts__lt=day_start(end_day, offset=1))
+        stats.delete()
+
+        rows = (
+            history
+            .annotate(day=TruncDate('ts'))
+            .values('day', 'track_id')
+            .annotate(play_count=Count('id'), ms_played=Sum('ms_played'))
+            .order_by()
+        )
+        batch = []
+        for row in rows.iterator():
+            batch.append(DailyTrackStats(user_id=user.pk, **row))
+            if len(batch) >= ROLLUP_BATCH_SIZE:
+                DailyTrackStats.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            DailyTrackStats.objects.bulk_create(batch)
+
+
+def update_daily_stats_for_upload(upload):
+    """
+    Rebuild the rollup for the days covered by the records an upload inserted
+    """
+    span = StreamingHistory.objects.filter(upload=upload).aggregate(
+        first=Min('ts'), last=Max('ts')
+    )
+    if span['first'] is None:
+        return
+    rebuild_daily_stats(
+        upload.user,
+        timezone.localdate(span['first']),
+        timezone.localdate(span['last']),
+    )
+
+
+def day_start(day, offset=0):
+    # Midnight of a calendar day in the current time zone
+    return timezone.make_aware(datetime.combine(day + timedelta(days=offset), time.min))
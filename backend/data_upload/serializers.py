@@ -1,15 +1,50 @@
 from rest_framework import serializers
-from .models import SpotifyDataUpload, StreamingHistory
+from .models import SpotifyDataUpload, UploadFile, StreamingHistory
+from .chunked import is_receiving
+
+
+class UploadFileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadFile
+        fields = (
+            'id', 'name', 'status', 'records_inserted', 'records_duplicate', 'records_skipped',
+            'error_message', 'started_at', 'finished_at', 'timings'
+        )
+        read_only_fields = fields
 
 
 class SpotifyDataUploadSerializer(serializers.ModelSerializer):
+    files = UploadFileSerializer(many=True, read_only=True)
+    # A chunked upload still accepting data, also while it's ingested
+    is_receiving = serializers.SerializerMethodField()
+    
     class Meta:
         model = SpotifyDataUpload
-        fields = ('id', 'file_path', 'file_size', 'upload_date', 'processed', 'processing_status')
-        read_only_fields = ('id', 'upload_date', 'processed', 'processing_status')
+        fields = (
+            'id', 'file_path', 'file_size', 'upload_date', 'processed', 'processing_status',
+            'incremental', 'bytes_received', 'files_total', 'files_processed', 'records_inserted', 'records_duplicate',
+            'records_skipped', 'error_message', 'started_at', 'finished_at', 'timings', 'profile', 'is_receiving', 'files'
+        )
+        read_only_fields = fields
+
+    def get_is_receiving(self, upload):
+        return is_receiving(upload)
 
 
 class StreamingHistorySerializer(serializers.ModelSerializer):
+    # Names are read from the dimension tables, keeping the export format
+    master_metadata_track_name = serializers.CharField(source='track.name', read_only=True, allow_null=True)
+    master_metadata_album_artist_name = serializers.CharField(
+        source='track.artist.name', read_only=True, allow_null=True
+    )
+    master_metadata_album_album_name = serializers.CharField(
+        source='track.album.name', read_only=True, allow_null=True
+    )
+    spotify_track_uri = serializers.CharField(source='track.spotify_uri', read_only=True, allow_null=True)
+    platform = serializers.CharField(source='platform.name', read_only=True, allow_null=True)
+    reason_start = serializers.CharField(source='reason_start.name', read_only=True, allow_null=True)
+    reason_end = serializers.CharField(source='reason_end.name', read_only=True, allow_null=True)
+    
     class Meta:
         model = StreamingHistory
         fields = '__all__'
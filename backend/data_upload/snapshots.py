@@ -0,0 +1,296 @@
+import os
+import shutil
+import logging
+import tempfile
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import User, StreamingHistory
+from .ingestion import iter_batches
+
+
+# Per-play columns of a snapshot: (file name, StreamingHistory lookup, dtype)
+# Track, artist and album are dictionary encoded: <name>.npy holds int32 codes
+# (-1 for plays without a value) and <name>_ids.npy maps codes to dimension ids
+SNAPSHOT_COLUMNS = (
+    ('ts', 'ts', 'int64'),  # Unix seconds, sorted
+    ('ms_played', 'ms_played', 'int32'),
+    ('track', 'track_id', 'int32'),
+    ('artist', 'track__artist_id', 'int32'),
+    ('album', 'track__album_id', 'int32'),
+)
+ENCODED_COLUMNS = ('track', 'artist', 'album')
+
+# Rows fetched per database round trip while building a snapshot
+SNAPSHOT_CHUNK_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def _require_numpy():
+    # numpy is only needed by the snapshot analytics engine
+    try:
+        import numpy
+    except ImportError:
+        raise ImproperlyConfigured('The snapshot analytics engine requires numpy (pip install numpy)')
+    return numpy
+
+
+def _user_dir(user_id):
+    return os.path.join(settings.SNAPSHOT_DIR, str(user_id))
+
+
+class Snapshot:
+    """
+    Memory-mapped columnar snapshot of one user's streaming history
+    """
+    def __init__(self, path):
+        np = _require_numpy()
+        self.path = path
+        for name, lookup, dtype in SNAPSHOT_COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+        for name in ENCODED_COLUMNS:
+            setattr(self, f'{name}_ids', np.load(os.path.join(path, f'{name}_ids.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def range_slice(self, start=None, end=None):
+        """
+        Return the slice of plays with start <= ts < end (aware datetimes).
+        Timestamps are sorted, so this is two binary searches.
+        """
+        np = _require_numpy()
+        lo = int(np.searchsorted(self.ts, int(start.timestamp()), 'left')) if start else 0
+        hi = int(np.searchsorted(self.ts, int(end.timestamp()), 'left')) if end else len(self.ts)
+        return slice(lo, hi)
+
+
+def build_snapshot(user):
+    """
+    Materialize a user's streaming history into a snapshot directory for
+    their current data version, replacing older snapshots
+    """
+    np = _require_numpy()
+    version = User.objects.values_list('data_version', flat=True).get(pk=user.pk)
+    user_dir = _user_dir(user.pk)
+    os.makedirs(user_dir, exist_ok=True)
+
+    # NULL dimension ids come back as -1, so every column converts in one C loop
+    rows = (
+        StreamingHistory.objects
+        .filter(user_id=user.pk)
+        .order_by('ts', 'id')
+        .values_list(*(
+            Coalesce(lookup, Value(-1), output_field=models.IntegerField()) if name in ENCODED_COLUMNS else lookup
+            for name, lookup, dtype in SNAPSHOT_COLUMNS
+        ))
+    )
+    count = rows.count()
+    columns = {name: np.empty(count, dtype='int64') for name, lookup, dtype in SNAPSHOT_COLUMNS}
+
+    # Fill the preallocated arrays a chunk at a time, column by column
+    position = 0
+    for chunk in iter_batches(rows.iterator(chunk_size=SNAPSHOT_CHUNK_SIZE), SNAPSHOT_CHUNK_SIZE):
+        chunk = chunk[:count - position]  # rows inserted since count() belong to the next version
+        if not chunk:
+            break
+        end = position + len(chunk)
+        ts, *values = zip(*chunk)
+        columns['ts'][position:end] = np.fromiter(map(datetime.timestamp, ts), 'float64', len(chunk))
+        for (name, lookup, dtype), column in zip(SNAPSHOT_COLUMNS[1:], values):
+            columns[name][position:end] = np.fromiter(column, 'int64', len(chunk))
+        position = end
+
+    tmp_dir = tempfile.mkdtemp(prefix='.build-', dir=user_dir)
+    for name, lookup, dtype in SNAPSHOT_COLUMNS:
+        values = columns[name][:position]
+        if name in ENCODED_COLUMNS:
+            # Dictionary encode dimension ids into dense codes 0..n-1
+            ids = np.unique(values[values >= 0])
+            codes = np.searchsorted(ids, values)
+            codes[values < 0] = -1
+            np.save(os.path.join(tmp_dir, f'{name}_ids.npy'), ids)
+            values = codes
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), values.astype(dtype))
+
+    path = os.path.join(user_dir, f'v{version}')
+    try:
+        os.rename(tmp_dir, path)
+    except OSError:
+        # Built concurrently by another worker
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Older versions are no longer read (open memory maps stay valid)
+    for entry in os.listdir(user_dir):
+        if entry != f'v{version}' and entry.startswith('v'):
+            shutil.rmtree(os.path.join(user_dir, entry), ignore_errors=True)
+    return Snapshot(path)
+
+
+def get_snapshot(user):
+    """
+    Return the snapshot of the user's current data version, building it if needed
+    """
+    path = os.path.join(_user_dir(user.pk), f'v{user.data_version}')
+    if os.path.isdir(path):
+        return Snapshot(path)
+    return build_snapshot(user)
+
+
+def get_engine_snapshot(user):
+    """
+    Return the user's snapshot when ANALYTICS_ENGINE is 'snapshot', or None
+    when the statistics are computed by the database. Without numpy the
+    database is used as well.
+    """
+    if settings.ANALYTICS_ENGINE != 'snapshot':
+        return None
+    try:
+        return get_snapshot(user)
+    except ImproperlyConfigured as e:
+        logger.warning('Snapshot analytics engine unavailable, using the database: %s', e)
+        return None
+
+
+def remove_snapshots(user):
+    """
+    Remove all snapshots of a user
+    """
+    shutil.rmtree(_user_dir(user.pk), ignore_errors=True)
+
+
+def _date_bounds(start_date, end_date, tzinfo):
+    # Inclusive date range -> [start, end) datetimes at local midnight
+    return (
+        datetime.combine(start_date, time.min, tzinfo=tzinfo) if start_date else None,
+        datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tzinfo) if end_date else None,
+    )
+
+
+def top_tracks(snapshot, start_date=None, end_date=None, limit=50):
+    """
+    Return the most played tracks in a date range as dicts with
+    track_id, play_count and total_ms_played
+    """
+    return _top_values(snapshot, 'track', 'track_id', start_date, end_date, limit)
+
+
+def top_artists(snapshot, start_date=None, end_date=None, limit=50):
+    """
+    Return the most played artists in a date range as dicts with
+    artist_id, play_count and total_ms_played
+    """
+    return _top_values(snapshot, 'artist', 'artist_id', start_date, end_date, limit)
+
+
+def _top_values(snapshot, column, key, start_date, end_date, limit):
+    np = _require_numpy()
+    selected = snapshot.range_slice(
+        *_date_bounds(start_date, end_date, timezone.get_current_timezone())
+    )
+    codes = np.asarray(getattr(snapshot, column)[selected])
+    ms_played = np.asarray(snapshot.ms_played[selected])
+
+    valid = codes >= 0
+    codes, ms_played = codes[valid], ms_played[valid]
+    ids = getattr(snapshot, f'{column}_ids')
+    play_counts = np.bincount(codes, minlength=len(ids))
+    total_ms = np.bincount(codes, weights=ms_played, minlength=len(ids))
+
+    # Partial sort: only the top `limit` codes are ordered
+    limit = min(limit, int(np.count_nonzero(play_counts)))
+    if not limit:
+        return []
+    top = np.argpartition(-play_counts, limit - 1)[:limit]
+    top = top[np.lexsort((-total_ms[top], -play_counts[top]))]
+    return [
+        {key: int(ids[code]), 'play_count': int(play_counts[code]), 'total_ms_played': int(total_ms[code])}
+        for code in top
+    ]
+
+
+def _period_starts(first, last, granularity):
+    # Local period start dates covering first..last
+    if granularity == 'day':
+        step = lambda d: d + timedelta(days=1)
+        current = first
+    elif granularity == 'week':
+        step = lambda d: d + timedelta(days=7)
+        current = first - timedelta(days=first.weekday())
+    elif granularity == 'month':
+        step = lambda d: (d.replace(year=d.year + 1, month=1) if d.month == 12 else d.replace(month=d.month + 1))
+        current = first.replace(day=1)
+    else:
+        step = lambda d: d.replace(year=d.year + 1)
+        current = first.replace(month=1, day=1)
+
+    starts = []
+    while current <= last:
+        starts.append(current)
+        current = step(current)
+    return starts
+
+
+def listening_periods(snapshot, granularity='month', tzinfo=None, start_date=None, end_date=None):
+    """
+    Return play counts and ms_played per day/week/month/year in a time zone
+    as dicts with period, total_ms and play_count
+    """
+    np = _require_numpy()
+    tzinfo = tzinfo or timezone.get_current_timezone()
+
+    selected = snapshot.range_slice(*_date_bounds(start_date, end_date, tzinfo))
+    ts = np.asarray(snapshot.ts[selected])
+    if not len(ts):
+        return []
+    ms_played = np.asarray(snapshot.ms_played[selected])
+
+    first = datetime.fromtimestamp(int(ts[0]), tzinfo).date()
+    last = datetime.fromtimestamp(int(ts[-1]), tzinfo).date()
+    starts = _period_starts(first, last, granularity)
+
+    # Period boundaries as Unix seconds - DST changes are handled by the time zone
+    bounds = np.array([int(datetime.combine(d, time.min, tzinfo=tzinfo).timestamp()) for d in starts])
+    buckets = np.searchsorted(bounds, ts, 'right') - 1
+    play_counts = np.bincount(buckets, minlength=len(starts))
+    total_ms = np.bincount(buckets, weights=ms_played, minlength=len(starts))
+
+    return [
+        {'period': starts[i], 'total_ms': int(total_ms[i]), 'play_count': int(play_counts[i])}
+        for i in np.flatnonzero(play_counts)
+    ]
+
+
+def hourly_distribution(snapshot, tzinfo=None, start_date=None, end_date=None):
+    """
+    Return a 7 x 24 matrix of listened milliseconds by weekday (Monday
+    first) and local hour
+    """
+    np = _require_numpy()
+    tzinfo = tzinfo or timezone.get_current_timezone()
+
+    selected = snapshot.range_slice(*_date_bounds(start_date, end_date, tzinfo))
+    ts = np.asarray(snapshot.ts[selected])
+    if not len(ts):
+        return [[0] * 24 for _ in range(7)]
+    ms_played = np.asarray(snapshot.ms_played[selected])
+
+    # UTC offset of each local day, applied to the plays of that day
+    first = datetime.fromtimestamp(int(ts[0]), tzinfo).date()
+    last = datetime.fromtimestamp(int(ts[-1]), tzinfo).date()
+    days = _period_starts(first, last, 'day')
+    midnights = [datetime.combine(d, time.min, tzinfo=tzinfo) for d in days]
+    bounds = np.array([int(m.timestamp()) for m in midnights])
+    offsets = np.array([int(m.utcoffset().total_seconds()) for m in midnights])
+    weekdays = np.array([d.weekday() for d in days])
+
+    day_index = np.searchsorted(bounds, ts, 'right') - 1
+    hours = ((ts + offsets[day_index]) // 3600) % 24
+    cells = weekdays[day_index] * 24 + hours
+    matrix = np.bincount(cells, weights=ms_played, minlength=7 * 24).reshape(7, 24)
+    return matrix.astype('int64').tolist()
@@ -0,0 +1,259 @@
+import io
+import time
+import zlib
+import struct
+import logging
+import zipfile
+import tempfile
+from django.conf import settings
+from django.db.models import F
+from .models import SpotifyDataUpload, UploadFile
+from .ingestion import (
+    get_incremental_cutoff, ingest_streaming_history, is_streaming_history_member, process_upload_file
+)
+
+logger = logging.getLogger(__name__)
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+
+# Compressed bytes read per step
+READ_BLOCK_SIZE = 64 * 1024
+
+# Decompressed history members up to this size are kept in memory
+MEMBER_SPOOL_SIZE = 32 * 1024 * 1024
+
+
+class UploadStalled(Exception):
+    """
+    No bytes arrived for STREAMING_INGESTION_TIMEOUT seconds
+    """
+
+
+class UnsupportedMember(zipfile.BadZipFile):
+    """
+    A member that can't be read front to back (e.g. stored with a data
+    descriptor) - the rest of such an archive is read once it is complete
+    """
+
+
+class GrowingUploadFile(io.RawIOBase):
+    """
+    Read-only view of the `.part` file of a chunked upload. Reads past the
+    stored bytes wait until more chunks arrive, so the file reads like a
+    complete one. Only bytes counted in `bytes_received` are read - anything
+    beyond may still be overwritten by a retried chunk.
+    """
+    def __init__(self, upload):
+        self.upload = upload
+        self.file = open(upload.file_path, 'rb')
+        self.position = 0
+
+    @property
+    def complete(self):
+        # Finishing the upload renames the file; the open handle stays valid
+        return not self.upload.file_path.endswith('.part')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        self.wait_for(self.position + 1)
+        count = min(len(buffer), self.upload.bytes_received - self.position)
+        if count <= 0:
+            return 0
+        self.file.seek(self.position)
+        count = self.file.readinto(memoryview(buffer)[:count])
+        self.position += count
+        return count
+
+    def wait_for(self, size=None):
+        """
+        Wait until `size` bytes (all bytes if None) are stored or the upload
+        is finished
+        """
+        last_progress = time.monotonic()
+        while not self.complete and (size is None or self.upload.bytes_received < size):
+            time.sleep(settings.STREAMING_INGESTION_POLL_INTERVAL)
+            received = self.upload.bytes_received
+            try:
+                self.upload.refresh_from_db(fields=['bytes_received', 'file_path'])
+            except SpotifyDataUpload.DoesNotExist:
+                raise UploadStalled('Upload was deleted')
+            self.upload.heartbeat()
+            if self.upload.bytes_received > received:
+                last_progress = time.monotonic()
+            elif time.monotonic() - last_progress > settings.STREAMING_INGESTION_TIMEOUT:
+                raise UploadStalled(f'No data received for {settings.STREAMING_INGESTION_TIMEOUT}s')
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class _PushbackStream:
+    # Bytes read past the end of a deflate stream belong to the next header
+    def __init__(self, raw):
+        self.raw = raw
+        self.pending = b''
+
+    def read(self, size):
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        return self.raw.read(size)
+
+    def read_exact(self, size):
+        chunks = []
+        while size:
+            data = self.read(size)
+            if not data:
+                raise zipfile.BadZipFile('Truncated ZIP archive')
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
+
+def _zip64_sizes(extra, compressed_size, size):
+    # The zip64 extra field holds the 8 byte sizes whose header fields are 0xFFFFFFFF
+    position = 0
+    while position + 4 <= len(extra):
+        field_id, length = struct.unpack_from('<HH', extra, position)
+        if field_id == ZIP64_EXTRA_ID:
+            values = extra[position + 4:position + 4 + length]
+            offset = 0
+            if size == ZIP64_LIMIT and offset + 8 <= len(values):
+                size = struct.unpack_from('<Q', values, offset)[0]
+                offset += 8
+            if compressed_size == ZIP64_LIMIT and offset + 8 <= len(values):
+                compressed_size = struct.unpack_from('<Q', values, offset)[0]
+            return True, compressed_size, size
+        position += 4 + length
+    return False, compressed_size, size
+
+
+def iter_zip_members(raw):
+    """
+    Read a ZIP archive front to back from a stream and yield (name, chunks)
+    for each member, where chunks yields its decompressed data. Chunks not
+    consumed are skipped before the next member. Stops at the central
+    directory.
+    """
+    stream = _PushbackStream(raw)
+    while True:
+        signature = stream.read_exact(4)
+        if signature != LOCAL_HEADER_SIGNATURE:
+            return  # central directory
+
+        (_, _, flags, method, _, _, crc, compressed_size, size, name_length,
+         extra_length) = LOCAL_HEADER.unpack(signature + stream.read_exact(LOCAL_HEADER.size - 4))
+        name = stream.read_exact(name_length).decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        zip64, compressed_size, size = _zip64_sizes(stream.read_exact(extra_length), compressed_size, size)
+
+        if flags & FLAG_ENCRYPTED:
+            raise UnsupportedMember(f'{name} is encrypted')
+        has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or (
+            has_descriptor and method == zipfile.ZIP_STORED
+        ):
+            if has_descriptor:
+                raise UnsupportedMember(f'{name} can not be read as a stream')
+            method = None  # skipped without decompressing
+
+        chunks = _member_chunks(stream, name, method, crc, compressed_size, has_descriptor, zip64)
+        yield name, chunks
+        for _ in chunks:
+            pass
+
+
+def _member_chunks(stream, name, method, crc, compressed_size, has_descriptor, zip64):
+    checksum = 0
+    if method == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        remaining = None if has_descriptor else compressed_size
+        while not decompressor.eof:
+            data = stream.read(READ_BLOCK_SIZE if remaining is None else min(READ_BLOCK_SIZE, remaining))
+            if not data:
+                raise zipfile.BadZipFile(f'Truncated data of {name}')
+            if remaining is not None:
+                remaining -= len(data)
+            output = decompressor.decompress(data)
+            if output:
+                checksum = zlib.crc32(output, checksum)
+                yield output
+        if remaining is None:
+            stream.unread(decompressor.unused_data)
+        elif remaining:
+            stream.read_exact(remaining)
+    else:
+        remaining = compressed_size
+        while remaining:
+            data = stream.read_exact(min(READ_BLOCK_SIZE, remaining))
+            remaining -= len(data)
+            if method is None:
+                continue
+            checksum = zlib.crc32(data, checksum)
+            yield data
+
+    if has_descriptor:
+        data = stream.read_exact(4)
+        if data == DESCRIPTOR_SIGNATURE:
+            data = stream.read_exact(4)
+        crc = struct.unpack('<I', data)[0]
+        stream.read_exact(16 if zip64 else 8)
+    if method is not None and checksum != crc:
+        raise zipfile.BadZipFile(f'Bad CRC-32 for {name}')
+
+
+def ingest_growing_zip(upload):
+    """
+    Ingest the history members of a ZIP archive while its chunked upload is
+    still in progress. Every member is parsed as soon as its last byte
+    arrived, so parsing overlaps with the upload. Returns once the whole
+    archive arrived and the upload is finished, or raises UploadStalled.
+    Checking the archive against its central directory and members the
+    stream could not read are left to process_spotify_zip.
+    """
+    since = get_incremental_cutoff(upload.user) if upload.incremental else None
+    done = set(upload.files.values_list('name', flat=True))
+
+    with GrowingUploadFile(upload) as raw:
+        try:
+            for name, chunks in iter_zip_members(io.BufferedReader(raw, READ_BLOCK_SIZE)):
+                if name.endswith('/') or not is_streaming_history_member(name) or name in done:
+                    continue
+                _ingest_member(upload, name, chunks, since)
+                done.add(name)
+        except zipfile.BadZipFile as e:
+            # Left to the pass over the complete archive, which reports real damage
+            logger.info('Streaming ingestion of upload %s stopped early: %s', upload.pk, e)
+        raw.wait_for()
+
+
+def _ingest_member(upload, name, chunks, since):
+    # The member is buffered first, so no transaction waits for the upload
+    with tempfile.SpooledTemporaryFile(max_size=MEMBER_SPOOL_SIZE) as spool:
+        for data in chunks:
+            spool.write(data)
+        size = spool.tell()
+        spool.seek(0)
+
+        SpotifyDataUpload.objects.filter(pk=upload.pk).update(files_total=F('files_total') + 1)
+        upload_file = UploadFile.objects.create(upload=upload, name=name)
+
+        def ingest():
+            stats = ingest_streaming_history(upload, io.TextIOWrapper(spool, encoding='utf-8'), since=since)
+            stats.timer.count('bytes', size)
+            return stats
+
+        process_upload_file(upload, upload_file, ingest)
@@ -0,0 +1,185 @@
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+from datetime import timedelta
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from authentication.models import User
+from data_upload.chunked import OffsetMismatch, complete_chunked_upload, create_chunked_upload, write_chunk
+from data_upload.jobs import remove_abandoned_uploads
+from data_upload.models import SpotifyDataUpload, StreamingHistory
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ChunkedUploadTests(TestCase):
+    data = os.urandom(300 * 1024)
+
+    def setUp(self):
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir)
+        settings = override_settings(UPLOAD_DIR=upload_dir, UPLOAD_CHUNK_SIZE=256 * 1024)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create(username='listener', email='listener@example.com')
+        self.upload = create_chunked_upload(self.user, 'history.parquet', len(self.data))
+
+    def write(self, start, end, checksum=None):
+        chunk = self.data[start:end]
+        return write_chunk(self.upload, start, io.BytesIO(chunk), len(chunk), checksum=checksum)
+
+    def stored(self):
+        with open(self.upload.file_path, 'rb') as f:
+            return f.read()
+
+    def test_chunks_with_checksums_are_stored(self):
+        self.assertEqual(self.write(0, 100000, sha256(self.data[:100000])), 100000)
+        self.assertEqual(self.write(100000, len(self.data), sha256(self.data[100000:]).upper()), len(self.data))
+
+        upload = complete_chunked_upload(self.upload, checksum=sha256(self.data))
+
+        self.assertEqual(upload.processing_status, 'uploaded')
+        self.assertFalse(upload.file_path.endswith('.part'))
+        with open(upload.file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_corrupted_chunk_is_discarded(self):
+        self.write(0, 100000)
+
+        with self.assertRaisesMessage(ValueError, 'Chunk checksum mismatch'):
+            self.write(100000, 200000, sha256(b'something else'))
+
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.bytes_received, 100000)
+        self.assertEqual(self.stored(), self.data[:100000])
+        # The client resends the chunk
+        self.assertEqual(self.write(100000, 200000, sha256(self.data[100000:200000])), 200000)
+
+    def test_chunk_cut_short_is_discarded_with_checksum(self):
+        chunk = self.data[:100000]
+        stream = io.BytesIO(chunk[:60000])
+
+        with self.assertRaisesMessage(ValueError, 'Chunk checksum mismatch'):
+            write_chunk(self.upload, 0, stream, len(chunk), checksum=sha256(chunk))
+
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.bytes_received, 0)
+
+    def test_chunk_cut_short_is_kept_without_checksum(self):
+        chunk = self.data[:100000]
+
+        offset = write_chunk(self.upload, 0, io.BytesIO(chunk[:60000]), len(chunk))
+
+        self.assertEqual(offset, 60000)
+        self.assertEqual(self.stored(), chunk[:60000])
+
+    def test_chunk_at_wrong_offset(self):
+        self.write(0, 100000)
+
+        with self.assertRaises(OffsetMismatch) as raised:
+            self.write(50000, 150000)
+
+        self.assertEqual(raised.exception.offset, 100000)
+
+    def test_body_is_read_without_locking_the_upload(self):
+        chunk = self.data[:100000]
+        stream = io.BytesIO(chunk)
+        depths = []
+
+        def read(size):
+            depths.append(len(connection.atomic_blocks))
+            return io.BytesIO.read(stream, size)
+
+        stream.read = read
+        outside = len(connection.atomic_blocks)
+        write_chunk(self.upload, 0, stream, len(chunk))
+
+        self.assertEqual(set(depths), {outside})
+
+    def test_chunk_stored_meanwhile_by_another_request(self):
+        chunk = self.data[:100000]
+        stream = io.BytesIO(chunk)
+
+        def read(size):
+            # A retried PUT of the same chunk finishes first
+            SpotifyDataUpload.objects.filter(pk=self.upload.pk).update(bytes_received=len(chunk))
+            return io.BytesIO.read(stream, size)
+
+        stream.read = read
+        with self.assertRaises(OffsetMismatch) as raised:
+            write_chunk(self.upload, 0, stream, len(chunk))
+
+        self.assertEqual(raised.exception.offset, len(chunk))
+        self.assertEqual(self.stored(), chunk)
+
+    def test_chunk_past_declared_size(self):
+        with self.assertRaisesMessage(ValueError, 'past the declared file size'):
+            write_chunk(self.upload, 0, io.BytesIO(self.data + b'x'), len(self.data) + 1)
+
+    def test_file_checksum_mismatch(self):
+        self.write(0, len(self.data))
+
+        with self.assertRaisesMessage(ValueError, 'File checksum mismatch'):
+            complete_chunked_upload(self.upload, checksum=sha256(b'something else'))
+
+        self.upload.refresh_from_db()
+        self.assertTrue(self.upload.file_path.endswith('.part'))
+        self.assertEqual(self.upload.processing_status, 'uploading')
+
+    def test_incomplete_upload_can_not_be_finished(self):
+        self.write(0, 100000)
+
+        with self.assertRaises(OffsetMismatch):
+            complete_chunked_upload(self.upload)
+
+    def test_chunk_checksum_header(self):
+        self.client.force_login(self.user)
+        url = f'/api/upload/chunked/{self.upload.pk}/?offset=0'
+        chunk = self.data[:100000]
+
+        response = self.client.put(
+            url, chunk, content_type='application/octet-stream', HTTP_X_CONTENT_SHA256=sha256(b'x')
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Chunk checksum mismatch')
+
+        response = self.client.put(
+            url, chunk, content_type='application/octet-stream', HTTP_X_CONTENT_SHA256=sha256(chunk)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['offset'], 100000)
+
+    def test_upload_being_ingested_can_be_resumed(self):
+        self.write(0, 100000)
+        SpotifyDataUpload.objects.filter(pk=self.upload.pk).update(processing_status='processing')
+        self.client.force_login(self.user)
+
+        chunked = self.client.get(f'/api/upload/chunked/{self.upload.pk}/').json()
+        status = self.client.get(f'/api/upload/status/{self.upload.pk}/').json()
+
+        self.assertEqual(chunked['offset'], 100000)
+        self.assertTrue(chunked['is_receiving'])
+        self.assertTrue(status['is_receiving'])
+
+    def test_abandoned_upload_is_removed(self):
+        self.write(0, 100000)
+        StreamingHistory.objects.create(user=self.user, upload=self.upload, ts=timezone.now(), ms_played=1)
+        active = create_chunked_upload(self.user, 'other.zip', 100)
+        created = timezone.now() - timedelta(days=2)
+        SpotifyDataUpload.objects.filter(pk__in=[self.upload.pk, active.pk]).update(upload_date=created)
+        # Only the active upload received a chunk lately
+        idle_since = created.timestamp()
+        os.utime(self.upload.file_path, (idle_since, idle_since))
+
+        self.assertEqual(remove_abandoned_uploads(), 1)
+
+        self.assertFalse(SpotifyDataUpload.objects.filter(pk=self.upload.pk).exists())
+        self.assertFalse(os.path.exists(self.upload.file_path))
+        self.assertFalse(StreamingHistory.objects.filter(user=self.user).exists())
+        self.assertTrue(os.path.exists(active.file_path))
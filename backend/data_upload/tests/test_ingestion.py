@@ -0,0 +1,76 @@
+import io
+import json
+from django.test import SimpleTestCase
+from data_upload.ingestion import iter_json_array
+
+
+def decode(text, chunk_size=4, max_record_size=1024):
+    return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size, max_record_size=max_record_size))
+
+
+class IterJsonArrayTests(SimpleTestCase):
+    def test_records_split_across_chunks(self):
+        records = [
+            {'ts': '2014-01-01T12:00:00Z', 'ms_played': 1000, 'master_metadata_track_name': 'Ballada "x" [live]'},
+            {'ts': '2014-01-01T12:05:00Z', 'ms_played': 0, 'nested': {'a': [1, 2, {'b': None}]}},
+        ]
+        text = json.dumps(records, indent=2)
+
+        for chunk_size in (1, 2, 3, 7, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(decode(text, chunk_size), records)
+
+    def test_empty_array(self):
+        self.assertEqual(decode('[]'), [])
+        self.assertEqual(decode('  [ \n ]  \n'), [])
+
+    def test_scalars_at_chunk_edges(self):
+        text = '[1.5e10, -12, true, false, null, "x", 3]'
+
+        for chunk_size in range(1, len(text) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(decode(text, chunk_size), [1.5e10, -12, True, False, None, 'x', 3])
+
+    def test_scalar_at_end_of_array(self):
+        self.assertEqual(decode('[12345]', chunk_size=3), [12345])
+
+    def test_not_an_array(self):
+        for text in ('', '   ', '{"ts": "2014-01-01T12:00:00Z"}', '"x"'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                decode(text)
+
+    def test_trailing_comma(self):
+        with self.assertRaisesMessage(ValueError, 'after ","'):
+            decode('[{"a": 1},]')
+
+    def test_leading_or_repeated_comma(self):
+        for text in ('[,1]', '[1,,2]'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                decode(text)
+
+    def test_missing_comma(self):
+        with self.assertRaisesMessage(ValueError, 'Expected ","'):
+            decode('[{"a": 1} {"a": 2}]')
+
+    def test_trailing_data(self):
+        with self.assertRaisesMessage(ValueError, 'after the JSON array'):
+            decode('[{"a": 1}] garbage')
+        self.assertEqual(decode('[{"a": 1}]  \n'), [{'a': 1}])
+
+    def test_truncated_file(self):
+        for text in ('[{"a": 1}', '[{"a": 1}, {"a": ', '[1, 2'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                decode(text)
+
+    def test_invalid_literal(self):
+        with self.assertRaises(ValueError):
+            decode('[tru]')
+
+    def test_record_larger_than_limit(self):
+        text = json.dumps([{'name': 'x' * 100}, {'name': 'y' * 5000}])
+
+        records = iter_json_array(io.StringIO(text), chunk_size=16, max_record_size=1000)
+
+        self.assertEqual(next(records), {'name': 'x' * 100})
+        with self.assertRaisesMessage(ValueError, 'larger than 1000 characters'):
+            next(records)
@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+from django.db import connection
+from django.test import TestCase
+from authentication.models import User
+from data_upload.benchmarks import generate_sample_records
+from data_upload.ingestion import ingest_records, iter_batches
+from data_upload.loaders import CopyLoader, OrmLoader
+from data_upload.models import SpotifyDataUpload, StreamingHistory
+
+
+class LoaderTestMixin:
+    loader_class = None
+
+    def setUp(self):
+        self.user = User.objects.create(username='listener', email='listener@example.com')
+        self.upload = self.create_upload()
+        self.records = list(generate_sample_records(50))
+
+    def create_upload(self):
+        return SpotifyDataUpload.objects.create(user=self.user, file_path='', file_size=0)
+
+    def test_records_are_stored(self):
+        inserted = self.loader_class().load(self.upload, self.records)
+
+        self.assertEqual(inserted, 50)
+        stored = StreamingHistory.objects.filter(user=self.user).select_related('track', 'platform')
+        self.assertEqual(stored.count(), 50)
+        for play, record in zip(stored.order_by('ts'), self.records):
+            self.assertEqual(play.ts.strftime('%Y-%m-%dT%H:%M:%SZ'), record['ts'])
+            self.assertEqual(play.ms_played, record['ms_played'])
+            self.assertEqual(play.platform.name, record['platform'])
+            self.assertEqual(play.spotify_episode_uri, record['spotify_episode_uri'])
+            self.assertEqual(play.track and play.track.spotify_uri, record['spotify_track_uri'])
+
+    def test_records_already_stored_are_skipped(self):
+        self.loader_class().load(self.upload, self.records[:30])
+
+        # A second upload of an overlapping export
+        inserted = self.loader_class().load(self.create_upload(), self.records)
+
+        self.assertEqual(inserted, 20)
+        self.assertEqual(StreamingHistory.objects.filter(user=self.user).count(), 50)
+
+    def test_duplicates_within_a_batch_are_stored_once(self):
+        inserted = self.loader_class().load(self.upload, self.records + self.records[:10])
+
+        self.assertEqual(inserted, 50)
+        self.assertEqual(StreamingHistory.objects.filter(user=self.user).count(), 50)
+
+    def test_same_records_of_other_users_are_stored(self):
+        self.loader_class().load(self.upload, self.records)
+        other = User.objects.create(username='other', email='other@example.com')
+
+        inserted = self.loader_class().load(
+            SpotifyDataUpload.objects.create(user=other, file_path='', file_size=0), self.records
+        )
+
+        self.assertEqual(inserted, 50)
+
+    def test_ingest_records_counts_duplicates_and_skipped(self):
+        self.loader_class().load(self.upload, self.records[10:20])
+
+        stats = ingest_records(
+            self.upload, iter_batches(self.records, 8), loader=self.loader_class(), since=self.records[5]['ts']
+        )
+
+        self.assertEqual(stats.skipped, 5)
+        self.assertEqual(stats.duplicates, 10)
+        self.assertEqual(stats.inserted, 35)
+        self.assertEqual(stats.timer.counters['records'], 50)
+
+
+class OrmLoaderTests(LoaderTestMixin, TestCase):
+    loader_class = OrmLoader
+
+    @unittest.skipUnless(
+        connection.features.supports_nulls_distinct_unique_constraints,
+        'unique_streaming_record is not created without NULLS NOT DISTINCT'
+    )
+    def test_conflicts_missed_by_dedup_are_ignored(self):
+        other_upload = self.create_upload()
+        bulk_create = StreamingHistory.objects.bulk_create
+
+        def concurrent_bulk_create(records, **kwargs):
+            # Another upload stores part of the records after the dedup query ran
+            if not other_upload.records.exists():
+                with mock.patch.object(StreamingHistory.objects, 'bulk_create', bulk_create):
+                    self.loader_class().load(other_upload, self.records[:20])
+            return bulk_create(records, **kwargs)
+
+        with mock.patch.object(StreamingHistory.objects, 'bulk_create', concurrent_bulk_create):
+            inserted = self.loader_class().load(self.upload, self.records)
+
+        self.assertEqual(inserted, 30)
+        self.assertEqual(StreamingHistory.objects.filter(user=self.user).count(), 50)
+        self.assertEqual(self.upload.records.count(), 30)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'The COPY loader requires PostgreSQL')
+class CopyLoaderTests(LoaderTestMixin, TestCase):
+    loader_class = CopyLoader
@@ -0,0 +1,78 @@
+from datetime import date, datetime, timedelta, timezone
+from django.test import TestCase
+from authentication.models import User
+from data_upload.models import SpotifyDataUpload, StreamingHistory
+from data_upload.rollups import day_start
+
+
+class HistoryPaginationTests(TestCase):
+    url = '/api/upload/history/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='listener', email='listener@example.com')
+        upload = SpotifyDataUpload.objects.create(user=cls.user, file_path='', file_size=0)
+        start = datetime(2014, 1, 1, tzinfo=timezone.utc)
+        # Pairs of plays share a timestamp, so pages also split on the id
+        StreamingHistory.objects.bulk_create([
+            StreamingHistory(user=cls.user, upload=upload, ts=start + timedelta(hours=3 * (i // 2)), ms_played=i)
+            for i in range(25)
+        ])
+        other = User.objects.create(username='other', email='other@example.com')
+        StreamingHistory.objects.create(
+            user=other,
+            upload=SpotifyDataUpload.objects.create(user=other, file_path='', file_size=0),
+            ts=start,
+            ms_played=0
+        )
+        cls.plays = StreamingHistory.objects.filter(user=cls.user).order_by('-ts', '-id')
+        cls.expected = list(cls.plays.values_list('ms_played', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def fetch_all(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([play['ms_played'] for play in response.json()['results']])
+            url = response.json()['next']
+        return pages
+
+    def test_pages_follow_each_other_without_gaps_or_repeats(self):
+        for page_size in (1, 2, 3, 7, 25, 100):
+            with self.subTest(page_size=page_size):
+                pages = self.fetch_all(f'{self.url}?page_size={page_size}')
+
+                self.assertEqual(sum(pages, []), self.expected)
+                self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+
+    def test_last_full_page_has_no_next_link(self):
+        pages = self.fetch_all(f'{self.url}?page_size=5')
+
+        self.assertEqual(len(pages), 5)
+
+    def test_date_filter_applies_to_every_page(self):
+        # The plays span two days, split across pages
+        day = date(2014, 1, 1)
+        first_day = list(self.plays.filter(ts__lt=day_start(day, 1)).values_list('ms_played', flat=True))
+        later = list(self.plays.filter(ts__gte=day_start(day, 1)).values_list('ms_played', flat=True))
+        self.assertTrue(first_day and later)
+
+        pages = self.fetch_all(f'{self.url}?page_size=4&end_date=2014-01-01')
+        self.assertEqual(sum(pages, []), first_day)
+        pages = self.fetch_all(f'{self.url}?page_size=4&start_date=2014-01-02')
+        self.assertEqual(sum(pages, []), later)
+
+    def test_page_size_is_at_least_one(self):
+        response = self.client.get(f'{self.url}?page_size=0')
+
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', 'bm9waXBl', 'eHx5'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'{self.url}?cursor={cursor}')
+
+                self.assertEqual(response.status_code, 404)
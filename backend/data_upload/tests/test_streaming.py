@@ -0,0 +1,105 @@
+import io
+import os
+import zipfile
+from django.test import SimpleTestCase
+from data_upload.streaming import UnsupportedMember, iter_zip_members
+
+
+class UnseekableWriter(io.RawIOBase):
+    """
+    Write-only stream without seek(), so zipfile writes data descriptors
+    after the members instead of patching their local headers
+    """
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+MEMBERS = {
+    'Spotify Extended Streaming History/Streaming_History_Audio_2014.json': b'[' + b'{"ms_played": 1},' * 20000 + b'{}]',
+    'Spotify Extended Streaming History/ReadMeFirst.pdf': os.urandom(100 * 1024),
+    'Spotify Extended Streaming History/empty.json': b'',
+    'Zażółć.json': b'[]',
+}
+
+
+def build_archive(compression, seekable=True, zip64=False):
+    target = io.BytesIO() if seekable else UnseekableWriter()
+    with zipfile.ZipFile(target, 'w', compression) as archive:
+        for name, data in MEMBERS.items():
+            info = zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+            info.compress_type = compression
+            with archive.open(info, 'w', force_zip64=zip64) as member:
+                member.write(data)
+    return (target if seekable else target.buffer).getvalue()
+
+
+def read_members(archive):
+    return {name: b''.join(chunks) for name, chunks in iter_zip_members(io.BytesIO(archive))}
+
+
+class IterZipMembersTests(SimpleTestCase):
+    def test_stored_members(self):
+        self.assertEqual(read_members(build_archive(zipfile.ZIP_STORED)), MEMBERS)
+
+    def test_deflated_members(self):
+        self.assertEqual(read_members(build_archive(zipfile.ZIP_DEFLATED)), MEMBERS)
+
+    def test_deflated_members_with_data_descriptors(self):
+        archive = build_archive(zipfile.ZIP_DEFLATED, seekable=False)
+        flags = zipfile.ZipFile(io.BytesIO(archive)).infolist()[0].flag_bits
+        self.assertTrue(flags & 0x8)
+
+        self.assertEqual(read_members(archive), MEMBERS)
+
+    def test_stored_members_with_data_descriptors_are_unsupported(self):
+        archive = build_archive(zipfile.ZIP_STORED, seekable=False)
+
+        with self.assertRaises(UnsupportedMember):
+            read_members(archive)
+
+    def test_zip64_members(self):
+        for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with self.subTest(compression=compression):
+                archive = build_archive(compression, zip64=True)
+                self.assertEqual(read_members(archive), MEMBERS)
+
+    def test_zip64_members_with_data_descriptors(self):
+        archive = build_archive(zipfile.ZIP_DEFLATED, seekable=False, zip64=True)
+
+        self.assertEqual(read_members(archive), MEMBERS)
+
+    def test_unread_members_are_skipped(self):
+        archive = build_archive(zipfile.ZIP_DEFLATED, seekable=False)
+
+        names = [name for name, chunks in iter_zip_members(io.BytesIO(archive))]
+
+        self.assertEqual(names, list(MEMBERS))
+
+    def test_partly_read_member_is_skipped(self):
+        archive = build_archive(zipfile.ZIP_DEFLATED)
+        members = iter_zip_members(io.BytesIO(archive))
+
+        name, chunks = next(members)
+        next(chunks)
+
+        self.assertEqual([name for name, chunks in members], list(MEMBERS)[1:])
+
+    def test_corrupted_member(self):
+        archive = bytearray(build_archive(zipfile.ZIP_STORED))
+        position = archive.index(b'{"ms_played": 1}')
+        archive[position + 2] ^= 0xFF
+
+        with self.assertRaisesMessage(zipfile.BadZipFile, 'Bad CRC-32'):
+            read_members(bytes(archive))
+
+    def test_truncated_archive(self):
+        archive = build_archive(zipfile.ZIP_DEFLATED)
+
+        with self.assertRaises(zipfile.BadZipFile):
+            read_members(archive[:len(archive) // 2])
@@ -3,11 +3,20 @@ from . import views
 
 urlpatterns = [
     path('', views.upload_spotify_data, name='upload_spotify_data'),
+    path('chunked/', views.start_chunked_upload, name='start_chunked_upload'),
+    path('chunked/<int:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    path('chunked/<int:upload_id>/complete/', views.finish_chunked_upload, name='finish_chunked_upload'),
     path('list/', views.get_uploads, name='get_uploads'),
+    path('status/<int:upload_id>/', views.get_upload_status, name='get_upload_status'),
+    path('status/<int:upload_id>/profile/', views.download_upload_profile, name='download_upload_profile'),
     path('stats/', views.get_streaming_stats, name='get_streaming_stats'),
     path('top-tracks/', views.get_top_tracks, name='get_top_tracks'),
     path('generate-playlist/', views.generate_custom_playlist, name='generate_custom_playlist'),
     path('monthly-stats/', views.get_monthly_listening_stats, name='get_monthly_listening_stats'),
     path('delete-all/', views.delete_all_streaming_data, name='delete_all_streaming_data'),
     path('create-playlist/', views.create_spotify_playlist, name='create_spotify_playlist'),
+    path('cache-stats/', views.get_stats_cache_counters, name='get_stats_cache_counters'),
+    path('export/', views.export_streaming_history, name='export_streaming_history'),
+    path('history/', views.get_streaming_history, name='get_streaming_history'),
+    path('analytics/', views.get_listening_analytics, name='get_listening_analytics'),
 ]
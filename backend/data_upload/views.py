@@ -1,17 +1,35 @@
 import os
 import json
-import zipfile
-import requests
-from datetime import datetime
+from time import perf_counter
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, StreamingHttpResponse
 from django.db import models
+from django.db.models.functions import Trunc
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, parser_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import SpotifyDataUpload, StreamingHistory
-from .serializers import SpotifyDataUploadSerializer
+from authentication.spotify_client import SpotifyClient
+from authentication.spotify_tokens import get_access_token
+from .models import SpotifyDataUpload, StreamingHistory, DailyTrackStats, Artist, Track, PlaylistExport
+from .serializers import SpotifyDataUploadSerializer, StreamingHistorySerializer
+from .pagination import KeysetPagination
+from .jobs import enqueue_upload
+from .chunked import (
+    OffsetMismatch, create_chunked_upload, write_chunk, complete_chunked_upload, starts_ingestion_early,
+    is_receiving
+)
+from .cache import bump_data_version, get_cached_stats, get_cache_counters
+from .rollups import day_start
+from .profiling import get_profile_path
+from .deletion import delete_user_history, delete_user_uploads
+from .columnar import iter_history_parquet
+from .playlists import get_playlist_track_uris, create_playlist_export, add_playlist_tracks
+from . import snapshots
 
 
 @api_view(['POST'])
@@ -19,7 +37,10 @@ from .serializers import SpotifyDataUploadSerializer
 @parser_classes([MultiPartParser, FormParser])
 def upload_spotify_data(request):
     """
-    Upload Spotify data ZIP file
+    Upload Spotify data ZIP file (or a Parquet export of this app)
+    Optional form fields:
+    - incremental: only ingest records newer than the latest stored play
+    - profile: capture a cProfile of the processing (with INGESTION_PROFILING)
     """
     if 'file' not in request.FILES:
         return Response(
@@ -30,9 +51,10 @@ def upload_spotify_data(request):
     uploaded_file = request.FILES['file']
     
     # Validate file type
-    if not uploaded_file.name.endswith('.zip'):
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    if extension not in ('.zip', '.parquet'):
         return Response(
-            {'error': 'File must be a ZIP archive'},
+            {'error': 'File must be a ZIP archive or a Parquet export'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
@@ -42,104 +64,188 @@ def upload_spotify_data(request):
     
     # Save uploaded file
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    file_path = os.path.join(user_upload_dir, f'spotify_data_{timestamp}.zip')
+    file_path = os.path.join(user_upload_dir, f'spotify_data_{timestamp}{extension}')
     
+    started = perf_counter()
     with open(file_path, 'wb+') as destination:
         for chunk in uploaded_file.chunks():
             destination.write(chunk)
+    save_time = perf_counter() - started
     
     # Create upload record
     upload = SpotifyDataUpload.objects.create(
         user=request.user,
         file_path=file_path,
         file_size=uploaded_file.size,
-        processing_status='uploaded'
+        processing_status='uploaded',
+        incremental=str(request.data.get('incremental', '')).lower() in ('1', 'true', 'yes'),
+        profile=profile_requested(request),
+        timings={'stages': {'save': round(save_time, 4)}}
     )
     
-    # Process the ZIP file
+    # Hand the file over to the background workers
+    enqueue_upload(upload)
+    
+    return Response(
+        {
+            'message': 'File uploaded and queued for processing',
+            'job_id': upload.id,
+            'upload': SpotifyDataUploadSerializer(upload).data
+        },
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def start_chunked_upload(request):
+    """
+    Start a resumable chunked upload
+    JSON body:
+    - filename: Name of the ZIP archive or Parquet export
+    - size: File size in bytes
+    - incremental: only ingest records newer than the latest stored play
+    - profile: capture a cProfile of the processing (with INGESTION_PROFILING)
+    Chunks are then sent with PUT /chunked/<id>/?offset=N and the upload is
+    finished with POST /chunked/<id>/complete/
+    """
     try:
-        process_spotify_zip(upload, file_path)
-        upload.processed = True
-        upload.processing_status = 'completed'
-        upload.save()
-        
+        size = int(request.data.get('size'))
+    except (TypeError, ValueError):
         return Response(
-            {
-                'message': 'File uploaded and processed successfully',
-                'upload': SpotifyDataUploadSerializer(upload).data
-            },
-            status=status.HTTP_201_CREATED
+            {'error': 'size must be the file size in bytes'},
+            status=status.HTTP_400_BAD_REQUEST
         )
-    except Exception as e:
-        upload.processing_status = 'failed'
-        upload.save()
+    
+    try:
+        upload = create_chunked_upload(
+            request.user,
+            request.data.get('filename'),
+            size,
+            incremental=str(request.data.get('incremental', '')).lower() in ('1', 'true', 'yes'),
+            profile=profile_requested(request)
+        )
+    except ValueError as e:
         return Response(
-            {'error': f'Error processing file: {str(e)}'},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
         )
+    
+    # ZIP archives are parsed while their chunks arrive
+    if starts_ingestion_early(upload):
+        enqueue_upload(upload)
+    
+    return Response(
+        {
+            'upload_id': upload.id,
+            'offset': 0,
+            'chunk_size': settings.UPLOAD_CHUNK_SIZE
+        },
+        status=status.HTTP_201_CREATED
+    )
 
 
-def process_spotify_zip(upload, file_path):
+@api_view(['GET', 'PUT'])
+@permission_classes([IsAuthenticated])
+def chunked_upload(request, upload_id):
     """
-    Process Spotify data ZIP file and extract streaming history
+    GET returns the offset to resume a chunked upload from.
+    PUT stores the raw request body at the `offset` query parameter; an
+    optional X-Content-SHA256 header is checked against the chunk.
+    A wrong offset is answered with 409 and the expected offset.
     """
-    extract_dir = file_path.replace('.zip', '_extracted')
-    os.makedirs(extract_dir, exist_ok=True)
+    try:
+        upload = SpotifyDataUpload.objects.get(id=upload_id, user=request.user)
+    except SpotifyDataUpload.DoesNotExist:
+        return Response(
+            {'error': 'Upload not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    if request.method == 'GET':
+        return Response({
+            'upload_id': upload.id,
+            'offset': upload.bytes_received,
+            'size': upload.file_size,
+            'processing_status': upload.processing_status,
+            'is_receiving': is_receiving(upload),
+            'chunk_size': settings.UPLOAD_CHUNK_SIZE
+        })
     
-    # Extract ZIP file
-    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_dir)
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return Response(
+            {'error': 'offset query parameter and Content-Length are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if length > settings.UPLOAD_CHUNK_SIZE:
+        return Response(
+            {'error': f'Chunks must not exceed {settings.UPLOAD_CHUNK_SIZE} bytes'},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
     
-    # Find and process streaming history JSON files
-    for root, dirs, files in os.walk(extract_dir):
-        for file in files:
-            if file.startswith('Streaming_History') and file.endswith('.json'):
-                json_path = os.path.join(root, file)
-                process_streaming_history_file(upload, json_path)
+    try:
+        # The body is read from the request stream, never parsed into memory
+        new_offset = write_chunk(
+            upload, offset, request._request, length, checksum=request.META.get('HTTP_X_CONTENT_SHA256')
+        )
+    except OffsetMismatch as e:
+        return Response(
+            {'error': 'Chunk does not start at the current offset', 'offset': e.offset},
+            status=status.HTTP_409_CONFLICT
+        )
+    except ValueError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response({'upload_id': upload.id, 'offset': new_offset, 'size': upload.file_size})
 
 
-def process_streaming_history_file(upload, json_path):
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finish_chunked_upload(request, upload_id):
     """
-    Process individual streaming history JSON file
+    Finish a chunked upload and queue it for processing
+    Optional JSON body:
+    - checksum: SHA-256 hex digest of the whole file
     """
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    try:
+        upload = SpotifyDataUpload.objects.get(id=upload_id, user=request.user)
+    except SpotifyDataUpload.DoesNotExist:
+        return Response(
+            {'error': 'Upload not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
     
-    records = []
-    for item in data:
-        # Parse timestamp
-        ts = datetime.fromisoformat(item.get('ts', '').replace('Z', '+00:00'))
-        
-        # Create streaming history record
-        record = StreamingHistory(
-            user=upload.user,
-            upload=upload,
-            ts=ts,
-            username=item.get('username', ''),
-            platform=item.get('platform', ''),
-            ms_played=item.get('ms_played', 0),
-            conn_country=item.get('conn_country', ''),
-            ip_addr_decrypted=item.get('ip_addr_decrypted', None),
-            user_agent_decrypted=item.get('user_agent_decrypted', ''),
-            master_metadata_track_name=item.get('master_metadata_track_name', ''),
-            master_metadata_album_artist_name=item.get('master_metadata_album_artist_name', ''),
-            master_metadata_album_album_name=item.get('master_metadata_album_album_name', ''),
-            spotify_track_uri=item.get('spotify_track_uri', ''),
-            episode_name=item.get('episode_name', ''),
-            episode_show_name=item.get('episode_show_name', ''),
-            spotify_episode_uri=item.get('spotify_episode_uri', ''),
-            reason_start=item.get('reason_start', ''),
-            reason_end=item.get('reason_end', ''),
-            shuffle=item.get('shuffle', False),
-            skipped=item.get('skipped', False),
-            offline=item.get('offline', False),
-            offline_timestamp=item.get('offline_timestamp', None),
-            incognito_mode=item.get('incognito_mode', False),
-        )
-        records.append(record)
-    
-    # Bulk create records for better performance
-    StreamingHistory.objects.bulk_create(records, batch_size=1000)
+    try:
+        upload = complete_chunked_upload(upload, checksum=request.data.get('checksum'))
+    except OffsetMismatch as e:
+        return Response(
+            {'error': 'Upload is incomplete', 'offset': e.offset},
+            status=status.HTTP_409_CONFLICT
+        )
+    except ValueError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Hand the file over to the background workers, unless they already ingest it
+    if upload.processing_status == 'uploaded':
+        enqueue_upload(upload)
+    
+    return Response(
+        {
+            'message': 'File uploaded and queued for processing',
+            'job_id': upload.id,
+            'upload': SpotifyDataUploadSerializer(upload).data
+        },
+        status=status.HTTP_202_ACCEPTED
+    )
 
 
 @api_view(['GET'])
@@ -148,21 +254,78 @@ def get_uploads(request):
     """
     Get all uploads for the current user
     """
-    uploads = SpotifyDataUpload.objects.filter(user=request.user)
+    uploads = SpotifyDataUpload.objects.filter(user=request.user).prefetch_related('files')
     serializer = SpotifyDataUploadSerializer(uploads, many=True)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_upload_status(request, upload_id):
+    """
+    Get processing status and progress of a single upload job
+    """
+    try:
+        upload = SpotifyDataUpload.objects.get(id=upload_id, user=request.user)
+    except SpotifyDataUpload.DoesNotExist:
+        return Response(
+            {'error': 'Upload not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    return Response(SpotifyDataUploadSerializer(upload).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_upload_profile(request, upload_id):
+    """
+    Download the cProfile capture of an upload (pstats format, e.g. for
+    `python -m pstats` or snakeviz)
+    """
+    try:
+        upload = SpotifyDataUpload.objects.get(id=upload_id, user=request.user)
+    except SpotifyDataUpload.DoesNotExist:
+        return Response(
+            {'error': 'Upload not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    path = get_profile_path(upload)
+    if not upload.profile or not os.path.exists(path):
+        return Response(
+            {'error': 'No profile was captured for this upload'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    return FileResponse(
+        open(path, 'rb'),
+        as_attachment=True,
+        filename=f'upload_{upload.id}.prof',
+        content_type='application/octet-stream'
+    )
+
+
+def profile_requested(request):
+    """
+    Check whether the request asks for a profile of the upload processing
+    """
+    requested = str(request.data.get('profile', '')).lower() in ('1', 'true', 'yes')
+    return requested and settings.INGESTION_PROFILING
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_streaming_stats(request):
     """
     Get basic streaming statistics for the user
     """
-    total_records = StreamingHistory.objects.filter(user=request.user).count()
-    total_ms_played = StreamingHistory.objects.filter(user=request.user).aggregate(
+    totals = DailyTrackStats.objects.filter(user=request.user).aggregate(
+        records=models.Sum('play_count'),
         total=models.Sum('ms_played')
-    )['total'] or 0
+    )
+    total_records = totals['records'] or 0
+    total_ms_played = totals['total'] or 0
     
     total_hours = total_ms_played / (1000 * 60 * 60)
     
@@ -173,6 +336,59 @@ def get_streaming_stats(request):
     })
 
 
+def get_ranked_tracks(query, limit):
+    """
+    Group daily rollup rows by track id and return the most played tracks
+    with their names, looked up from the dimension tables
+    """
+    top_tracks = list(
+        query
+        .values('track_id')
+        .annotate(
+            play_count=models.Sum('play_count'),
+            total_ms_played=models.Sum('ms_played')
+        )
+        .order_by('-play_count')[:limit]
+    )
+    return rank_tracks(top_tracks)
+
+
+def rank_tracks(top_tracks):
+    """
+    Add ranking and track names to rows with track_id, play_count and
+    total_ms_played
+    """
+    tracks = Track.objects.select_related('artist', 'album').in_bulk(
+        [row['track_id'] for row in top_tracks]
+    )
+    
+    # Convert to list and add ranking
+    result = []
+    for idx, row in enumerate(top_tracks, start=1):
+        track = tracks[row['track_id']]
+        total_hours = row['total_ms_played'] / (1000 * 60 * 60)
+        result.append({
+            'rank': idx,
+            'track_name': track.name,
+            'artist_name': track.artist.name if track.artist else None,
+            'album_name': track.album.name if track.album else None,
+            'play_count': row['play_count'],
+            'total_hours_played': round(total_hours, 2),
+            'spotify_track_uri': track.spotify_uri
+        })
+    return result
+
+
+def compute_top_tracks(user, query, start_date, end_date, limit):
+    """
+    Rank the user's top tracks with the configured analytics engine
+    """
+    snapshot = snapshots.get_engine_snapshot(user)
+    if snapshot is not None:
+        return rank_tracks(snapshots.top_tracks(snapshot, start_date, end_date, limit))
+    return get_ranked_tracks(query, limit)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_top_tracks(request):
@@ -182,23 +398,22 @@ def get_top_tracks(request):
     - start_date: Start date in YYYY-MM-DD format
     - end_date: End date in YYYY-MM-DD format
     """
-    from datetime import timedelta
-    
     # Get date range filters
     start_date_str = request.GET.get('start_date')
     end_date_str = request.GET.get('end_date')
+    start_date = end_date = None
     
     # Build base query
-    query = StreamingHistory.objects.filter(
+    query = DailyTrackStats.objects.filter(
         user=request.user,
-        master_metadata_track_name__isnull=False  # Exclude null track names
+        track__isnull=False  # Exclude plays without track info
     )
     
     # Apply date range filter
     if start_date_str:
         try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            query = query.filter(ts__gte=start_date)
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            query = query.filter(day__gte=start_date)
         except ValueError:
             return Response(
                 {'error': 'Invalid start_date format. Use YYYY-MM-DD'},
@@ -207,44 +422,21 @@ def get_top_tracks(request):
     
     if end_date_str:
         try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            # Include the entire end date (until 23:59:59)
-            end_date = end_date + timedelta(days=1)
-            query = query.filter(ts__lt=end_date)
+            # The entire end date is included
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            query = query.filter(day__lte=end_date)
         except ValueError:
             return Response(
                 {'error': 'Invalid end_date format. Use YYYY-MM-DD'},
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    # Group by track name, artist, and album, then count plays
-    top_tracks = (
-        query
-        .values(
-            'master_metadata_track_name',
-            'master_metadata_album_artist_name',
-            'master_metadata_album_album_name'
-        )
-        .annotate(
-            play_count=models.Count('id'),
-            total_ms_played=models.Sum('ms_played')
-        )
-        .order_by('-play_count')[:50]
+    # Group by track and count plays (cached until the user's data changes)
+    result = get_cached_stats(
+        request.user, 'top_tracks', (start_date_str, end_date_str, 50),
+        lambda: compute_top_tracks(request.user, query, start_date, end_date, 50)
     )
     
-    # Convert to list and add ranking
-    result = []
-    for idx, track in enumerate(top_tracks, start=1):
-        total_hours = track['total_ms_played'] / (1000 * 60 * 60)
-        result.append({
-            'rank': idx,
-            'track_name': track['master_metadata_track_name'],
-            'artist_name': track['master_metadata_album_artist_name'],
-            'album_name': track['master_metadata_album_album_name'],
-            'play_count': track['play_count'],
-            'total_hours_played': round(total_hours, 2)
-        })
-    
     return Response(result)
 
 
@@ -256,13 +448,12 @@ def generate_custom_playlist(request):
     Query parameters:
     - start_date: Start date in YYYY-MM-DD format
     - end_date: End date in YYYY-MM-DD format
-    - limit: Number of tracks (default 50, max 200)
+    - limit: Number of tracks (default 50, max PLAYLIST_MAX_TRACKS)
     """
-    from datetime import timedelta
-    
     # Get parameters
     start_date_str = request.GET.get('start_date')
     end_date_str = request.GET.get('end_date')
+    start_date = end_date = None
     limit = request.GET.get('limit', '50')
     
     # Validate and parse limit
@@ -270,25 +461,25 @@ def generate_custom_playlist(request):
         limit = int(limit)
         if limit < 1:
             limit = 1
-        elif limit > 200:
-            limit = 200
+        elif limit > settings.PLAYLIST_MAX_TRACKS:
+            limit = settings.PLAYLIST_MAX_TRACKS
     except ValueError:
         return Response(
-            {'error': 'Invalid limit. Must be a number between 1 and 200'},
+            {'error': f'Invalid limit. Must be a number between 1 and {settings.PLAYLIST_MAX_TRACKS}'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
     # Build base query
-    query = StreamingHistory.objects.filter(
+    query = DailyTrackStats.objects.filter(
         user=request.user,
-        master_metadata_track_name__isnull=False
+        track__isnull=False
     )
     
     # Apply date range filter
     if start_date_str:
         try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            query = query.filter(ts__gte=start_date)
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            query = query.filter(day__gte=start_date)
         except ValueError:
             return Response(
                 {'error': 'Invalid start_date format. Use YYYY-MM-DD'},
@@ -297,46 +488,20 @@ def generate_custom_playlist(request):
     
     if end_date_str:
         try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            end_date = end_date + timedelta(days=1)
-            query = query.filter(ts__lt=end_date)
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            query = query.filter(day__lte=end_date)
         except ValueError:
             return Response(
                 {'error': 'Invalid end_date format. Use YYYY-MM-DD'},
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    # Group and get top tracks
-    top_tracks = (
-        query
-        .values(
-            'master_metadata_track_name',
-            'master_metadata_album_artist_name',
-            'master_metadata_album_album_name'
-        )
-        .annotate(
-            play_count=models.Count('id'),
-            total_ms_played=models.Sum('ms_played')
-        )
-        .order_by('-play_count')[:limit]
+    # Group and get top tracks (cached until the user's data changes)
+    result = get_cached_stats(
+        request.user, 'top_tracks', (start_date_str, end_date_str, limit),
+        lambda: compute_top_tracks(request.user, query, start_date, end_date, limit)
     )
-    
-    # Convert to list
-    tracks_list = list(top_tracks)
-    actual_count = len(tracks_list)
-    
-    # Add ranking
-    result = []
-    for idx, track in enumerate(tracks_list, start=1):
-        total_hours = track['total_ms_played'] / (1000 * 60 * 60)
-        result.append({
-            'rank': idx,
-            'track_name': track['master_metadata_track_name'],
-            'artist_name': track['master_metadata_album_artist_name'],
-            'album_name': track['master_metadata_album_album_name'],
-            'play_count': track['play_count'],
-            'total_hours_played': round(total_hours, 2)
-        })
+    actual_count = len(result)
     
     return Response({
         'tracks': result,
@@ -353,15 +518,16 @@ def delete_all_streaming_data(request):
     Delete all streaming data and uploads for the authenticated user
     """
     try:
-        # Count records before deletion
-        streaming_count = StreamingHistory.objects.filter(user=request.user).count()
-        upload_count = SpotifyDataUpload.objects.filter(user=request.user).count()
+        # Delete all streaming history, then its rollup
+        streaming_count = delete_user_history(request.user)
+        DailyTrackStats.objects.filter(user=request.user).delete()
         
-        # Delete all streaming history
-        StreamingHistory.objects.filter(user=request.user).delete()
+        # Delete all upload records and their files
+        upload_count = delete_user_uploads(request.user)
         
-        # Delete all upload records
-        SpotifyDataUpload.objects.filter(user=request.user).delete()
+        # Invalidate cached statistics and snapshots
+        bump_data_version(request.user)
+        snapshots.remove_snapshots(request.user)
         
         return Response({
             'success': True,
@@ -374,28 +540,18 @@ def delete_all_streaming_data(request):
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
-    
-    # Format the response
-    tracks_data = []
-    for idx, track in enumerate(top_tracks, 1):
-        tracks_data.append({
-            'rank': idx,
-            'track_name': track['master_metadata_track_name'],
-            'artist_name': track['master_metadata_album_artist_name'] or 'Unknown Artist',
-            'album_name': track['master_metadata_album_album_name'] or 'Unknown Album',
-            'play_count': track['play_count'],
-            'total_hours_played': round(track['total_ms_played'] / (1000 * 60 * 60), 2),
-            'spotify_track_uri': None  # Will be populated if available
-        })
-    
-    return Response(tracks_data)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_spotify_playlist(request):
     """
-    Create a Spotify playlist from top 50 tracks
+    Create a Spotify playlist from the user's most played tracks
+    Optional JSON body:
+    - start_date: Start date in YYYY-MM-DD format
+    - end_date: End date in YYYY-MM-DD format
+    - limit: Number of tracks (default 50, max PLAYLIST_MAX_TRACKS)
+    - export_id: Resume a failed export, continuing after its last added batch
     """
     user = request.user
     
@@ -406,148 +562,372 @@ def create_spotify_playlist(request):
             status=status.HTTP_401_UNAUTHORIZED
         )
     
-    # Check if token is expired
-    if user.spotify_token_expires_at and datetime.now() >= user.spotify_token_expires_at.replace(tzinfo=None):
+    # Refreshed ahead of expiry - None means the refresh token no longer works
+    access_token = get_access_token(user)
+    if not access_token:
         return Response(
             {'error': 'Spotify token expired. Please reconnect your Spotify account.'},
             status=status.HTTP_401_UNAUTHORIZED
         )
     
-    access_token = user.spotify_access_token
-    spotify_user_id = user.spotify_user_id
+    # One client (and pooled connection) for all calls of this request
+    spotify = SpotifyClient(access_token)
     
-    # Get top tracks with Spotify URIs
-    top_tracks = (
-        StreamingHistory.objects
-        .filter(
-            user=request.user,
-            master_metadata_track_name__isnull=False,
-            spotify_track_uri__isnull=False  # Only tracks with valid Spotify URIs
-        )
-        .values(
-            'master_metadata_track_name',
-            'master_metadata_album_artist_name',
-            'spotify_track_uri'
-        )
-        .annotate(
-            play_count=models.Count('id')
+    if request.data.get('export_id'):
+        try:
+            export = PlaylistExport.objects.get(pk=request.data['export_id'], user=user)
+        except (PlaylistExport.DoesNotExist, ValueError, TypeError):
+            return Response(
+                {'error': 'Playlist export not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if export.status == 'completed':
+            return playlist_export_response(export)
+        return playlist_export_response(add_playlist_tracks(export, spotify))
+    
+    # Get parameters
+    try:
+        limit = max(1, min(int(request.data.get('limit', 50)), settings.PLAYLIST_MAX_TRACKS))
+    except (ValueError, TypeError):
+        return Response(
+            {'error': f'Invalid limit. Must be a number between 1 and {settings.PLAYLIST_MAX_TRACKS}'},
+            status=status.HTTP_400_BAD_REQUEST
         )
-        .order_by('-play_count')[:50]
-    )
     
-    if not top_tracks:
+    dates = {}
+    for param in ('start_date', 'end_date'):
+        if request.data.get(param):
+            try:
+                dates[param] = datetime.strptime(request.data[param], '%Y-%m-%d').date()
+            except (ValueError, TypeError):
+                return Response(
+                    {'error': f'Invalid {param} format. Use YYYY-MM-DD'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+    
+    # Get top tracks with Spotify URIs
+    track_uris = get_playlist_track_uris(user, limit=limit, **dates)
+    
+    if not track_uris:
         return Response(
             {'error': 'No tracks with Spotify URIs found in your data.'},
             status=status.HTTP_404_NOT_FOUND
         )
     
-    # Extract unique track URIs
-    track_uris = list(set([track['spotify_track_uri'] for track in top_tracks]))
-    
     # Create playlist
-    playlist_name = f"Top 50 - {datetime.now().strftime('%Y-%m-%d')}"
-    playlist_description = f"Your top 50 most played tracks generated by Enhanced Spotify App"
+    playlist_name = f"Top {len(track_uris)} - {datetime.now().strftime('%Y-%m-%d')}"
+    playlist_description = f"Your top {len(track_uris)} most played tracks generated by Enhanced Spotify App"
+    if dates:
+        period = ' - '.join(request.data.get(param) or '...' for param in ('start_date', 'end_date'))
+        playlist_description += f" ({period})"
+    
+    export, failed_response = create_playlist_export(
+        user, spotify, playlist_name, playlist_description, track_uris
+    )
+    if export is None:
+        return Response(
+            {'error': 'Failed to create playlist on Spotify', 'details': failed_response.text},
+            status=status.HTTP_502_BAD_GATEWAY
+        )
     
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
+    return playlist_export_response(add_playlist_tracks(export, spotify))
+
+
+def playlist_export_response(export):
+    """
+    Report the outcome of a playlist export. A partial export is reported
+    with its progress and the export_id needed to resume it.
+    """
+    data = {
+        'success': export.status == 'completed',
+        'export_id': export.pk,
+        'playlist_id': export.spotify_playlist_id,
+        'playlist_url': export.playlist_url,
+        'playlist_name': export.name,
+        'tracks_added': export.tracks_added,
+        'tracks_total': len(export.track_uris)
     }
+    if export.status == 'completed':
+        return Response(data)
     
-    # Create empty playlist
-    create_playlist_url = f'https://api.spotify.com/v1/users/{spotify_user_id}/playlists'
-    create_data = {
-        'name': playlist_name,
-        'description': playlist_description,
-        'public': False
-    }
+    data['error'] = 'Playlist created but not all tracks could be added. Retry to resume.'
+    data['details'] = export.error_message
+    return Response(data, status=status.HTTP_502_BAD_GATEWAY)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_stats_cache_counters(request):
+    """
+    Get hit/miss counters of the statistics cache (admin only)
+    """
+    return Response(get_cache_counters())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_streaming_history(request):
+    """
+    Download the user's streaming history as a compressed Parquet file,
+    streamed in row groups. The file can be uploaded again to re-import it.
+    """
+    try:
+        chunks = iter_history_parquet(request.user)
+        first_chunk = next(chunks)  # fails early when pyarrow is missing
+    except ImproperlyConfigured as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    
+    def stream():
+        yield first_chunk
+        yield from chunks
+    
+    filename = f'spotify_history_{datetime.now().strftime("%Y%m%d_%H%M%S")}.parquet'
+    response = StreamingHttpResponse(stream(), content_type='application/vnd.apache.parquet')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# Rows fetched per database round trip when streaming the history as NDJSON
+HISTORY_STREAM_CHUNK_SIZE = 2000
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_streaming_history(request):
+    """
+    List the user's raw plays, newest first, with cursor pagination
+    Query parameters:
+    - start_date: Start date in YYYY-MM-DD format
+    - end_date: End date in YYYY-MM-DD format
+    - page_size: Plays per page (default 100, max 1000)
+    - cursor: Opaque cursor from the `next` link of the previous page
+    - stream: "ndjson" streams all matching plays as newline-delimited JSON
+    """
+    query = StreamingHistory.objects.filter(user=request.user).select_related(
+        'track__artist', 'track__album', 'platform', 'reason_start', 'reason_end'
+    )
+    
+    for param, lookup, offset in (('start_date', 'ts__gte', 0), ('end_date', 'ts__lt', 1)):
+        if request.GET.get(param):
+            try:
+                day = datetime.strptime(request.GET[param], '%Y-%m-%d').date()
+            except ValueError:
+                return Response(
+                    {'error': f'Invalid {param} format. Use YYYY-MM-DD'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            query = query.filter(**{lookup: day_start(day, offset)})
+    
+    if request.GET.get('stream') == 'ndjson':
+        return StreamingHttpResponse(iter_history_ndjson(query), content_type='application/x-ndjson')
+    
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(query, request)
+    serializer = StreamingHistorySerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+def iter_history_ndjson(query):
+    # Server-side cursor over the whole result, one serializer reused for every row
+    serializer = StreamingHistorySerializer()
+    lines = []
+    for play in query.order_by('-ts', '-id').iterator(chunk_size=HISTORY_STREAM_CHUNK_SIZE):
+        lines.append(json.dumps(serializer.to_representation(play)))
+        if len(lines) == HISTORY_STREAM_CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_listening_analytics(request):
+    """
+    Get top artists and a weekday x hour listening heatmap, computed from
+    the user's columnar snapshot
+    Query parameters:
+    - start_date: Start date in YYYY-MM-DD format
+    - end_date: End date in YYYY-MM-DD format
+    - limit: Number of artists (default 20, max 200)
+    """
+    start_date = end_date = None
+    if request.GET.get('start_date'):
+        try:
+            start_date = datetime.strptime(request.GET['start_date'], '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {'error': 'Invalid start_date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
     
-    create_response = requests.post(create_playlist_url, headers=headers, json=create_data)
+    if request.GET.get('end_date'):
+        try:
+            end_date = datetime.strptime(request.GET['end_date'], '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {'error': 'Invalid end_date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
     
-    if create_response.status_code not in [200, 201]:
+    try:
+        limit = min(max(int(request.GET.get('limit', '20')), 1), 200)
+    except ValueError:
         return Response(
-            {'error': 'Failed to create playlist on Spotify', 'details': create_response.json()},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': 'Invalid limit. Must be a number between 1 and 200'},
+            status=status.HTTP_400_BAD_REQUEST
         )
     
-    playlist_data = create_response.json()
-    playlist_id = playlist_data['id']
-    playlist_url = playlist_data['external_urls']['spotify']
+    try:
+        snapshot = snapshots.get_snapshot(request.user)
+    except ImproperlyConfigured as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
     
-    # Add tracks to playlist (Spotify allows max 100 tracks per request)
-    add_tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-    
-    # Add tracks in batches of 100
-    for i in range(0, len(track_uris), 100):
-        batch = track_uris[i:i+100]
-        add_data = {'uris': batch}
-        
-        add_response = requests.post(add_tracks_url, headers=headers, json=add_data)
-        
-        if add_response.status_code not in [200, 201]:
-            # Playlist created but tracks not added - still return success with warning
-            return Response({
-                'success': True,
-                'warning': 'Playlist created but some tracks could not be added',
-                'playlist_id': playlist_id,
-                'playlist_url': playlist_url,
-                'tracks_added': i
-            })
+    top_artists = snapshots.top_artists(snapshot, start_date, end_date, limit)
+    artists = Artist.objects.in_bulk([row['artist_id'] for row in top_artists])
+    heatmap = snapshots.hourly_distribution(snapshot, start_date=start_date, end_date=end_date)
     
     return Response({
-        'success': True,
-        'playlist_id': playlist_id,
-        'playlist_url': playlist_url,
-        'playlist_name': playlist_name,
-        'tracks_added': len(track_uris)
+        'top_artists': [
+            {
+                'rank': idx,
+                'artist_name': artists[row['artist_id']].name,
+                'play_count': row['play_count'],
+                'total_hours_played': round(row['total_ms_played'] / (1000 * 60 * 60), 2)
+            }
+            for idx, row in enumerate(top_artists, start=1)
+        ],
+        # Rows are weekdays (Monday first), columns are hours of the day
+        'hours_by_weekday_and_hour': [
+            [round(ms / (1000 * 60 * 60), 2) for ms in row] for row in heatmap
+        ]
     })
 
 
+MONTH_NAMES = {
+    1: 'Styczeń', 2: 'Luty', 3: 'Marzec', 4: 'Kwiecień',
+    5: 'Maj', 6: 'Czerwiec', 7: 'Lipiec', 8: 'Sierpień',
+    9: 'Wrzesień', 10: 'Październik', 11: 'Listopad', 12: 'Grudzień'
+}
+
+LISTENING_GRANULARITIES = ('day', 'week', 'month', 'year')
+
+
+def format_period(period, granularity):
+    """
+    Return the (key, label) pair of a listening stats period start date
+    """
+    if granularity == 'year':
+        return period.strftime('%Y'), period.strftime('%Y')
+    if granularity == 'month':
+        return period.strftime('%Y-%m'), f'{MONTH_NAMES[period.month]} {period.year}'
+    if granularity == 'week':
+        return period.isoformat(), f'Tydzień od {period.strftime("%d.%m.%Y")}'
+    return period.isoformat(), period.strftime('%d.%m.%Y')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_monthly_listening_stats(request):
     """
-    Get monthly listening statistics showing total hours listened per month
+    Get listening statistics showing total hours listened per period
+    Query parameters:
+    - granularity: day, week, month (default) or year
+    - start_date: Start date in YYYY-MM-DD format
+    - end_date: End date in YYYY-MM-DD format
+    - tz: IANA time zone used for period boundaries (default TIME_ZONE)
     """
-    # Get all streaming history for the user
-    streaming_data = StreamingHistory.objects.filter(
-        user=request.user,
-        ts__isnull=False
-    ).values(
-        'ts', 'ms_played'
-    ).order_by('ts')
+    granularity = request.GET.get('granularity', 'month')
+    if granularity not in LISTENING_GRANULARITIES:
+        return Response(
+            {'error': f'Invalid granularity. Use one of: {", ".join(LISTENING_GRANULARITIES)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    if not streaming_data:
-        return Response([])
+    tz_name = request.GET.get('tz') or settings.TIME_ZONE
+    try:
+        tzinfo = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return Response(
+            {'error': 'Invalid tz. Use an IANA time zone name, e.g. Europe/Warsaw'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    # Group by year-month
-    from collections import defaultdict
-    monthly_stats = defaultdict(lambda: {'total_ms': 0, 'play_count': 0})
+    start_date = end_date = None
+    if request.GET.get('start_date'):
+        try:
+            start_date = datetime.strptime(request.GET['start_date'], '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {'error': 'Invalid start_date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
     
-    for record in streaming_data:
-        # Format: YYYY-MM
-        month_key = record['ts'].strftime('%Y-%m')
-        monthly_stats[month_key]['total_ms'] += record['ms_played']
-        monthly_stats[month_key]['play_count'] += 1
+    if request.GET.get('end_date'):
+        try:
+            end_date = datetime.strptime(request.GET['end_date'], '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {'error': 'Invalid end_date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    snapshot = snapshots.get_engine_snapshot(request.user)
+    if snapshot is not None:
+        # Vectorized bucketing of the memory-mapped snapshot, in any time zone
+        query = snapshots.listening_periods(snapshot, granularity, tzinfo, start_date, end_date)
+    elif tz_name == settings.TIME_ZONE:
+        # The daily rollup is bucketed in TIME_ZONE - sum its days per period
+        query = DailyTrackStats.objects.filter(user=request.user)
+        if start_date:
+            query = query.filter(day__gte=start_date)
+        if end_date:
+            query = query.filter(day__lte=end_date)
+        query = query.annotate(
+            period=Trunc('day', granularity, output_field=models.DateField())
+        ).values('period').annotate(
+            total_ms=models.Sum('ms_played'),
+            play_count=models.Sum('play_count')
+        )
+    else:
+        # Other time zones shift day boundaries - truncate the plays themselves
+        query = StreamingHistory.objects.filter(user=request.user)
+        if start_date:
+            query = query.filter(ts__gte=datetime.combine(start_date, time.min, tzinfo=tzinfo))
+        if end_date:
+            query = query.filter(
+                ts__lt=datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tzinfo)
+            )
+        query = query.annotate(
+            period=Trunc('ts', granularity, output_field=models.DateField(), tzinfo=tzinfo)
+        ).values('period').annotate(
+            total_ms=models.Sum('ms_played'),
+            play_count=models.Count('id')
+        )
     
     # Convert to list and calculate hours
+    if isinstance(query, models.QuerySet):
+        query = query.order_by('period')
     result = []
-    for month_key in sorted(monthly_stats.keys()):
-        stats = monthly_stats[month_key]
+    for stats in query:
+        key, label = format_period(stats['period'], granularity)
         total_hours = stats['total_ms'] / (1000 * 60 * 60)
-        
-        # Parse month for better display
-        year, month = month_key.split('-')
-        month_names = {
-            '01': 'Styczeń', '02': 'Luty', '03': 'Marzec', '04': 'Kwiecień',
-            '05': 'Maj', '06': 'Czerwiec', '07': 'Lipiec', '08': 'Sierpień',
-            '09': 'Wrzesień', '10': 'Październik', '11': 'Listopad', '12': 'Grudzień'
-        }
-        
-        result.append({
-            'month': month_key,
-            'month_label': f'{month_names[month]} {year}',
+        item = {
+            'period': key,
+            'label': label,
             'total_hours': round(total_hours, 2),
             'play_count': stats['play_count']
-        })
+        }
+        if granularity == 'month':
+            # Field names used before granularity was configurable
+            item['month'] = key
+            item['month_label'] = label
+        result.append(item)
     
     return Response(result)
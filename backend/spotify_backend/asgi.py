@@ -9,3 +9,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_backend.settings')
 
 application = get_asgi_application()
+
+# Start the local ingestion workers (INGESTION_QUEUE_BACKEND=thread), which
+# also pick up uploads left queued or processing by a previous process
+from data_upload.jobs import get_queue_backend  # noqa: E402
+
+get_queue_backend()
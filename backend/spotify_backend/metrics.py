@@ -0,0 +1,268 @@
+"""
+Request performance metrics: wall time, SQL query count and DB time per
+request, reported as Server-Timing headers and logs, and aggregated per
+route into Prometheus histograms served by /api/metrics.
+"""
+import json
+import heapq
+import logging
+import secrets
+import threading
+from time import perf_counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import URLPattern, URLResolver, get_resolver
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Route label of requests that matched no URL pattern
+UNMATCHED_ROUTE = '<unmatched>'
+
+# Cache alias of the shared counters (set by METRICS_CACHE_URL)
+METRICS_CACHE = 'metrics'
+
+# Cache backends whose incr() is not shared between processes or not atomic
+UNSHARED_CACHES = (LocMemCache, FileBasedCache, DatabaseCache)
+
+
+class QueryTracker:
+    """
+    Database execute wrapper counting queries and their time, keeping the
+    slowest ones
+    """
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []  # min-heap of (duration, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (duration, sql))
+            elif self.keep:
+                heapq.heappushpop(self.slowest, (duration, sql))
+
+    def slowest_queries(self):
+        return [
+            {'sql': sql, 'ms': round(duration * 1000, 2)}
+            for duration, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure each request: wall time, number of SQL queries and their total
+    time. Adds a Server-Timing header, logs the request (slow requests with
+    their slowest queries as warnings) and adds it to the route's metrics.
+    Queries run while a streaming response is consumed are not counted.
+    """
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS:
+            raise MiddlewareNotUsed
+        # Fail at startup rather than on the first request
+        get_counters()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tracker = QueryTracker(settings.PERFORMANCE_SLOW_QUERIES)
+        started = perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(tracker))
+            response = self.get_response(request)
+        duration = perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else UNMATCHED_ROUTE
+        response['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, '
+            f'db;dur={tracker.duration * 1000:.1f};desc="{tracker.count} queries"'
+        )
+        try:
+            record_request(route, duration, tracker.count, tracker.duration)
+        except Exception:
+            # An unreachable metrics cache must not fail the request
+            logger.warning('Could not record metrics of %s', route, exc_info=True)
+        log_request(request, response, route, duration, tracker)
+        return response
+
+
+def log_request(request, response, route, duration, tracker):
+    data = {
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'status': response.status_code,
+        'ms': round(duration * 1000, 1),
+        'queries': tracker.count,
+        'db_ms': round(tracker.duration * 1000, 1),
+    }
+    if duration * 1000 >= settings.PERFORMANCE_SLOW_REQUEST_MS:
+        data['slowest_queries'] = tracker.slowest_queries()
+        logger.warning('Slow request %s', json.dumps(data))
+    else:
+        logger.info('Request %s', json.dumps(data))
+
+
+class LocalCounters:
+    """
+    In-process counters with the incr() / get_many() interface of a cache
+    """
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def incr(self, key, delta=1):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + delta
+
+    def get_many(self, keys):
+        with self.lock:
+            return {key: self.values[key] for key in keys if key in self.values}
+
+
+_local_counters = LocalCounters()
+
+
+def get_counters():
+    """
+    Store of the request and statistics cache counters: the
+    METRICS_CACHE_URL cache when it is configured, otherwise counters of
+    this process only
+    """
+    if METRICS_CACHE not in settings.CACHES:
+        return _local_counters
+    cache = caches[METRICS_CACHE]
+    if isinstance(cache, UNSHARED_CACHES):
+        raise ImproperlyConfigured(
+            f'METRICS_CACHE_URL must point to a cache shared by all processes with atomic '
+            f'increments (Redis, Memcached), not {type(cache).__name__}'
+        )
+    return cache
+
+
+def _key(route, name):
+    return f'metrics:{route}:{name}'
+
+
+def increment_counter(key, delta=1):
+    """
+    Add to a counter in the store of get_counters()
+    """
+    counters = get_counters()
+    try:
+        counters.incr(key, delta)
+    except ValueError:
+        # Counter not created yet (or evicted)
+        counters.add(key, 0, timeout=None)
+        counters.incr(key, delta)
+
+
+def record_request(route, duration, queries, db_duration):
+    """
+    Add a request to the route's counters. Without METRICS_CACHE_URL the
+    counters belong to this process, so with several worker processes
+    /api/metrics only reports the one that served the scrape. The bucket
+    counters are not cumulative; durations are summed in microseconds, as
+    the cache only increments integers.
+    """
+    bucket = next(index for index, bound in enumerate(LATENCY_BUCKETS) if duration <= bound)
+    increment_counter(_key(route, f'bucket:{bucket}'))
+    increment_counter(_key(route, 'duration_us'), round(duration * 1e6))
+    if queries:
+        increment_counter(_key(route, 'queries'), queries)
+        increment_counter(_key(route, 'db_us'), round(db_duration * 1e6))
+
+
+def iter_routes(patterns=None, prefix=''):
+    """
+    Yield the route of every URL pattern, as in ResolverMatch.route
+    """
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from iter_routes(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern):
+            yield route
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def render_prometheus():
+    """
+    Render the per-route metrics in the Prometheus text exposition format
+    """
+    routes = list(dict.fromkeys(iter_routes())) + [UNMATCHED_ROUTE]
+    names = [f'bucket:{index}' for index in range(len(LATENCY_BUCKETS))] + ['duration_us', 'queries', 'db_us']
+    values = get_counters().get_many([_key(route, name) for route in routes for name in names])
+
+    latency = [
+        '# HELP http_request_duration_seconds Request wall time by route',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    queries = [
+        '# HELP http_request_db_queries_total SQL queries run by requests, by route',
+        '# TYPE http_request_db_queries_total counter',
+    ]
+    db_time = [
+        '# HELP http_request_db_seconds_total Time spent in SQL queries by route',
+        '# TYPE http_request_db_seconds_total counter',
+    ]
+    for route in routes:
+        counts = [values.get(_key(route, f'bucket:{index}'), 0) for index in range(len(LATENCY_BUCKETS))]
+        if not any(counts):
+            continue
+        label = f'route="{_label(route)}"'
+        duration = values.get(_key(route, 'duration_us'), 0) / 1e6
+        query_count = values.get(_key(route, 'queries'), 0)
+        db_duration = values.get(_key(route, 'db_us'), 0) / 1e6
+
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, counts):
+            cumulative += count
+            latency.append(
+                f'http_request_duration_seconds_bucket{{{label},le="{_format_bound(bound)}"}} {cumulative}'
+            )
+        latency.append(f'http_request_duration_seconds_sum{{{label}}} {duration}')
+        latency.append(f'http_request_duration_seconds_count{{{label}}} {cumulative}')
+        queries.append(f'http_request_db_queries_total{{{label}}} {query_count}')
+        db_time.append(f'http_request_db_seconds_total{{{label}}} {db_duration}')
+
+    return '\n'.join(latency + queries + db_time) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics. Available to staff users and to scrapers sending
+    `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    authorized = bool(token) and secrets.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    if not authorized and not request.user.is_staff:
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
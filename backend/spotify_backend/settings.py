@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so the measured time covers the other middleware too
+    'spotify_backend.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -85,6 +87,27 @@ DATABASES = {
     }
 }
 
+# Cache (statistics results)
+# e.g. locmemcache:// (default), filecache:///var/tmp/spotify_cache, rediscache://redis:6379/1
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+# Seconds a cached statistics result is kept (entries are also invalidated on upload/delete)
+STATS_CACHE_TIMEOUT = env.int('STATS_CACHE_TIMEOUT', default=3600)
+
+# Request metrics: Server-Timing headers, request logs and /api/metrics
+PERFORMANCE_METRICS = env.bool('PERFORMANCE_METRICS', default=True)
+# Request and statistics cache counters are kept per process unless they go to a shared
+# cache with atomic increments, e.g. rediscache://redis:6379/2 (required to aggregate
+# several workers)
+if env('METRICS_CACHE_URL', default=''):
+    CACHES['metrics'] = env.cache('METRICS_CACHE_URL')
+# Requests slower than this are logged as warnings with their slowest queries
+PERFORMANCE_SLOW_REQUEST_MS = env.int('PERFORMANCE_SLOW_REQUEST_MS', default=500)
+PERFORMANCE_SLOW_QUERIES = env.int('PERFORMANCE_SLOW_QUERIES', default=3)
+# Bearer token for Prometheus scrapers (staff users can always read /api/metrics)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -200,9 +223,61 @@ SPECTACULAR_SETTINGS = {
 # File upload settings
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
+# Largest chunk of a resumable upload (PUT /api/upload/chunked/<id>/), streamed to disk
+UPLOAD_CHUNK_SIZE = env.int('UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024)
+# Parse chunked ZIP uploads while they arrive. A follower thread (outside the
+# queue workers, at most STREAMING_INGESTION_FOLLOWERS per process) follows the
+# upload and hands it back if no chunk arrives for STREAMING_INGESTION_TIMEOUT
+# seconds. Finished uploads are processed by the queue workers. Not on SQLite.
+STREAMING_INGESTION = env.bool('STREAMING_INGESTION', default=True)
+STREAMING_INGESTION_FOLLOWERS = env.int('STREAMING_INGESTION_FOLLOWERS', default=4)
+STREAMING_INGESTION_TIMEOUT = env.int('STREAMING_INGESTION_TIMEOUT', default=300)
+STREAMING_INGESTION_POLL_INTERVAL = env.float('STREAMING_INGESTION_POLL_INTERVAL', default=0.5)
+# Chunked uploads that receive no data for this many seconds are deleted with
+# their .part file and the plays ingested from them
+CHUNKED_UPLOAD_EXPIRY = env.int('CHUNKED_UPLOAD_EXPIRY', default=24 * 60 * 60)
+# Allow uploads to request a cProfile capture of their processing (`profile` field)
+INGESTION_PROFILING = env.bool('INGESTION_PROFILING', default=False)
+
+# Streaming history ingestion
+INGESTION_BATCH_SIZE = env.int('INGESTION_BATCH_SIZE', default=1000)  # records per bulk insert
+# Load rows with COPY FROM STDIN on PostgreSQL (the ORM path is used on other databases)
+INGESTION_COPY_LOADER = env.bool('INGESTION_COPY_LOADER', default=True)
+# 'thread' processes uploads in a local thread pool, 'database' leaves them
+# queued for `python manage.py run_ingestion_worker`
+INGESTION_QUEUE_BACKEND = env('INGESTION_QUEUE_BACKEND', default='thread')
+INGESTION_QUEUE_WORKERS = env.int('INGESTION_QUEUE_WORKERS', default=2)
+INGESTION_QUEUE_POLL_INTERVAL = env.float('INGESTION_QUEUE_POLL_INTERVAL', default=5.0)
+# Uploads 'processing' without a heartbeat for this many seconds (e.g. after a
+# restart of the process running them) are queued again
+INGESTION_STALE_TIMEOUT = env.int('INGESTION_STALE_TIMEOUT', default=600)
+# Worker processes used to ingest the files of one export in parallel (PostgreSQL only)
+INGESTION_FILE_WORKERS = env.int('INGESTION_FILE_WORKERS', default=1)
+# Rows removed per DELETE statement when a user deletes their data
+DELETE_CHUNK_SIZE = env.int('DELETE_CHUNK_SIZE', default=10000)
+# Rows per Parquet row group in history exports
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=50000)
+
+# Analytics engine for top tracks and listening stats: 'database' (daily rollup)
+# or 'snapshot' (memory-mapped per-user NumPy snapshots, requires numpy)
+ANALYTICS_ENGINE = env('ANALYTICS_ENGINE', default='database')
+SNAPSHOT_DIR = env('SNAPSHOT_DIR', default=os.path.join(BASE_DIR, 'snapshots'))
 
 # Spotify API settings
 SPOTIFY_CLIENT_ID = env('SPOTIFY_CLIENT_ID', default='')
 SPOTIFY_CLIENT_SECRET = env('SPOTIFY_CLIENT_SECRET', default='')
 SPOTIFY_REDIRECT_URI = env('SPOTIFY_REDIRECT_URI', default='http://127.0.0.1:8000/api/auth/spotify/callback/')
 SPOTIFY_SCOPES = 'playlist-modify-public playlist-modify-private user-read-private user-read-email'
+# Base URLs can point to a local stub server in development
+SPOTIFY_API_URL = env('SPOTIFY_API_URL', default='https://api.spotify.com/v1')
+SPOTIFY_ACCOUNTS_URL = env('SPOTIFY_ACCOUNTS_URL', default='https://accounts.spotify.com')
+SPOTIFY_TIMEOUT = env.float('SPOTIFY_TIMEOUT', default=10)  # seconds per HTTP request
+SPOTIFY_POOL_SIZE = env.int('SPOTIFY_POOL_SIZE', default=10)  # pooled connections per host
+# Retries of 429/5xx responses; a Retry-After longer than the maximum is not waited for
+SPOTIFY_MAX_RETRIES = env.int('SPOTIFY_MAX_RETRIES', default=3)
+SPOTIFY_RETRY_BACKOFF = env.float('SPOTIFY_RETRY_BACKOFF', default=0.5)  # first backoff in seconds, doubled per retry
+SPOTIFY_MAX_RETRY_AFTER = env.float('SPOTIFY_MAX_RETRY_AFTER', default=30)
+# Access tokens are refreshed this many seconds before they expire
+SPOTIFY_TOKEN_REFRESH_MARGIN = env.int('SPOTIFY_TOKEN_REFRESH_MARGIN', default=300)
+# Largest playlist created from top tracks (Spotify's limit per playlist)
+PLAYLIST_MAX_TRACKS = env.int('PLAYLIST_MAX_TRACKS', default=10000)
@@ -5,6 +5,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from .metrics import metrics_view
 
 
 def api_root(request):
@@ -16,6 +17,7 @@ def api_root(request):
             'upload': '/api/upload/',
             'docs': '/api/docs/',
             'schema': '/api/schema/',
+            'metrics': '/api/metrics',
         }
     })
 
@@ -28,6 +30,7 @@ urlpatterns = [
     # API endpoints
     path('api/auth/', include('authentication.urls')),
     path('api/upload/', include('data_upload.urls')),
+    path('api/metrics', metrics_view, name='metrics'),
     
     # API documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
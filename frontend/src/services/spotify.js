@@ -18,8 +18,9 @@ export const spotifyService = {
     return response.data
   },
 
-  async createPlaylist() {
-    const response = await api.post('/upload/create-playlist/')
+  // options: start_date, end_date, limit, or export_id to resume a failed export
+  async createPlaylist(options = {}) {
+    const response = await api.post('/upload/create-playlist/', options)
     return response.data
   }
 }
@@ -1,9 +1,24 @@
 import api from './api'
 
+// Failed chunks are retried this many times (with backoff) before giving up
+const CHUNK_RETRIES = 5
+
+function resumeKey(file) {
+  return `chunked-upload:${file.name}:${file.size}:${file.lastModified}`
+}
+
+async function sha256Hex(blob) {
+  // SubtleCrypto is only available in secure contexts (HTTPS or localhost)
+  if (!window.crypto?.subtle) return null
+  const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer())
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('')
+}
+
 export const uploadService = {
-  async uploadSpotifyData(file, onUploadProgress) {
+  async uploadSpotifyData(file, onUploadProgress, incremental = false) {
     const formData = new FormData()
     formData.append('file', file)
+    formData.append('incremental', incremental ? 'true' : 'false')
     
     const response = await api.post('/upload/', formData, {
       headers: {
@@ -14,11 +29,86 @@ export const uploadService = {
     return response.data
   },
 
+  // Resumable upload in chunks - an interrupted upload of the same file
+  // continues from the last stored byte, also after a page reload
+  async uploadSpotifyDataChunked(file, onUploadProgress, incremental = false) {
+    const key = resumeKey(file)
+    let upload = null
+    
+    const savedId = localStorage.getItem(key)
+    if (savedId) {
+      try {
+        const response = await api.get(`/upload/chunked/${savedId}/`)
+        // A ZIP may already be queued or processing while its chunks arrive
+        if (response.data.is_receiving) upload = response.data
+      } catch (error) {
+        // Unknown upload - start over
+      }
+    }
+    if (!upload) {
+      const response = await api.post('/upload/chunked/', {
+        filename: file.name,
+        size: file.size,
+        incremental
+      })
+      upload = response.data
+      localStorage.setItem(key, upload.upload_id)
+    }
+    
+    const url = `/upload/chunked/${upload.upload_id}/`
+    let offset = upload.offset
+    let failures = 0
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + upload.chunk_size)
+      const chunkOffset = offset
+      try {
+        const headers = { 'Content-Type': 'application/octet-stream' }
+        const checksum = await sha256Hex(chunk)
+        if (checksum) headers['X-Content-SHA256'] = checksum
+        
+        const response = await api.put(url, chunk, {
+          params: { offset },
+          headers,
+          onUploadProgress: (event) => onUploadProgress?.({
+            loaded: chunkOffset + event.loaded,
+            total: file.size
+          })
+        })
+        offset = response.data.offset
+        failures = 0
+      } catch (error) {
+        const status = error.response?.status
+        if (status === 409) {
+          offset = error.response.data.offset
+          continue
+        }
+        if ((status && status < 500) || ++failures > CHUNK_RETRIES) throw error
+        
+        await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** failures))
+        // Part of the chunk may have arrived before the failure
+        try {
+          offset = (await api.get(url)).data.offset
+        } catch (statusError) {
+          // Retry from the same offset
+        }
+      }
+    }
+    
+    const response = await api.post(`${url}complete/`)
+    localStorage.removeItem(key)
+    return response.data
+  },
+
   async getUploads() {
     const response = await api.get('/upload/list/')
     return response.data
   },
 
+  async getUploadStatus(uploadId) {
+    const response = await api.get(`/upload/status/${uploadId}/`)
+    return response.data
+  },
+
   async getStats() {
     const response = await api.get('/upload/stats/')
     return response.data
@@ -42,8 +132,12 @@ export const uploadService = {
     return response.data
   },
 
-  async getMonthlyStats() {
-    const response = await api.get('/upload/monthly-stats/')
+  async getMonthlyStats(granularity = 'month', startDate = '', endDate = '') {
+    const params = { granularity }
+    if (startDate) params.start_date = startDate
+    if (endDate) params.end_date = endDate
+    
+    const response = await api.get('/upload/monthly-stats/', { params })
     return response.data
   },
 